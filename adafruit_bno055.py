@@ -36,16 +36,39 @@ from adafruit_bus_device.i2c_device import I2CDevice
 from adafruit_register.i2c_struct import Struct, UnaryStruct
 
 try:
-    from typing import Any, Optional, Tuple, Type, Union
+    from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple, Type, Union
     from busio import I2C, UART
 except ImportError:
     pass
 
+try:
+    # Only for BNO055_I2CDev on Linux; CircuitPython has neither
+    import ctypes
+    import fcntl
+    import os
+
+    class _I2CMsg(ctypes.Structure):  # struct i2c_msg from <linux/i2c.h>
+        _fields_ = [
+            ("addr", ctypes.c_uint16),
+            ("flags", ctypes.c_uint16),
+            ("len", ctypes.c_uint16),
+            ("buf", ctypes.POINTER(ctypes.c_uint8)),
+        ]
+
+    class _I2CRdwrData(ctypes.Structure):  # struct i2c_rdwr_ioctl_data
+        _fields_ = [("msgs", ctypes.POINTER(_I2CMsg)), ("nmsgs", ctypes.c_uint32)]
+
+except ImportError:
+    pass
+
 __version__ = "0.0.0+auto.0"
 __repo__ = "https://github.com/adafruit/Adafruit_CircuitPython_BNO055.git"
 
 _CHIP_ID = const(0xA0)
 
+_I2C_RDWR = const(0x0707)  # ioctl request, <linux/i2c-dev.h>
+_I2C_M_RD = const(0x0001)
+
 CONFIG_MODE = const(0x00)
 ACCONLY_MODE = const(0x01)
 MAGONLY_MODE = const(0x02)
@@ -131,6 +154,7 @@ _OFFSET_MAGNET_REGISTER = const(0x5B)
 _OFFSET_GYRO_REGISTER = const(0x61)
 _RADIUS_ACCEL_REGISTER = const(0x67)
 _RADIUS_MAGNET_REGISTER = const(0x69)
+CALIBRATION_PROFILE_LENGTH = const(22)  # Offsets and radii, registers 0x55-0x6A
 _TRIGGER_REGISTER = const(0x3F)
 _POWER_REGISTER = const(0x3E)
 _ID_REGISTER = const(0x00)
@@ -143,6 +167,49 @@ AXIS_REMAP_Z = const(0x02)
 AXIS_REMAP_POSITIVE = const(0x00)
 AXIS_REMAP_NEGATIVE = const(0x01)
 
+_NON_FUSION_MODES = (0x00, 0x01, 0x02, 0x03, 0x04, 0x05, 0x06, 0x07)
+
+# Output data registers on page 0, all within 0x08-0x34:
+# name -> (register address, struct format, scale, modes in which the channel is off)
+CHANNELS = {
+    "acceleration": (0x08, "<hhh", 1 / 100, (0x00, 0x02, 0x03, 0x06)),
+    "magnetic": (0x0E, "<hhh", 1 / 16, (0x00, 0x01, 0x03, 0x05, 0x08)),
+    "gyro": (0x14, "<hhh", 0.001090830782496456, (0x00, 0x01, 0x02, 0x04, 0x09, 0x0A)),
+    "euler": (0x1A, "<hhh", 1 / 16, _NON_FUSION_MODES),
+    "quaternion": (0x20, "<hhhh", 1 / (1 << 14), _NON_FUSION_MODES),
+    "linear_acceleration": (0x28, "<hhh", 1 / 100, _NON_FUSION_MODES),
+    "gravity": (0x2E, "<hhh", 1 / 100, _NON_FUSION_MODES),
+    "temperature": (0x34, "b", 1, ()),
+}
+
+
+def plan_bursts(
+    channels: Sequence[str], max_gap: int = 8
+) -> List[Tuple[int, int, Tuple[str, ...]]]:
+    """Compute the fewest contiguous register reads that cover the given channels.
+
+    Channels closer than ``max_gap`` unused bytes apart share one burst: on I2C
+    a few extra bytes cost less than the address, register and restart of
+    another transaction. With ``max_gap=0`` only adjacent channels are merged.
+
+    :param channels: names from :data:`CHANNELS`, e.g. ``("gyro", "acceleration")``
+    :param int max_gap: largest run of unused registers read to join two channels
+    :return: list of ``(start register, length, channel names)`` in register order
+    """
+    for name in channels:
+        if name not in CHANNELS:
+            raise ValueError(f"unknown channel '{name}'")
+    bursts = []
+    for name in sorted(set(channels), key=lambda name: CHANNELS[name][0]):
+        address = CHANNELS[name][0]
+        end = address + struct.calcsize(CHANNELS[name][1])
+        if bursts and address - (bursts[-1][0] + bursts[-1][1]) <= max_gap:
+            start, _, names = bursts[-1]
+            bursts[-1] = (start, end - start, names + (name,))
+        else:
+            bursts.append((address, end - address, (name,)))
+    return bursts
+
 
 class _ScaledReadOnlyStruct(Struct):  # pylint: disable=too-few-public-methods
     def __init__(self, register_address: int, struct_format: str, scale: float) -> None:
@@ -221,6 +288,12 @@ class BNO055:  # pylint: disable=too-many-public-methods
     """
 
     def __init__(self) -> None:
+        self._burst_plans = {}
+        # Driver-side copies of the operating and power mode (None = unknown)
+        self._mode = None
+        self._power_mode = None
+        self._resume_mode = None  # Operating mode to return to after suspend()
+        self.verify_mode_cache = False
         chip_id = self._read_register(_ID_REGISTER)
         if chip_id != _CHIP_ID:
             raise RuntimeError(f"bad chip id ({chip_id:#x} != {_CHIP_ID:#x})")
@@ -242,9 +315,16 @@ class BNO055:  # pylint: disable=too-many-public-methods
             self._write_register(_TRIGGER_REGISTER, 0x20)
         except OSError:  # error due to the chip resetting
             pass
+        self.invalidate_mode_cache()
         # wait for the chip to reset (650 ms typ.)
         time.sleep(0.7)
 
+    def invalidate_mode_cache(self) -> None:
+        """Forget the cached operating and power mode, e.g. after another
+        program changed them; the next access reads them from the sensor."""
+        self._mode = None
+        self._power_mode = None
+
     @property
     def mode(self) -> int:
         """
@@ -352,16 +432,37 @@ class BNO055:  # pylint: disable=too-many-public-methods
            This is a fusion mode with 9 degrees of freedom where the fused absolute orientation data
            is calculated from accelerometer, gyroscope and the magnetometer.
 
+        The driver caches the mode, so reading it costs no bus access and setting
+        the mode the sensor is already in is skipped, including the transition
+        delays. The cache is dropped on reset and when a mode change fails. Set
+        ``sensor.verify_mode_cache = True`` while debugging to compare it with
+        the sensor on every access (a mismatch raises :class:`RuntimeError`).
+
         """
-        return self._read_register(_MODE_REGISTER) & 0b00001111  # Datasheet Table 4-2
+        if self._mode is None or self.verify_mode_cache:
+            mode = self._read_register(_MODE_REGISTER) & 0b00001111  # Datasheet Table 4-2
+            self._check_mode_cache("operating", self._mode, mode)
+            self._mode = mode
+        return self._mode
 
     @mode.setter
     def mode(self, new_mode: int) -> None:
+        if new_mode == (self.mode if self.verify_mode_cache else self._mode):
+            return
+        self._mode = None  # Unknown until the transition has completed
         self._write_register(_MODE_REGISTER, CONFIG_MODE)  # Empirically necessary
         time.sleep(0.02)  # Datasheet table 3.6
         if new_mode != CONFIG_MODE:
             self._write_register(_MODE_REGISTER, new_mode)
             time.sleep(0.01)  # Table 3.6
+        self._mode = new_mode
+
+    def _check_mode_cache(self, name: str, cached: Optional[int], actual: int) -> None:
+        if self.verify_mode_cache and cached is not None and cached != actual:
+            self.invalidate_mode_cache()
+            raise RuntimeError(
+                f"Cached {name} mode {cached:#x} does not match the sensor ({actual:#x})"
+            )
 
     @property
     def calibration_status(self) -> Tuple[int, int, int, int]:
@@ -379,6 +480,39 @@ class BNO055:  # pylint: disable=too-many-public-methods
         sys, gyro, accel, mag = self.calibration_status
         return sys == gyro == accel == mag == 0x03
 
+    @property
+    def calibration_profile(self) -> bytes:
+        """All calibration offsets and radii as one block of
+        :data:`CALIBRATION_PROFILE_LENGTH` bytes (registers 0x55-0x6A, in register
+        order: accelerometer, magnetometer and gyroscope offsets, then the
+        accelerometer and magnetometer radii).
+
+        Reading or writing the block switches to CONFIG_MODE once, instead of
+        once per field as the ``offsets_*`` and ``radius_*`` properties do. Save
+        it once :attr:`calibrated` is true and write it back after power-up so
+        fusion starts from a calibrated state:
+
+        .. code-block:: python
+
+            profile = sensor.calibration_profile
+            ...
+            sensor.calibration_profile = profile
+        """
+        last_mode = self.mode
+        self.mode = CONFIG_MODE
+        data = bytes(self._read_registers(_OFFSET_ACCEL_REGISTER, CALIBRATION_PROFILE_LENGTH))
+        self.mode = last_mode
+        return data
+
+    @calibration_profile.setter
+    def calibration_profile(self, data: bytes) -> None:
+        if len(data) != CALIBRATION_PROFILE_LENGTH:
+            raise ValueError(f"Calibration profile must be {CALIBRATION_PROFILE_LENGTH} bytes")
+        last_mode = self.mode
+        self.mode = CONFIG_MODE
+        self._write_registers(_OFFSET_ACCEL_REGISTER, bytes(data))
+        self.mode = last_mode
+
     @property
     def external_crystal(self) -> bool:
         """Switches the use of external crystal on or off."""
@@ -704,9 +838,54 @@ class BNO055:  # pylint: disable=too-many-public-methods
         self._write_register(_MAGNET_CONFIG_REGISTER, masked_value | mode)
         self._write_register(_PAGE_REGISTER, 0x00)
 
+    def read_channels(
+        self, channels: Sequence[str], max_gap: int = 8
+    ) -> Dict[str, Union[int, Tuple[Optional[float], ...]]]:
+        """Read several output channels in as few register bursts as possible.
+
+        All values come from the same moment (up to the length of the bursts),
+        unlike reading the properties one after the other, which also costs a
+        mode read per property. Channels disabled by the current mode are
+        returned as tuples of ``None`` like the properties do.
+
+        .. code-block:: python
+
+            values = sensor.read_channels(("gyro", "acceleration", "magnetic", "euler"))
+            print(values["euler"])
+
+        :param channels: names from :data:`CHANNELS`
+        :param int max_gap: see :func:`plan_bursts`
+        :return: dictionary of channel name to scaled value(s)
+        """
+        key = (tuple(channels), max_gap)
+        plan = self._burst_plans.get(key)
+        if plan is None:
+            plan = self._burst_plans[key] = plan_bursts(channels, max_gap)
+
+        mode = self.mode
+        values = {}
+        for start, length, names in plan:
+            enabled = [name for name in names if mode not in CHANNELS[name][3]]
+            if enabled:
+                data = self._read_registers(start, length)
+            for name in names:
+                address, fmt, scale, off_modes = CHANNELS[name]
+                if mode in off_modes:
+                    values[name] = (None,) * len(fmt.lstrip("<"))
+                    continue
+                raw = struct.unpack_from(fmt, data, address - start)
+                values[name] = raw[0] if len(raw) == 1 else tuple(scale * v for v in raw)
+        return values
+
+    def _read_registers(self, register: int, length: int) -> bytes:
+        raise NotImplementedError("Must be implemented.")
+
     def _write_register(self, register: int, value: int) -> None:
         raise NotImplementedError("Must be implemented.")
 
+    def _write_registers(self, register: int, data: bytes) -> None:
+        raise NotImplementedError("Must be implemented.")
+
     def _read_register(self, register: int) -> None:
         raise NotImplementedError("Must be implemented.")
 
@@ -759,7 +938,7 @@ class BNO055:  # pylint: disable=too-many-public-methods
         """
         x, y, z, x_sign, y_sign, z_sign = remap
         # Switch to configuration mode. Necessary to remap axes
-        current_mode = self._read_register(_MODE_REGISTER)
+        current_mode = self.mode
         self.mode = CONFIG_MODE
         # Set the axis remap register value.
         map_config = 0x00
@@ -774,15 +953,45 @@ class BNO055:  # pylint: disable=too-many-public-methods
         sign_config |= z_sign & 0x01
         self._write_register(_AXIS_MAP_SIGN_REGISTER, sign_config)
         # Go back to normal operation mode.
-        self._write_register(_MODE_REGISTER, current_mode)
+        self.mode = current_mode
 
     def set_normal_mode(self) -> None:
         """Sets the sensor to Normal power mode"""
-        self._write_register(_POWER_REGISTER, _POWER_NORMAL)
+        self._set_power_mode(_POWER_NORMAL)
 
     def set_suspend_mode(self) -> None:
         """Sets the sensor to Suspend power mode"""
-        self._write_register(_POWER_REGISTER, _POWER_SUSPEND)
+        self._set_power_mode(_POWER_SUSPEND)
+
+    def suspend(self) -> None:
+        """Suspend all sensors to save power until :meth:`resume` is called.
+
+        The power mode is changed in CONFIG_MODE, as in Bosch's sensor API; the
+        operating mode in use is remembered for :meth:`resume`.
+        """
+        if self._resume_mode is None:
+            self._resume_mode = self.mode
+        self.mode = CONFIG_MODE
+        self.set_suspend_mode()
+
+    def resume(self) -> None:
+        """Return from :meth:`suspend` to Normal power mode and the previous
+        operating mode. Fusion outputs need a short time to settle afterwards."""
+        self.set_normal_mode()
+        if self._resume_mode is not None:
+            self.mode = self._resume_mode
+            self._resume_mode = None
+
+    def _set_power_mode(self, power_mode: int) -> None:
+        if self.verify_mode_cache:
+            actual = self._read_register(_POWER_REGISTER) & 0x03
+            self._check_mode_cache("power", self._power_mode, actual)
+            self._power_mode = actual
+        if power_mode == self._power_mode:
+            return
+        self._power_mode = None  # Unknown until the write has succeeded
+        self._write_register(_POWER_REGISTER, power_mode)
+        self._power_mode = power_mode
 
 
 class BNO055_I2C(BNO055):
@@ -822,12 +1031,176 @@ class BNO055_I2C(BNO055):
         with self.i2c_device as i2c:
             i2c.write(self.buffer)
 
+    def _write_registers(self, register: int, data: bytes) -> None:
+        with self.i2c_device as i2c:
+            i2c.write(bytes([register]) + data)
+
     def _read_register(self, register: int) -> int:
         self.buffer[0] = register
         with self.i2c_device as i2c:
             i2c.write_then_readinto(self.buffer, self.buffer, out_end=1, in_start=1)
         return self.buffer[1]
 
+    def _read_registers(self, register: int, length: int) -> bytes:
+        self.buffer[0] = register
+        data = bytearray(length)
+        with self.i2c_device as i2c:
+            i2c.write_then_readinto(self.buffer, data, out_end=1)
+        return data
+
+
+class I2CDevDevice:
+    """
+    I2C device on a Linux ``/dev/i2c-N`` adapter, accessed with ``I2C_RDWR`` ioctls.
+
+    Offers the interface of :class:`adafruit_bus_device.i2c_device.I2CDevice`
+    without Blinka: every transfer is one ioctl, and a register read is a single
+    combined write+read (repeated start) into preallocated buffers. The kernel
+    serializes transfers on the adapter, so no bus lock is taken.
+
+    :param int bus: number N of ``/dev/i2c-N``
+    :param int address: I2C address of the device
+    :param int fd: open file descriptor of the adapter to use instead of opening
+        ``/dev/i2c-N``, e.g. a fake in tests
+    :param ioctl: replacement for :func:`fcntl.ioctl`, called as
+        ``ioctl(fd, request, rdwr_data)``
+    :param int max_length: largest transfer in bytes
+    """
+
+    def __init__(
+        self,
+        bus: int = 1,
+        address: int = 0x28,
+        fd: Optional[int] = None,
+        ioctl: Optional[Callable] = None,
+        max_length: int = 128,
+    ) -> None:
+        self.address = address
+        self.max_length = max_length
+        self._owns_fd = fd is None
+        self.fd = os.open(f"/dev/i2c-{bus}", os.O_RDWR) if fd is None else fd
+        self._ioctl = ioctl or fcntl.ioctl
+
+        self._out = (ctypes.c_uint8 * max_length)()
+        self._in = (ctypes.c_uint8 * max_length)()
+        self._out_view = memoryview(self._out).cast("B")
+        self._in_view = memoryview(self._in).cast("B")
+        self._msgs = (_I2CMsg * 2)()
+        self._msgs[0].addr = self._msgs[1].addr = address
+        self._msgs[0].buf = ctypes.cast(self._out, ctypes.POINTER(ctypes.c_uint8))
+        self._msgs[1].flags = _I2C_M_RD
+        self._msgs[1].buf = ctypes.cast(self._in, ctypes.POINTER(ctypes.c_uint8))
+        first = ctypes.cast(self._msgs, ctypes.POINTER(_I2CMsg))
+        second = ctypes.cast(
+            ctypes.addressof(self._msgs) + ctypes.sizeof(_I2CMsg),
+            ctypes.POINTER(_I2CMsg),
+        )
+        # Write, read, and combined write+read transfers
+        self._write_data = _I2CRdwrData(first, 1)
+        self._read_data = _I2CRdwrData(second, 1)
+        self._write_read_data = _I2CRdwrData(first, 2)
+
+    def __enter__(self) -> "I2CDevDevice":
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_val: Optional[BaseException],
+        exc_tb: Optional[Any],
+    ) -> bool:
+        return False
+
+    def close(self) -> None:
+        """Close the adapter unless its file descriptor was passed in."""
+        if self._owns_fd and self.fd is not None:
+            os.close(self.fd)
+        self.fd = None
+
+    def _check_length(self, length: int) -> int:
+        if length > self.max_length:
+            raise ValueError(f"Transfer of {length} bytes exceeds {self.max_length}")
+        return length
+
+    def write(self, buf: bytes, *, start: int = 0, end: Optional[int] = None) -> None:
+        """Write ``buf[start:end]`` to the device."""
+        end = len(buf) if end is None else end
+        length = self._check_length(end - start)
+        self._out_view[:length] = buf[start:end]
+        self._msgs[0].len = length
+        self._ioctl(self.fd, _I2C_RDWR, self._write_data)
+
+    def readinto(self, buf: bytearray, *, start: int = 0, end: Optional[int] = None) -> None:
+        """Read into ``buf[start:end]`` from the device."""
+        end = len(buf) if end is None else end
+        length = self._check_length(end - start)
+        self._msgs[1].len = length
+        self._ioctl(self.fd, _I2C_RDWR, self._read_data)
+        buf[start:end] = self._in_view[:length]
+
+    def write_then_readinto(
+        self,
+        out_buffer: bytes,
+        in_buffer: bytearray,
+        *,
+        out_start: int = 0,
+        out_end: Optional[int] = None,
+        in_start: int = 0,
+        in_end: Optional[int] = None,
+    ) -> None:
+        """Write ``out_buffer[out_start:out_end]``, then read into
+        ``in_buffer[in_start:in_end]`` in one combined transfer."""
+        out_end = len(out_buffer) if out_end is None else out_end
+        in_end = len(in_buffer) if in_end is None else in_end
+        out_length = self._check_length(out_end - out_start)
+        in_length = self._check_length(in_end - in_start)
+        self._out_view[:out_length] = out_buffer[out_start:out_end]
+        self._msgs[0].len = out_length
+        self._msgs[1].len = in_length
+        self._ioctl(self.fd, _I2C_RDWR, self._write_read_data)
+        in_buffer[in_start:in_end] = self._in_view[:in_length]
+
+    def read_registers(self, register: int, length: int) -> bytes:
+        """Read ``length`` consecutive registers starting at ``register``."""
+        self._msgs[1].len = self._check_length(length)
+        self._out[0] = register
+        self._msgs[0].len = 1
+        self._ioctl(self.fd, _I2C_RDWR, self._write_read_data)
+        return bytes(self._in_view[:length])
+
+
+class BNO055_I2CDev(BNO055_I2C):
+    """
+    Driver for the BNO055 9DOF IMU sensor via Linux i2c-dev, bypassing Blinka.
+
+    Behaves like :class:`BNO055_I2C` but talks to ``/dev/i2c-N`` through
+    :class:`I2CDevDevice`, which saves the bus locking and layers of the
+    ``busio`` path on every register access. Linux only.
+
+    .. code-block:: python
+
+        sensor = adafruit_bno055.BNO055_I2CDev(bus=1)
+
+    :param int bus: number N of ``/dev/i2c-N`` (1 on a Raspberry Pi)
+    :param int address: I2C address of the sensor
+    :param int fd: see :class:`I2CDevDevice`
+    :param ioctl: see :class:`I2CDevDevice`
+    """
+
+    def __init__(  # pylint: disable=super-init-not-called
+        self,
+        bus: int = 1,
+        address: int = 0x28,
+        fd: Optional[int] = None,
+        ioctl: Optional[Callable] = None,
+    ) -> None:
+        self.buffer = bytearray(2)
+        self.i2c_device = I2CDevDevice(bus, address, fd=fd, ioctl=ioctl)
+        BNO055.__init__(self)  # pylint: disable=non-parent-init-called
+
+    def _read_registers(self, register: int, length: int) -> bytes:
+        return self.i2c_device.read_registers(register, length)
+
 
 class BNO055_UART(BNO055):
     """
@@ -875,6 +1248,14 @@ class BNO055_UART(BNO055):
             return resp[2:]
         return int(resp[2])
 
+    def _read_registers(self, register: int, length: int) -> bytes:
+        if length == 1:
+            return bytes([self._read_register(register)])
+        return self._read_register(register, length)
+
+    def _write_registers(self, register: int, data: bytes) -> None:
+        self._write_register(register, data)
+
     @property
     def _temperature(self) -> int:
         return self._read_register(0x34)
@@ -0,0 +1,358 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Convert whole recording archives in parallel.
+
+Finds the recordings (.csv, .bin, .rec) under the input directories, converts
+each stale one in a process pool sized to the CPU count and writes the results
+to the same relative path under the output directory. Files are streamed in
+chunks (recording_reader.iter_records), so memory stays bounded for any file
+size. Every record can be re-scaled, resampled and extended with derived
+columns on the way:
+
+    --format binary|csv        output format (.bin memory-mappable, or .csv)
+    --offset CH=X,Y,Z          subtract per-axis offsets from gyro, accel or mag
+    --scale CH=X,Y,Z           then multiply by per-axis factors (calibration fix)
+    --resample RATE            linearly interpolate onto a uniform RATE Hz grid
+    --derive magnitude         add |gyro|, |accel| and |mag| columns (CSV only)
+
+A manifest in the output directory records each input's size, mtime (with
+--hash, content hash) and the options it was converted with. Inputs whose size and mtime (or,
+with --hash, content) match and whose output exists are skipped, so re-running
+the same export only converts new or changed recordings.
+
+Usage: python batch_convert.py [--output DIR] [--workers N] [--hash] [--force]
+           [--format binary|csv] [--offset CH=X,Y,Z] [--scale CH=X,Y,Z]
+           [--resample RATE] [--derive magnitude] [DIRECTORY ...]
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+
+import recording_reader
+from channel_columns import DEFAULT_CHANNELS, csv_header
+from csv_emitter import CsvEmitter
+
+RECORDING_EXTENSIONS = ('.bin', '.rec', '.csv')  # Preferred first when a recording has several
+# Files other tools write next to recordings
+DERIVED_SUFFIXES = ('_orientation.csv', '_fused.csv', '_bursts.csv')
+MANIFEST_NAME = '.batch_manifest.json'
+HASH_CHUNK = 1 << 20
+
+DERIVED_COLUMNS = {
+    'magnitude': ["Gyroscope magnitude", "Accelerometer magnitude", "Magnetometer magnitude"],
+}
+CHANNEL_FIELDS = {'gyro': 'gyro', 'accel': 'accel', 'mag': 'mag'}
+
+
+def discover(directories, exclude=None):
+    """Recording paths under the given directories, sorted, skipping `exclude` (a directory).
+
+    A recording stored in several formats (e.g. r1.csv and its conversion
+    r1.bin) is listed once, in the first format of RECORDING_EXTENSIONS.
+    """
+    exclude = os.path.abspath(exclude) if exclude else None
+    paths = []
+    for directory in directories:
+        for root, dirs, files in os.walk(directory):
+            dirs[:] = sorted(name for name in dirs
+                             if os.path.abspath(os.path.join(root, name)) != exclude)
+            chosen = {}
+            for name in files:
+                stem, extension = os.path.splitext(name)
+                if extension not in RECORDING_EXTENSIONS or name.endswith(DERIVED_SUFFIXES):
+                    continue
+                if (stem not in chosen or RECORDING_EXTENSIONS.index(extension)
+                        < RECORDING_EXTENSIONS.index(os.path.splitext(chosen[stem])[1])):
+                    chosen[stem] = name
+            paths.extend(os.path.join(root, name) for name in sorted(chosen.values()))
+    return paths
+
+
+def file_hash(path):
+    """BLAKE2b digest of a file's content, read in chunks."""
+    with open(path, 'rb') as f:
+        return _read_hash(f)
+
+
+def _read_hash(f):
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: f.read(HASH_CHUNK), b''):
+        digest.update(chunk)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """What each output was converted from: input size, mtime, hash and options."""
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, 'r') as f:
+                self.entries = json.load(f)
+        except FileNotFoundError:
+            self.entries = {}
+        except (OSError, ValueError) as e:
+            print(f'Error reading manifest {path}, converting everything: {e}')
+            self.entries = {}
+
+    def up_to_date(self, key, path, output, options, use_hash=False):
+        """True if `output` was made from the current content of `path` with `options`.
+
+        With `use_hash`, an input whose mtime changed (e.g. copied back from a
+        backup) still counts as unchanged if its content hash matches; the
+        entry is then refreshed with the new mtime.
+        """
+        entry = self.entries.get(key)
+        if not entry or entry['options'] != options or not os.path.exists(output):
+            return False
+        stat = os.stat(path)
+        if entry['size'] != stat.st_size:
+            return False
+        if entry['mtime_ns'] == stat.st_mtime_ns:
+            return True
+        if use_hash and entry.get('hash') and entry['hash'] == file_hash(path):
+            entry['mtime_ns'] = stat.st_mtime_ns
+            return True
+        return False
+
+    def record(self, key, result, options):
+        self.entries[key] = {'size': result['size'], 'mtime_ns': result['mtime_ns'],
+                             'hash': result['hash'], 'options': options,
+                             'output': result['output']}
+
+    def save(self):
+        temporary = f'{self.path}.tmp'
+        with open(temporary, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(temporary, self.path)
+
+
+class _Resampler:
+    """Streaming counterpart of recording_reader.resample().
+
+    Each chunk is interpolated together with the last record of the previous
+    one, so grid points between chunks come out as if the file were whole;
+    finish() adds the points resample() places up to half a step after the
+    last record.
+    """
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._start = None
+        self._next = 0  # Index of the next grid point
+        self._last = None  # Last record of the previous chunk
+
+    def feed(self, records):
+        if self._last is not None:
+            records = np.concatenate((self._last, records))
+        if len(records) == 0:
+            return records
+        if self._start is None:
+            self._start = records['timestamp'][0]
+        stop = int(np.floor((records['timestamp'][-1] - self._start) * self.rate)) + 1
+        resampled = self._interpolate(records, stop)
+        self._last = records[-1:]
+        return resampled
+
+    def stream(self, chunks):
+        """Resample a sequence of chunks, yielding the feed() results and then finish()."""
+        for records in chunks:
+            yield self.feed(records)
+        yield self.finish()
+
+    def finish(self):
+        """The grid points after the last record, like resample()'s default end."""
+        if self._last is None:
+            return np.zeros(0, dtype=recording_reader.SCALED_DTYPE)
+        end = self._last['timestamp'][0] + 0.5 / self.rate
+        return self._interpolate(self._last, int(np.ceil((end - self._start) * self.rate)))
+
+    def _interpolate(self, records, stop):
+        """Grid points from the next one up to `stop` (exclusive), interpolated in `records`."""
+        timestamps = records['timestamp']
+        indexes = np.arange(self._next, max(stop, self._next))
+        grid = self._start + indexes / self.rate
+        resampled = np.empty(len(grid), dtype=recording_reader.SCALED_DTYPE)
+        resampled['packet'] = indexes
+        resampled['timestamp'] = grid
+        for channel in recording_reader.CHANNELS:
+            for axis in range(3):
+                resampled[channel][:, axis] = np.interp(grid, timestamps, records[channel][:, axis])
+        self._next = max(stop, self._next)
+        return resampled
+
+
+def _transform(records, options):
+    """Apply the offset and scale corrections to a chunk (in place) and return it."""
+    for field, values in options.get('offset', {}).items():
+        records[field] -= np.asarray(values, dtype=np.float32)
+    for field, values in options.get('scale', {}).items():
+        records[field] *= np.asarray(values, dtype=np.float32)
+    return records
+
+
+def _csv_lines(records, derive, emitter):
+    columns = [records['packet'][:, None].astype(np.float64)]
+    columns += [records[field].astype(np.float64) for field in recording_reader.CHANNELS]
+    if derive == 'magnitude':
+        columns += [np.linalg.norm(records[field], axis=1)[:, None].astype(np.float64)
+                    for field in recording_reader.CHANNELS]
+    columns.append(records['timestamp'][:, None])
+    return emitter.format(np.hstack(columns))
+
+
+def output_path(path, source_root, output_dir, options):
+    """Output path of `path`: same relative path under output_dir, new extension."""
+    relative = os.path.relpath(path, source_root)
+    extension = '.bin' if options['format'] == 'binary' else '.csv'
+    return os.path.join(output_dir, os.path.splitext(relative)[0] + extension)
+
+
+def convert_file(path, output, options, chunk_records=recording_reader.CSV_CHUNK_ROWS,
+                 use_hash=False):
+    """Convert one recording chunk by chunk. Runs in a worker process.
+
+    Args:
+        use_hash: Also hash the input for the manifest (an extra read of the file)
+
+    Returns:
+        Dict with 'path', 'output', 'records', 'size', 'mtime_ns', 'hash'
+        (None without `use_hash`), 'seconds', or 'error' if the conversion failed
+    """
+    started = time.perf_counter()
+    result = {'path': path, 'output': output, 'records': 0, 'hash': None}
+    temporary = f'{output}.tmp'
+    try:
+        # Size, mtime and hash all describe the content read here
+        with open(path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if use_hash:
+                result['hash'] = _read_hash(f)
+        result.update(size=stat.st_size, mtime_ns=stat.st_mtime_ns)
+        directory = os.path.dirname(output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        resampler = _Resampler(options['resample']) if options.get('resample') else None
+        binary = options['format'] == 'binary'
+        with open(temporary, 'wb') if binary else open(temporary, 'w', newline='') as f:
+            if binary:
+                recording_reader._write_header(f, recording_reader.SCALED_DTYPE)
+            else:
+                header = csv_header(DEFAULT_CHANNELS) + DERIVED_COLUMNS.get(options.get('derive'), [])
+                header.append(header.pop(header.index("Timestamp")))
+                emitter = CsvEmitter(header, lineterminator='\n')
+                f.write(emitter.header_line())
+            chunks = (_transform(np.array(records, copy=True), options)
+                      for records in recording_reader.iter_records(path, chunk_records))
+            if resampler:
+                chunks = resampler.stream(chunks)
+            for records in chunks:
+                if binary:
+                    records.tofile(f)
+                else:
+                    f.write(_csv_lines(records, options.get('derive'), emitter))
+                result['records'] += len(records)
+        after = os.stat(path)
+        if (after.st_size, after.st_mtime_ns) != (stat.st_size, stat.st_mtime_ns):
+            raise OSError('input changed during the conversion')
+        os.replace(temporary, output)
+    except Exception as e:  # Reported per file; the batch goes on
+        result['error'] = str(e)
+        if os.path.exists(temporary):
+            os.remove(temporary)
+    result['seconds'] = time.perf_counter() - started
+    return result
+
+
+def convert_archive(directories, output_dir, options, workers=None, use_hash=False, force=False):
+    """Convert every stale recording under `directories` into `output_dir`.
+
+    Returns:
+        Dict with 'converted', 'skipped' and 'failed' result lists and the
+        'seconds', 'files_per_second' and 'mb_per_second' of the run
+    """
+    started = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    manifest = Manifest(os.path.join(output_dir, MANIFEST_NAME))
+    options_key = json.dumps(options, sort_keys=True)
+    jobs, skipped = [], []
+    for directory in directories:
+        for path in discover([directory], exclude=output_dir):
+            output = output_path(path, directory, output_dir, options)
+            key = os.path.relpath(output, output_dir)
+            if not force and manifest.up_to_date(key, path, output, options_key, use_hash):
+                skipped.append(path)
+            else:
+                jobs.append((key, path, output))
+
+    converted, failed = [], []
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = {pool.submit(convert_file, path, output, options, use_hash=use_hash): key
+                   for key, path, output in jobs}
+        for future in as_completed(futures):
+            result = future.result()
+            if 'error' in result:
+                print(f"Error converting {result['path']}: {result['error']}")
+                failed.append(result)
+                continue
+            manifest.record(futures[future], result, options_key)
+            converted.append(result)
+            print(f"{result['path']} -> {result['output']}: {result['records']} records "
+                  f"in {result['seconds']:.2f} s")
+    manifest.save()
+
+    elapsed = time.perf_counter() - started
+    megabytes = sum(result['size'] for result in converted) / 1e6
+    return {'converted': converted, 'skipped': skipped, 'failed': failed, 'seconds': elapsed,
+            'files_per_second': len(converted) / elapsed if elapsed else 0.0,
+            'mb_per_second': megabytes / elapsed if elapsed else 0.0}
+
+
+def _channel_values(text):
+    """'accel=1.01,1,0.99' -> ('accel', [1.01, 1.0, 0.99])"""
+    channel, _, values = text.partition('=')
+    values = [float(value) for value in values.split(',')]
+    if channel not in CHANNEL_FIELDS or len(values) != 3:
+        raise argparse.ArgumentTypeError(f"Expected gyro|accel|mag=X,Y,Z, got '{text}'")
+    return CHANNEL_FIELDS[channel], values
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Convert recording archives in parallel')
+    parser.add_argument('directories', nargs='*', default=['sensor_data'],
+                        help='directories to search for recordings (default: sensor_data)')
+    parser.add_argument('--output', default='converted', help='output directory')
+    parser.add_argument('--format', default='binary', choices=('binary', 'csv'))
+    parser.add_argument('--offset', type=_channel_values, action='append', default=[],
+                        metavar='CH=X,Y,Z', help='subtract per-axis offsets (gyro, accel, mag)')
+    parser.add_argument('--scale', type=_channel_values, action='append', default=[],
+                        metavar='CH=X,Y,Z', help='multiply by per-axis factors after the offset')
+    parser.add_argument('--resample', type=float, metavar='RATE', help='resample to RATE Hz')
+    parser.add_argument('--derive', choices=tuple(DERIVED_COLUMNS),
+                        help='add derived columns (CSV output only)')
+    parser.add_argument('--workers', type=int, help='processes (default: one per CPU)')
+    parser.add_argument('--hash', action='store_true',
+                        help='treat inputs with a new mtime but unchanged content as up to date')
+    parser.add_argument('--force', action='store_true', help='convert even up-to-date files')
+    args = parser.parse_args()
+    if args.derive and args.format != 'csv':
+        parser.error('--derive needs --format csv')
+
+    options = {'format': args.format, 'offset': dict(args.offset), 'scale': dict(args.scale),
+               'resample': args.resample, 'derive': args.derive}
+    summary = convert_archive(args.directories, args.output, options, workers=args.workers,
+                              use_hash=args.hash, force=args.force)
+    print(f"{len(summary['converted'])} converted, {len(summary['skipped'])} up to date, "
+          f"{len(summary['failed'])} failed in {summary['seconds']:.2f} s "
+          f"({summary['files_per_second']:.1f} files/s, {summary['mb_per_second']:.1f} MB/s)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Register read benchmark: Blinka (busio) versus direct i2c-dev ioctls.
+
+Reads the recorded channels repeatedly through BNO055_I2C and BNO055_I2CDev
+on the same sensor and reports the latency distribution of one read_channels()
+call per transport. Run it on the Pi with the sensor attached and nothing else
+using the bus.
+
+Usage: python bench_i2c.py [--reads 2000] [--bus 1] [--address 0x28]
+                           [--channels gyro,acceleration,magnetic]
+"""
+
+import argparse
+import statistics
+import time
+
+import adafruit_bno055
+import board
+
+from channel_columns import DEFAULT_CHANNELS
+
+
+def time_reads(sensor, channels, reads):
+    """Return the sorted durations in seconds of `reads` read_channels() calls."""
+    for _ in range(20):
+        sensor.read_channels(channels)  # Warm up caches and the burst plan
+    durations = []
+    for _ in range(reads):
+        start = time.perf_counter()
+        sensor.read_channels(channels)
+        durations.append(time.perf_counter() - start)
+    durations.sort()
+    return durations
+
+
+def print_row(label, durations):
+    def percentile(fraction):
+        return durations[min(len(durations) - 1, int(fraction * len(durations)))] * 1e6
+
+    mean = statistics.fmean(durations)
+    print(f'{label:<10} mean {mean * 1e6:8.1f} us  p50 {percentile(0.5):8.1f} us  '
+          f'p99 {percentile(0.99):8.1f} us  max {durations[-1] * 1e6:8.1f} us  '
+          f'{1 / mean:8.0f} reads/s')
+    return mean
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--reads', type=int, default=2000, help='reads per transport')
+    parser.add_argument('--bus', type=int, default=1, help='adapter number N of /dev/i2c-N')
+    parser.add_argument('--address', type=lambda text: int(text, 0), default=0x28)
+    parser.add_argument('--channels', default=','.join(DEFAULT_CHANNELS),
+                        help='comma-separated adafruit_bno055.CHANNELS names')
+    args = parser.parse_args()
+    channels = tuple(args.channels.split(','))
+
+    # Both drivers reset and configure the sensor when created
+    blinka = adafruit_bno055.BNO055_I2C(board.I2C(), args.address)
+    blinka_mean = print_row('blinka', time_reads(blinka, channels, args.reads))
+
+    i2c_dev = adafruit_bno055.BNO055_I2CDev(args.bus, args.address)
+    try:
+        i2c_dev_mean = print_row('i2c-dev', time_reads(i2c_dev, channels, args.reads))
+    finally:
+        i2c_dev.i2c_device.close()
+    print(f'i2c-dev is {blinka_mean / i2c_dev_mean:.2f}x faster per read')
+
+
+if __name__ == '__main__':
+    main()
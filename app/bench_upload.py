@@ -0,0 +1,137 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""End-to-end upload benchmark against the local Drive v3 stand-in server.
+
+Measures upload throughput per protocol, the chunk-size tradeoff of resumable
+uploads under latency, and the time needed to recover from injected failures
+(without the randomized retry backoff, which is reported separately).
+No credentials or network access are needed.
+
+Usage: python bench_upload.py [--size-mb 8] [--latency 0.05] [--bandwidth-kbps 2000]
+"""
+
+import argparse
+import os
+import tempfile
+import time
+
+from google.auth.credentials import AnonymousCredentials
+
+from drive_stub_server import DriveStubServer
+from upload_togoogle import GoogleDriveUploader
+
+KIB = 1024
+MIB = 1024 * 1024
+
+
+def make_test_file(directory, size):
+    """Write a CSV-like file of roughly `size` bytes and return its path."""
+    path = os.path.join(directory, f'bench_{size}.csv')
+    row = b'12345,0.0010908,-0.0021816,0.0000000,0.12,-0.03,9.81,-21.5,4.25,40.0,1700000000.123\n'
+    with open(path, 'wb') as f:
+        written = 0
+        while written < size:
+            f.write(row)
+            written += len(row)
+    return path
+
+
+def timed_upload(server, file_path, **uploader_options):
+    """Upload once and return (seconds, requests made, succeeded)."""
+    uploader = GoogleDriveUploader(credentials=AnonymousCredentials(),
+                                   discovery_url=server.discovery_url,
+                                   folder_id=None, **uploader_options)
+    requests_before = server.stats['requests']
+    start = time.perf_counter()
+    file_id = uploader.upload_file(file_path)
+    elapsed = time.perf_counter() - start
+    return elapsed, server.stats['requests'] - requests_before, file_id is not None
+
+
+def print_row(label, size, elapsed, requests, ok):
+    rate = size / elapsed / MIB if elapsed else 0.0
+    status = 'ok' if ok else 'FAILED'
+    print(f'{label:<28} {elapsed * 1000:9.1f} ms {rate:8.2f} MiB/s {requests:6d} req  {status}')
+
+
+def bench_protocols(server, file_path, size, repeat):
+    print('\n== Throughput by protocol ==')
+    cases = [
+        ('multipart', {'resumable': False}),
+        ('resumable, single request', {'resumable': True, 'chunk_size': -1}),
+        ('resumable, 1 MiB chunks', {'resumable': True, 'chunk_size': MIB}),
+    ]
+    for label, options in cases:
+        results = [timed_upload(server, file_path, **options) for _ in range(repeat)]
+        best = min(results, key=lambda r: r[0])
+        print_row(label, size, *best)
+
+
+def bench_chunk_sizes(server, file_path, size, repeat):
+    print('\n== Resumable chunk size tradeoff ==')
+    for chunk_size in (256 * KIB, MIB, 4 * MIB, 16 * MIB, -1):
+        label = 'whole file' if chunk_size == -1 else f'{chunk_size // KIB} KiB chunks'
+        results = [timed_upload(server, file_path, chunk_size=chunk_size) for _ in range(repeat)]
+        best = min(results, key=lambda r: r[0])
+        print_row(label, size, *best)
+
+
+def expected_backoff(failures):
+    """Mean seconds the uploader's default backoff waits for `failures` retries in a row."""
+    return sum(2 ** retry / 2 for retry in range(1, failures + 1))
+
+
+def bench_recovery(server, file_path, size):
+    # At least four chunks, so failures injected after the first chunk all land mid-upload
+    chunk_size = max(256 * KIB, min(MIB, size // 4 // (256 * KIB) * (256 * KIB)))
+    print(f'\n== Recovery from injected failures ({chunk_size // KIB} KiB chunks, 5 retries) ==')
+    print('Retries run without backoff; the default randomized backoff is listed separately')
+    options = {'chunk_size': chunk_size, 'num_retries': 5, 'retry_delay': lambda failures: 0.0}
+    server.reset()
+    baseline, requests, ok = timed_upload(server, file_path, **options)
+    print_row('no failures', size, baseline, requests, ok)
+    for label, count, partial in (('1 failed chunk', 1, False),
+                                  ('3 failed chunks', 3, False),
+                                  ('1 chunk dropped halfway', 1, True)):
+        server.reset()
+        # Let the session start and the first chunk through so the failure hits mid-upload
+        server.fail_next(count, partial, after=2)
+        elapsed, requests, ok = timed_upload(server, file_path, **options)
+        injected = server.stats['failures_injected']
+        if server.pending_failures() or injected != count:
+            ok = False
+            print(f'{"":<28} only {injected} of {count} failures were injected')
+        print_row(label, size, elapsed, requests, ok)
+        print(f'{"":<28} recovery overhead {1000 * (elapsed - baseline):9.1f} ms'
+              f' + backoff {1000 * expected_backoff(count):.0f} ms on average')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--size-mb', type=float, default=8, help='test file size in MiB')
+    parser.add_argument('--latency', type=float, default=0.02, help='seconds added per request')
+    parser.add_argument('--bandwidth-kbps', type=float, default=0,
+                        help='upload cap in KiB/s (0 = unlimited)')
+    parser.add_argument('--repeat', type=int, default=3, help='runs per case (best is reported)')
+    args = parser.parse_args()
+
+    server = DriveStubServer(latency=args.latency,
+                             bandwidth=args.bandwidth_kbps * KIB if args.bandwidth_kbps else None)
+    server.start()
+    print(f'Drive stand-in at {server.url}, latency {args.latency * 1000:.0f} ms, '
+          f'bandwidth {"unlimited" if not args.bandwidth_kbps else f"{args.bandwidth_kbps:.0f} KiB/s"}')
+    try:
+        with tempfile.TemporaryDirectory() as directory:
+            size = int(args.size_mb * MIB)
+            file_path = make_test_file(directory, size)
+            size = os.path.getsize(file_path)
+            bench_protocols(server, file_path, size, args.repeat)
+            bench_chunk_sizes(server, file_path, size, args.repeat)
+            bench_recovery(server, file_path, size)
+    finally:
+        server.stop()
+
+
+if __name__ == '__main__':
+    main()
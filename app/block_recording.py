@@ -0,0 +1,362 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Crash-safe block recordings (.rec) and their recovery after a power cut.
+
+A block recording is a sequence of 4 KiB blocks. The first block is the file
+header: format, record layout, the column names of the recording and a
+committed-length marker. Every other block holds up to records_per_block
+fixed-size records followed by a trailer with the block's sequence number,
+its record count and a CRC32 of both:
+
+    uint32 packet    float64 timestamp    float32 value[columns - 2]  (x count)
+    ... zero padding ...    uint32 sequence    uint32 count    uint32 crc32
+
+Segment space is preallocated with posix_fallocate(), so appending a block
+does not change the file size and fdatasync() does not have to update file
+system metadata on the SD card. Blocks are only ever written once: every
+flush completes the open block (partially filled if need be), syncs it and
+then advances the committed marker, which therefore never points past data
+that is on disk. After a crash only the blocks behind the marker can be
+damaged, so recover() checks those and truncates at the first invalid one
+without reading the rest of the file.
+
+Command line:
+    python block_recording.py recover RECORDING.rec [...]
+    python block_recording.py info RECORDING.rec
+"""
+
+import os
+import struct
+import sys
+import zlib
+
+import numpy as np
+
+from recording_writer import RecordingWriter
+
+BLOCK_MAGIC = b'BNOBLK1\0'
+BLOCK_VERSION = 1
+BLOCK_SIZE = 4096
+BLOCK_EXTENSION = '.rec'
+FILE_HEADER = struct.Struct('<8sHHIII')  # magic, version, flags, record size, block size, records per block
+COMMIT = struct.Struct('<QII')  # committed blocks, closed flag, crc32 of both
+COMMIT_OFFSET = 32
+COLUMNS_OFFSET = 64  # Column names as one NUL-terminated CSV line
+TRAILER = struct.Struct('<III')  # sequence, record count, crc32 of the records and both fields
+
+PREALLOCATE_BYTES = 4 * 1024 * 1024  # Space reserved ahead of the write position
+
+
+def record_dtype(header):
+    """Record layout for a recording with the given column names.
+
+    The first column must be the packet number and the last the timestamp; all
+    other columns are stored as float32 (missing values as NaN).
+    """
+    if header[0] != "Packet number" or header[-1] != "Timestamp":
+        raise ValueError("Block recordings need 'Packet number' first and 'Timestamp' last")
+    return np.dtype([
+        ('packet', '<u4'),
+        ('timestamp', '<f8'),
+        ('values', '<f4', (len(header) - 2,)),
+    ])
+
+
+def _block_dtype(records, records_per_block):
+    padding = BLOCK_SIZE - records.itemsize * records_per_block - TRAILER.size
+    return np.dtype([
+        ('records', records, (records_per_block,)),
+        ('padding', f'V{padding}'),
+        ('sequence', '<u4'),
+        ('count', '<u4'),
+        ('crc', '<u4'),
+    ])
+
+
+def _records_per_block(dtype):
+    count = (BLOCK_SIZE - TRAILER.size) // dtype.itemsize
+    if count < 1:
+        raise ValueError(f'Records of {dtype.itemsize} bytes do not fit in a block')
+    return count
+
+
+def _block_crc(data, sequence, count):
+    return zlib.crc32(struct.pack('<II', sequence, count), zlib.crc32(data))
+
+
+def _commit_marker(blocks, closed):
+    fields = struct.pack('<QI', blocks, int(closed))
+    return COMMIT.pack(blocks, int(closed), zlib.crc32(fields))
+
+
+def read_header(path):
+    """Header of a block recording.
+
+    Returns:
+        Dict with 'columns', 'dtype', 'records_per_block', 'committed' (blocks
+        known to be on disk, None if the marker itself is damaged) and 'closed'
+    """
+    with open(path, 'rb') as f:
+        data = f.read(BLOCK_SIZE)
+    if len(data) < BLOCK_SIZE or data[:len(BLOCK_MAGIC)] != BLOCK_MAGIC:
+        raise ValueError(f'{path} is not a block recording')
+    _, version, _, record_size, block_size, records_per_block = FILE_HEADER.unpack_from(data)
+    if version != BLOCK_VERSION or block_size != BLOCK_SIZE:
+        raise ValueError(f'{path}: unsupported block recording version {version}')
+    columns = data[COLUMNS_OFFSET:].split(b'\0', 1)[0].decode().split(',')
+    dtype = record_dtype(columns)
+    if record_size != dtype.itemsize or records_per_block != _records_per_block(dtype):
+        raise ValueError(f'{path}: record layout does not match its columns')
+    committed, closed, crc = COMMIT.unpack_from(data, COMMIT_OFFSET)
+    if zlib.crc32(struct.pack('<QI', committed, closed)) != crc:
+        committed, closed = None, 0
+    return {'columns': columns, 'dtype': dtype, 'records_per_block': records_per_block,
+            'committed': committed, 'closed': bool(closed)}
+
+
+def _valid_blocks(blocks, first_sequence):
+    """Number of leading blocks with the expected sequence, a sane count and a matching CRC."""
+    records_per_block = blocks.dtype['records'].shape[0]
+    record_size = blocks.dtype['records'].base.itemsize
+    raw = blocks.view(np.uint8).reshape(len(blocks), BLOCK_SIZE)
+    for position, block in enumerate(blocks):
+        sequence, count = int(block['sequence']), int(block['count'])
+        if (sequence != first_sequence + position or count > records_per_block
+                or _block_crc(raw[position, :count * record_size], sequence, count) != int(block['crc'])):
+            return position
+    return len(blocks)
+
+
+def iter_blocks(path, chunk_blocks=1024):
+    """Read the valid records of a block recording chunk by chunk.
+
+    Reading stops at the first invalid block, so recordings that were cut off
+    (and not yet recovered) load up to their last intact block.
+
+    Yields:
+        (column names, array of record_dtype(columns) records) per chunk_blocks blocks
+    """
+    header = read_header(path)
+    dtype = _block_dtype(header['dtype'], header['records_per_block'])
+    count = os.path.getsize(path) // BLOCK_SIZE - 1
+    if count <= 0:
+        return
+    blocks = np.memmap(path, dtype=dtype, mode='r', offset=BLOCK_SIZE, shape=(count,))
+    slots = np.arange(header['records_per_block'])
+    for first in range(0, count, chunk_blocks):
+        chunk = blocks[first:first + chunk_blocks]
+        valid = _valid_blocks(chunk, first)
+        chunk = chunk[:valid]
+        yield header['columns'], np.asarray(chunk['records'][slots < chunk['count'][:, None]])
+        if valid < chunk_blocks:
+            return
+
+
+def read_blocks(path):
+    """Read the valid records of a block recording (see iter_blocks).
+
+    Returns:
+        (column names, array of record_dtype(columns) records)
+    """
+    columns = read_header(path)['columns']
+    chunks = [records for _, records in iter_blocks(path)]
+    if not chunks:
+        return columns, np.zeros(0, dtype=record_dtype(columns))
+    return columns, np.concatenate(chunks)
+
+
+def recover(path, verify=False):
+    """Truncate a block recording after its last valid block.
+
+    Only the blocks after the committed marker are checked (all blocks with
+    `verify`, or when the marker is damaged), so the time taken depends on the
+    damaged tail rather than the file size. The preallocated space behind the
+    data is released and the marker is updated.
+
+    Returns:
+        Dict with 'blocks' (valid data blocks), 'checked' (blocks read) and
+        'truncated' (bytes removed)
+    """
+    header = read_header(path)
+    dtype = _block_dtype(header['dtype'], header['records_per_block'])
+    size = os.path.getsize(path)
+    on_disk = size // BLOCK_SIZE - 1
+    first = 0 if verify or header['committed'] is None else min(header['committed'], on_disk)
+
+    fd = os.open(path, os.O_RDWR)
+    try:
+        valid = first
+        checked = 0
+        while valid < on_disk:
+            data = os.pread(fd, BLOCK_SIZE, BLOCK_SIZE * (1 + valid))
+            checked += 1
+            if len(data) < BLOCK_SIZE or not _valid_blocks(np.frombuffer(data, dtype=dtype), valid):
+                break
+            valid += 1
+        end = BLOCK_SIZE * (1 + valid)
+        if end != size or header['committed'] != valid or not header['closed']:
+            os.ftruncate(fd, end)
+            os.pwrite(fd, _commit_marker(valid, True), COMMIT_OFFSET)
+            os.fsync(fd)
+    finally:
+        os.close(fd)
+    return {'blocks': valid, 'checked': checked, 'truncated': size - end}
+
+
+def recover_directory(directory):
+    """Recover the block recordings in `directory` that were not closed.
+
+    Returns:
+        Dict path -> recover() result of the recordings that needed it
+    """
+    results = {}
+    for name in sorted(os.listdir(directory)):
+        path = os.path.join(directory, name)
+        if not name.endswith(BLOCK_EXTENSION):
+            continue
+        try:
+            if not read_header(path)['closed']:
+                results[path] = recover(path)
+        except (OSError, ValueError) as e:
+            print(f'Error recovering {path}: {e}')
+    return results
+
+
+class BlockRecordingWriter(RecordingWriter):
+    """RecordingWriter variant that writes crash-safe block recordings.
+
+    Rows are packed into fixed-size records and written a block at a time into
+    preallocated space. Every flush (see flush_interval) completes the open
+    block, syncs it and advances the committed marker, so at most the last
+    flush_interval of data is lost on a power cut and recover() restores the
+    file quickly. Segments get the .rec extension of csv_filename's root.
+    """
+
+    def __init__(self, csv_filename, header, segment_seconds=None,
+                 on_segment_closed=None, batch_size=50, flush_interval=1.0,
+                 preallocate=PREALLOCATE_BYTES, summary=False):
+        """Initialize the writer.
+
+        Args:
+            csv_filename: Path of the recording (the extension is replaced with .rec)
+            header: List of column names, 'Packet number' first and 'Timestamp' last
+            segment_seconds: See RecordingWriter
+            on_segment_closed: See RecordingWriter
+            batch_size: See RecordingWriter
+            flush_interval: Seconds between committed blocks
+            preallocate: Bytes reserved with posix_fallocate() at a time (0 = never)
+            summary: See RecordingWriter
+        """
+        super().__init__(os.path.splitext(csv_filename)[0] + BLOCK_EXTENSION, header,
+                         segment_seconds=segment_seconds, on_segment_closed=on_segment_closed,
+                         batch_size=batch_size, flush_interval=flush_interval, summary=summary)
+        self.preallocate = preallocate
+        self.dtype = record_dtype(header)
+        self.records_per_block = _records_per_block(self.dtype)
+        self._block_dtype = _block_dtype(self.dtype, self.records_per_block)
+        self._fd = None
+        self._block = None
+        self._count = 0  # Records in the open block
+        self._blocks = 0  # Data blocks written to the open file
+        self._allocated = 0
+
+    def _open_file(self, path):
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0o644)
+        header = bytearray(BLOCK_SIZE)
+        FILE_HEADER.pack_into(header, 0, BLOCK_MAGIC, BLOCK_VERSION, 0, self.dtype.itemsize,
+                              BLOCK_SIZE, self.records_per_block)
+        header[COMMIT_OFFSET:COMMIT_OFFSET + COMMIT.size] = _commit_marker(0, False)
+        columns = ','.join(self.header).encode()
+        if COLUMNS_OFFSET + len(columns) >= BLOCK_SIZE:
+            raise ValueError('Too many columns for a block recording header')
+        header[COLUMNS_OFFSET:COLUMNS_OFFSET + len(columns)] = columns
+        self._allocated = 0
+        self._reserve(BLOCK_SIZE)
+        os.pwrite(self._fd, bytes(header), 0)
+        self._block = np.zeros(1, dtype=self._block_dtype)
+        self._count = 0
+        self._blocks = 0
+
+    def _reserve(self, end):
+        """Make sure the file has space up to `end`, a preallocation chunk at a time."""
+        if end <= self._allocated or not self.preallocate:
+            return
+        length = max(self.preallocate, end - self._allocated)
+        try:
+            os.posix_fallocate(self._fd, self._allocated, length)
+            self._allocated += length
+        except (AttributeError, OSError) as e:
+            print(f"Warning: cannot preallocate recording space, appending instead: {e}")
+            self.preallocate = 0
+
+    def _write_block(self):
+        used = self._block['records'][0, :self._count].tobytes()
+        self._block['sequence'] = self._blocks
+        self._block['count'] = self._count
+        self._block['crc'] = _block_crc(used, self._blocks, self._count)
+        offset = BLOCK_SIZE * (1 + self._blocks)
+        self._reserve(offset + BLOCK_SIZE)
+        os.pwrite(self._fd, self._block.tobytes(), offset)
+        self._block = np.zeros(1, dtype=self._block_dtype)
+        self._blocks += 1
+        self._count = 0
+
+    def _write_rows(self, rows):
+        if not rows:
+            return
+        values = np.array(rows, dtype=np.float64)  # None (missing) becomes NaN
+        records = np.empty(len(rows), dtype=self.dtype)
+        records['packet'] = values[:, 0]
+        records['timestamp'] = values[:, -1]
+        records['values'] = values[:, 1:-1]
+        while len(records):
+            taken = min(len(records), self.records_per_block - self._count)
+            self._block['records'][0, self._count:self._count + taken] = records[:taken]
+            self._count += taken
+            records = records[taken:]
+            if self._count == self.records_per_block:
+                self._write_block()
+        self._segment_rows += len(rows)
+
+    def _commit(self, closed=False):
+        if self._count:
+            self._write_block()
+        # Data first, then the marker that points to it
+        os.fdatasync(self._fd)
+        os.pwrite(self._fd, _commit_marker(self._blocks, closed), COMMIT_OFFSET)
+
+    def _flush(self):
+        self._commit()
+
+    def _close_file(self):
+        self._commit(closed=True)
+        os.ftruncate(self._fd, BLOCK_SIZE * (1 + self._blocks))  # Release the unused reserve
+        os.fsync(self._fd)
+        os.close(self._fd)
+        self._fd = None
+
+
+def _print_info(path):
+    header = read_header(path)
+    columns, records = read_blocks(path)
+    print(f"{path}: {len(records)} records, {len(columns)} columns,"
+          f" {header['records_per_block']} records per block")
+    print(f"  committed blocks: {header['committed']}"
+          f" ({'closed' if header['closed'] else 'not closed, run recover'})")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'recover':
+        for recording in sys.argv[2:]:
+            try:
+                result = recover(recording)
+                print(f"{recording}: {result['blocks']} valid blocks, checked {result['checked']},"
+                      f" truncated {result['truncated']} bytes")
+            except (OSError, ValueError) as e:
+                print(f'Error recovering {recording}: {e}')
+    elif len(sys.argv) == 3 and sys.argv[1] == 'info':
+        _print_info(sys.argv[2])
+    else:
+        print(__doc__.split('Command line:')[1])
+        sys.exit(2)
@@ -0,0 +1,117 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import json
+import os
+import socket
+import struct
+from datetime import datetime
+
+# Layout of adafruit_bno055's calibration_profile block (registers 0x55-0x6A)
+PROFILE_FORMAT = struct.Struct('<hhhhhhhhhhh')
+PROFILE_FIELDS = (
+    "accel_offset_x", "accel_offset_y", "accel_offset_z",
+    "mag_offset_x", "mag_offset_y", "mag_offset_z",
+    "gyro_offset_x", "gyro_offset_y", "gyro_offset_z",
+    "accel_radius", "mag_radius",
+)
+
+
+def unit_key(unit_id=None):
+    """Key of this unit's profile: the given unit id or the host name.
+
+    The BNO055 has no serial number, so profiles follow the unit (Pi plus
+    sensor) rather than the chip.
+    """
+    return unit_id or socket.gethostname()
+
+
+def decode_profile(data):
+    """Calibration profile bytes -> dict of named offsets and radii."""
+    return dict(zip(PROFILE_FIELDS, PROFILE_FORMAT.unpack(data)))
+
+
+def encode_profile(fields):
+    """Dict of named offsets and radii (see PROFILE_FIELDS) -> profile bytes."""
+    return PROFILE_FORMAT.pack(*(fields[name] for name in PROFILE_FIELDS))
+
+
+class CalibrationStore:
+    """Calibration profiles of several units in one local JSON file.
+
+    Each entry keeps the raw profile (hex), its decoded fields for reading, the
+    calibration status it was captured with and when.
+    """
+
+    def __init__(self, path="calibration_profiles.json"):
+        self.path = path
+
+    def load(self):
+        """All stored entries as a dict (empty if the file does not exist yet)."""
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            print(f"Error reading calibration profiles {self.path}: {e}")
+            return {}
+
+    def get(self, key):
+        """Profile bytes stored for `key`, or None."""
+        entry = self.load().get(key)
+        return bytes.fromhex(entry["profile"]) if entry else None
+
+    def save(self, key, data, status=None):
+        """Store a profile for `key`, replacing the file atomically."""
+        entries = self.load()
+        entries[key] = {
+            "profile": data.hex(),
+            "fields": decode_profile(data),
+            "status": list(status) if status else None,
+            "captured": datetime.now().isoformat(timespec='seconds'),
+        }
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        temporary = f"{self.path}.tmp"
+        with open(temporary, 'w') as f:
+            json.dump(entries, f, indent=2, sort_keys=True)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temporary, self.path)
+
+    def capture(self, sensor, key):
+        """Read the sensor's calibration profile and store it if fully calibrated.
+
+        Returns:
+            True if a profile was stored
+        """
+        try:
+            status = sensor.calibration_status
+            if status != (3, 3, 3, 3):
+                return False
+            self.save(key, sensor.calibration_profile, status)
+            print(f"Saved calibration profile for {key}")
+            return True
+        except Exception as e:
+            print(f"Error capturing calibration profile: {e}")
+            return False
+
+    def restore(self, sensor, key, fallback=None):
+        """Write the stored profile for `key` (or `fallback` bytes) to the sensor in one block.
+
+        Returns:
+            'stored', 'fallback' or None depending on what was written
+        """
+        data = self.get(key)
+        source = 'stored' if data else 'fallback' if fallback else None
+        data = data or fallback
+        if data is None:
+            return None
+        try:
+            sensor.calibration_profile = data
+        except Exception as e:
+            print(f"Error restoring calibration profile: {e}")
+            return None
+        return source
@@ -0,0 +1,81 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+# CSV column names per driver channel (see adafruit_bno055.CHANNELS). The first
+# three keep the names of the original recordings so existing tools still work.
+CHANNEL_COLUMNS = {
+    "gyro": ["Gyroscope X (deg/s)", "Gyroscope Y (deg/s)", "Gyroscope Z (deg/s)"],
+    "acceleration": ["Accelerometer X (g)", "Accelerometer Y (g)", "Accelerometer Z (g)"],
+    "magnetic": ["Magnetometer X (microteslas)", "Magnetometer Y (microteslas)",
+                 "Magnetometer Z (microteslas)"],
+    "euler": ["Euler heading (deg)", "Euler roll (deg)", "Euler pitch (deg)"],
+    "quaternion": ["Quaternion W", "Quaternion X", "Quaternion Y", "Quaternion Z"],
+    "linear_acceleration": ["Linear acceleration X (m/s^2)", "Linear acceleration Y (m/s^2)",
+                            "Linear acceleration Z (m/s^2)"],
+    "gravity": ["Gravity X (m/s^2)", "Gravity Y (m/s^2)", "Gravity Z (m/s^2)"],
+    "temperature": ["Temperature (C)"],
+    # Not a burst channel: read through sensor.calibration_status (0-3 each)
+    "calibration_status": ["Calibration system", "Calibration gyro", "Calibration accel",
+                           "Calibration mag"],
+}
+
+# Register step (LSB) of each channel in the driver's units, same scale factors
+# as adafruit_bno055.CHANNELS
+CHANNEL_RESOLUTION = {
+    "gyro": 0.001090830782496456,
+    "acceleration": 1 / 100,
+    "magnetic": 1 / 16,
+    "euler": 1 / 16,
+    "quaternion": 1 / (1 << 14),
+    "linear_acceleration": 1 / 100,
+    "gravity": 1 / 100,
+    "temperature": 1,
+    "calibration_status": 1,
+}
+
+# Decimals written per channel: enough to tell every register step apart,
+# e.g. 1/100 m/s^2 -> 2, 1/16 uT -> 4, 1/900 rad/s -> 5, 1/2^14 -> 5
+CHANNEL_DECIMALS = {
+    "gyro": 5,
+    "acceleration": 2,
+    "magnetic": 4,
+    "euler": 4,
+    "quaternion": 5,
+    "linear_acceleration": 2,
+    "gravity": 2,
+    "temperature": 0,
+    "calibration_status": 0,
+}
+
+DEFAULT_CHANNELS = ("gyro", "acceleration", "magnetic")
+
+
+def csv_header(channels):
+    """Header row for a recording of the given channels, in the given order."""
+    for name in channels:
+        if name not in CHANNEL_COLUMNS:
+            raise ValueError(f"Unknown channel '{name}'")
+    header = ["Packet number"]
+    for name in channels:
+        header.extend(CHANNEL_COLUMNS[name])
+    header.append("Timestamp")
+    return header
+
+
+def csv_row(packet_number, values, channels, timestamp):
+    """Row matching csv_header(channels) from a sensor.read_channels() result.
+
+    Channels missing from `values` (e.g. low-rate channels not read for this
+    sample) are left empty.
+    """
+    row = [packet_number]
+    for name in channels:
+        value = values.get(name)
+        if value is None:
+            row.extend([None] * len(CHANNEL_COLUMNS[name]))
+        elif isinstance(value, tuple):
+            row.extend(value)
+        else:
+            row.append(value)
+    row.append(timestamp)
+    return row
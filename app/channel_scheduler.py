@@ -0,0 +1,74 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import time
+
+
+class _SlowTask:
+    def __init__(self, name, rate, read, initial_cost):
+        self.name = name
+        self.period = 1.0 / rate
+        self.read = read
+        self.cost = initial_cost  # Decaying peak of the read duration (seconds)
+        self.next_due = 0.0
+        self.reads = 0
+        self.deferred = 0  # Times a due read did not fit into the slack
+
+
+class MultiRateScheduler:
+    """Fits low-rate register reads into the slack between high-rate samples.
+
+    The sampler reads its fast channels first, then asks the scheduler to run
+    whatever low-rate reads are due and still fit before the next sample's
+    deadline, judged by each read's measured duration. A due read that does
+    not fit waits for a sample period with more slack, so fast samples never
+    slip. The most overdue reads go first.
+    """
+
+    def __init__(self, reads, clock=time.perf_counter, margin=0.0005, initial_cost=0.002):
+        """Initialize the scheduler.
+
+        Args:
+            reads: Dict name -> (rate in Hz, callable returning the value)
+            clock: Monotonic clock in seconds (deadlines use the same clock)
+            margin: Seconds of slack always left before the deadline
+            initial_cost: Assumed read duration until one has been measured
+        """
+        self.clock = clock
+        self.margin = margin
+        self.tasks = [_SlowTask(name, rate, read, initial_cost)
+                      for name, (rate, read) in reads.items()]
+
+    def run(self, deadline):
+        """Run the due reads that fit before `deadline`.
+
+        Returns:
+            Dict name -> value of the reads made (empty if none)
+        """
+        results = {}
+        now = self.clock()
+        for task in sorted(self.tasks, key=lambda task: task.next_due):
+            if now < task.next_due:
+                break
+            if now + task.cost + self.margin > deadline:
+                task.deferred += 1
+                continue
+            try:
+                results[task.name] = task.read()
+                task.reads += 1
+            except Exception as e:
+                print(f"Error reading {task.name}: {e}")
+            finished = self.clock()
+            task.cost = max(finished - now, task.cost * 0.9)
+            # Keep the phase, but never try to catch up on missed periods
+            task.next_due += task.period
+            if task.next_due <= finished:
+                task.next_due = finished + task.period
+            now = finished
+        return results
+
+    def stats(self):
+        """Per read: rate, reads made, deferrals and current cost estimate."""
+        return {task.name: {'rate': round(1.0 / task.period, 3), 'reads': task.reads,
+                            'deferred': task.deferred, 'cost_us': round(task.cost * 1e6, 1)}
+                for task in self.tasks}
@@ -0,0 +1,149 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Local HTTP/JSON API for controlling a recorder from scripts.
+
+    GET  /status   recorder state, sample rate, drops, queue depths, disk free
+    POST /start    {"filename": "run1", "tags": {"site": "A"}, "start_at": 1760000000.0}
+    POST /stop
+    POST /upload   queue the stopped recording for background upload
+
+All fields of /start are optional. start_at is a Unix time; units whose clocks
+are synchronized (NTP/PTP) all begin sampling at that instant, e.g.::
+
+    t=$(($(date +%s) + 5))
+    for host in unit1 unit2 unit3; do
+        curl -s -X POST -d "{\\"start_at\\": $t}" http://$host:8055/start &
+    done
+
+Every response is a JSON object with 'ok', 'message' and the current 'status'.
+Requests that do not fit the current state (e.g. stop while ready) answer 409.
+If a token is configured, requests must send it in the X-Api-Token header.
+"""
+
+import hmac
+import json
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from recording_control import ControlError
+
+
+class ControlServer:
+    """Serves the control API for one RecordingController."""
+
+    def __init__(self, controller, address=('127.0.0.1', 8055), token=None):
+        """Initialize the server (call start() to begin serving).
+
+        Args:
+            controller: RecordingController shared with the UI or daemon
+            address: (host, port) to listen on; port 0 picks a free one
+            token: Shared secret required in the X-Api-Token header (None = no check)
+        """
+        self.controller = controller
+        self.address = address
+        self.token = token
+        self._httpd = None
+
+    @property
+    def url(self):
+        host, port = self.address
+        return f'http://{host}:{port}'
+
+    def start(self):
+        """Start serving on a background thread. Safe to call twice."""
+        if self._httpd is not None:
+            return
+        self._httpd = ThreadingHTTPServer(self.address, _ControlHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.control = self
+        self.address = self._httpd.server_address[:2]
+        thread = threading.Thread(target=self._httpd.serve_forever, name="control-api")
+        thread.daemon = True
+        thread.start()
+        print(f'Control API listening on {self.url}')
+
+    def stop(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+
+class _ControlHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass  # Keep the recorder console readable
+
+    @property
+    def controller(self):
+        return self.server.control.controller
+
+    def do_GET(self):
+        if not self._authorized():
+            return
+        if self.path.split('?')[0] == '/status':
+            self._reply(200, True, '')
+        else:
+            self._reply(404, False, 'Not found')
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        path = self.path.split('?')[0]
+        try:
+            body = self._read_json()
+            if path == '/start':
+                self.controller.start(filename=body.get('filename'), tags=body.get('tags'),
+                                      start_at=body.get('start_at'))
+                self._reply(200, True, 'Recording armed' if self.controller.state == 'armed'
+                            else 'Recording started')
+            elif path == '/stop':
+                self.controller.stop()
+                self._reply(200, True, 'Recording stopped')
+            elif path == '/upload':
+                level, message = self.controller.upload(background=True)
+                self._reply(200, level != 'error', message)
+            else:
+                self._reply(404, False, 'Not found')
+        except ControlError as e:
+            self._reply(409, False, str(e))
+        except (ValueError, TypeError) as e:
+            self._reply(400, False, str(e))
+        except Exception as e:
+            print(f'Error handling control request {path}: {e}')
+            self._reply(500, False, str(e))
+
+    def _authorized(self):
+        token = self.server.control.token
+        # As bytes: compare_digest refuses str with non-ASCII characters
+        if token and not hmac.compare_digest(self.headers.get('X-Api-Token', '').encode(),
+                                             token.encode()):
+            # The body is left unread, so the connection cannot carry another request
+            self.close_connection = True
+            self._reply(401, False, 'Missing or wrong X-Api-Token', include_status=False)
+            return False
+        return True
+
+    def _read_json(self):
+        length = int(self.headers.get('Content-Length') or 0)
+        if not length:
+            return {}
+        body = json.loads(self.rfile.read(length))
+        if not isinstance(body, dict):
+            raise ValueError('Request body must be a JSON object')
+        return body
+
+    def _reply(self, status, ok, message, include_status=True):
+        payload = {'ok': ok, 'message': message}
+        if include_status:
+            payload['status'] = self.controller.status()
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        if self.close_connection:
+            self.send_header('Connection', 'close')
+        self.end_headers()
+        self.wfile.write(body)
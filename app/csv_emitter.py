@@ -0,0 +1,225 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+from channel_columns import CHANNEL_COLUMNS, CHANNEL_DECIMALS, CHANNEL_RESOLUTION
+
+TIMESTAMP_FORMAT = '%.6f'  # time.time() seconds, to the microsecond
+DEFAULT_FORMAT = '%.6f'  # Columns without a known resolution (e.g. derived ones)
+
+# Pre-formatted strings cover register values -TABLE_STEPS..TABLE_STEPS, about
+# 1 MB per table: +-8.9 rad/s, +-82 m/s^2 and +-512 uT, beyond any value seen
+# outside violent motion. Batches with larger values are formatted directly.
+TABLE_STEPS = 8192
+_tables = {}  # (resolution, format) -> object array of strings, shared by all emitters
+_NONE_TYPE = type(None)
+
+
+def column_formats(header, overrides=None):
+    """printf-style format per column of `header`, from the channel resolutions.
+
+    Args:
+        header: Column names, e.g. from channel_columns.csv_header()
+        overrides: Dict column name -> format replacing the default
+    """
+    formats = {"Packet number": '%d', "Timestamp": TIMESTAMP_FORMAT}
+    for channel, columns in CHANNEL_COLUMNS.items():
+        decimals = CHANNEL_DECIMALS[channel]
+        formats.update((name, f'%.{decimals}f' if decimals else '%d') for name in columns)
+    formats.update(overrides or {})
+    return [formats.get(name, DEFAULT_FORMAT) for name in header]
+
+
+def _step_table(resolution, column_format):
+    import numpy as np
+    key = (resolution, column_format)
+    table = _tables.get(key)
+    if table is None:
+        # step * resolution is the driver's own raw * scale, so the strings are exact
+        table = np.array([column_format % (step * resolution)
+                          for step in range(-TABLE_STEPS, TABLE_STEPS + 1)], dtype=object)
+        _tables[key] = table
+    return table
+
+
+class CsvEmitter:
+    """Formats whole batches of rows into one CSV text block.
+
+    Instead of converting every number of every row on its own (csv.writer),
+    each run of rows with the same missing columns is formatted by a single
+    %-operation on a repeated row format, with a fixed precision per column
+    (see column_formats).
+
+    Lists of rows, as the recorder queues them, are handled in plain Python,
+    so the live recorder does not need numpy. 2-D arrays from the offline
+    tools take a vectorized path: sensor values are whole register steps, so
+    fractional channel columns are looked up in tables of pre-formatted steps
+    instead of being formatted again, falling back to direct formatting for
+    any batch with values off the step grid (e.g. re-scaled data) or outside
+    the table.
+
+    Missing values (None or NaN) stay empty cells, as csv.writer writes None.
+    The lines end in \\r\\n like csv.writer's, so files stay column-compatible
+    and only the number formatting differs.
+    """
+
+    def __init__(self, header, formats=None, lineterminator='\r\n'):
+        """Initialize the emitter.
+
+        Args:
+            header: Column names of the rows
+            formats: Dict column name -> printf-style format overriding the default
+            lineterminator: End of every line
+        """
+        self.header = list(header)
+        self.formats = column_formats(self.header, formats)
+        self.lineterminator = lineterminator
+        self._row_formats = {}  # (present columns, plan) -> row format
+
+        resolutions = {}
+        for channel, columns in CHANNEL_COLUMNS.items():
+            resolutions.update((name, CHANNEL_RESOLUTION[channel]) for name in columns)
+        # Column index -> (resolution, table) for fractional channel columns
+        self._tables = {}
+        for index, (name, column_format) in enumerate(zip(self.header, self.formats)):
+            if name in resolutions and column_format.endswith('f'):
+                self._tables[index] = resolutions[name], None
+        # Column index -> decimals of the large fixed-point columns (timestamps)
+        self._fixed = {index: int(column_format[2:-1])
+                       for index, column_format in enumerate(self.formats)
+                       if self.header[index] == "Timestamp" and column_format == TIMESTAMP_FORMAT}
+
+    def header_line(self):
+        """The header row, like csv.writer writes it."""
+        return ','.join(self.header) + self.lineterminator
+
+    def format(self, rows):
+        """CSV text of a batch of rows (lists with None for missing values, or a 2-D array)."""
+        if isinstance(rows, (list, tuple)):
+            return self._format_rows(rows)
+        return self._format_array(rows)
+
+    def write(self, f, rows):
+        """Write a batch of rows to the text file `f` in one call."""
+        f.write(self.format(rows))
+
+    def _format_rows(self, rows, check_nan=True):
+        parts = []
+        run = []
+        run_types = None
+        for row in rows:
+            # Rows with the same value types have the same missing (None) columns
+            types = tuple(map(type, row))
+            if types != run_types and run:
+                parts.append(self._format_run(run, run_types, check_nan))
+                run = []
+            run_types = types
+            run.append(row)
+        if run:
+            parts.append(self._format_run(run, run_types, check_nan))
+        return ''.join(parts)
+
+    def _format_run(self, run, types, check_nan=True):
+        present = tuple(value_type is not _NONE_TYPE for value_type in types)
+        if all(present):
+            values = [value for row in run for value in row]
+        else:
+            values = [value for row in run for value in row if value is not None]
+        total = sum(values)
+        if check_nan and total != total:
+            # A NaN somewhere (or inf - inf): write NaN as an empty cell, like None
+            return self._format_rows([[None if value != value else value for value in row]
+                                      for row in run], check_nan=False)
+        row_format = self._row_format(present, ('value',) * len(self.header))
+        return (row_format * len(run)) % tuple(values)
+
+    def _format_array(self, rows):
+        import numpy as np
+        values = np.asarray(rows, dtype=np.float64).reshape(-1, len(self.header))
+        if not len(values):
+            return ''
+        missing = np.isnan(values)
+        cells, widths, plan = self._cells(values, missing)
+        if not missing.any():
+            row_format = self._row_format(~missing[0], plan)
+            return (row_format * len(values)) % tuple(cells.ravel().tolist())
+        # Runs of consecutive rows that leave the same columns empty
+        starts = np.flatnonzero((missing[1:] != missing[:-1]).any(axis=1)) + 1
+        bounds = [0, *starts.tolist(), len(values)]
+        parts = []
+        for start, stop in zip(bounds[:-1], bounds[1:]):
+            present = ~missing[start]
+            parts.append((self._row_format(present, plan) * (stop - start))
+                         % tuple(cells[start:stop, np.repeat(present, widths)].ravel().tolist()))
+        return ''.join(parts)
+
+    def _cells(self, values, missing):
+        """Values to format per column, their number of cells and the format plan.
+
+        The plan has one entry per column: 'table' for strings looked up in a
+        step table, 'fixed' for a non-negative fixed-point number split into
+        whole and fractional integers (much cheaper than float formatting, used
+        for the timestamps) and 'value' for plain formatting.
+        """
+        import numpy as np
+        plan = []
+        columns = []
+        for index, column in enumerate(values.T):
+            column_missing = missing[:, index]
+            kind = 'value'
+            if index in self._tables:
+                resolution, table = self._tables[index]
+                steps = np.rint(column / resolution)
+                usable = column_missing | ((np.abs(steps) <= TABLE_STEPS)
+                                           & (np.abs(column - steps * resolution) <= resolution * 1e-3))
+                if usable.all():
+                    if table is None:
+                        table = _step_table(resolution, self.formats[index])
+                        self._tables[index] = resolution, table
+                    steps[column_missing] = 0
+                    columns.append(table[steps.astype(np.int64) + TABLE_STEPS])
+                    kind = 'table'
+            elif index in self._fixed:
+                decimals = self._fixed[index]
+                scale = 10 ** decimals
+                column = np.where(column_missing, 0.0, column)
+                if ((column >= 0) & (column * scale < 2 ** 53)).all():
+                    # Whole seconds split off exactly, so only the fraction is scaled
+                    whole = np.floor(column)
+                    scaled = (column - whole) * scale
+                    fraction = np.rint(scaled)
+                    whole, fraction = whole.astype(np.int64), fraction.astype(np.int64)
+                    # Near-ties may round differently in the product: format those directly
+                    for row in np.flatnonzero(np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6):
+                        text = f'%.{decimals}f' % column[row]
+                        whole[row], fraction[row] = (int(part) for part in text.split('.'))
+                    carry = fraction == scale
+                    whole[carry] += 1
+                    fraction[carry] = 0
+                    columns.extend((whole, fraction))
+                    kind = 'fixed'
+            if kind == 'value':
+                columns.append(column)
+            plan.append(kind)
+        cells = np.empty((len(values), len(columns)), dtype=object)
+        for position, column in enumerate(columns):
+            cells[:, position] = column
+        widths = [2 if kind == 'fixed' else 1 for kind in plan]
+        return cells, widths, tuple(plan)
+
+    def _row_format(self, present, plan):
+        key = (bytes(present), plan)
+        row_format = self._row_formats.get(key)
+        if row_format is None:
+            fields = []
+            for index, (column_present, kind) in enumerate(zip(present, plan)):
+                if not column_present:
+                    fields.append('')
+                elif kind == 'table':
+                    fields.append('%s')
+                elif kind == 'fixed':
+                    fields.append(f'%d.%0{self._fixed[index]}d')
+                else:
+                    fields.append(self.formats[index])
+            row_format = ','.join(fields) + self.lineterminator
+            self._row_formats[key] = row_format
+        return row_format
@@ -0,0 +1,404 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PROPERTY_LIMIT = 124  # Bytes per file property, key and value together, as in Drive
+
+
+class DriveStubServer:
+    """Local stand-in for the subset of the Drive v3 API used by GoogleDriveUploader.
+
+    Implements the discovery document, files.create and the simple, multipart and
+    resumable upload protocols, with injectable latency, bandwidth caps and failures.
+    Point an uploader at it with::
+
+        server = DriveStubServer(latency=0.05, bandwidth=256 * 1024)
+        server.start()
+        uploader = GoogleDriveUploader(credentials=AnonymousCredentials(),
+                                       discovery_url=server.discovery_url)
+    """
+
+    def __init__(self, host='127.0.0.1', port=0, latency=0.0, bandwidth=None,
+                 failure_rate=0.0, seed=None, discovery_document=None):
+        """Initialize the server (call start() to begin serving).
+
+        Args:
+            host: Interface to listen on
+            port: TCP port, 0 picks a free one
+            latency: Seconds added before every response
+            bandwidth: Upload cap in bytes/s shared by all connections (None = unlimited)
+            failure_rate: Probability that an upload request answers 503
+            seed: Seed for the failure random generator
+            discovery_document: Drive v3 discovery document (dict). Defaults to the
+                                static copy shipped with google-api-python-client
+        """
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.bandwidth = bandwidth
+        self.failure_rate = failure_rate
+        self.discovery_document = discovery_document
+        self.files = {}  # file ID -> metadata of stored files
+        self.stats = {'requests': 0, 'failures_injected': 0, 'bytes_received': 0}
+
+        self._random = random.Random(seed)
+        self._sessions = {}  # upload ID -> resumable session state
+        self._forced_failures = []  # pending fail_next() entries
+        self._failure_delay = 0  # upload requests to pass before forced failures
+        self._lock = threading.Lock()
+        self._link_free_at = 0.0  # bandwidth cap bookkeeping
+        self._httpd = None
+        self._thread = None
+
+    @property
+    def url(self):
+        """Base URL of the running server."""
+        return f'http://{self.host}:{self.port}'
+
+    @property
+    def discovery_url(self):
+        """Discovery service URL to pass to googleapiclient's build()."""
+        return self.url + '/discovery/v1/apis/{api}/{apiVersion}/rest'
+
+    def start(self):
+        """Start serving on a background thread."""
+        if self.discovery_document is None:
+            from googleapiclient import discovery_cache
+            self.discovery_document = json.loads(discovery_cache.get_static_doc('drive', 'v3'))
+        self._httpd = ThreadingHTTPServer((self.host, self.port), _DriveStubHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.stub = self
+        self.port = self._httpd.server_address[1]
+        self._thread = threading.Thread(target=self._httpd.serve_forever, name="drive-stub")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the server."""
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            self._httpd = None
+
+    def fail_next(self, count=1, partial=False, after=0):
+        """Make upcoming upload requests fail with 503.
+
+        Args:
+            count: Number of requests to fail
+            partial: For resumable chunks, commit the first half of the chunk
+                     before failing, as if the connection dropped mid-transfer
+            after: Number of upload requests to let through before failing
+        """
+        with self._lock:
+            self._forced_failures.extend([partial] * count)
+            self._failure_delay = after
+
+    def pending_failures(self):
+        """Number of fail_next() failures that have not been injected yet."""
+        with self._lock:
+            return len(self._forced_failures)
+
+    def reset(self):
+        """Forget stored files, sessions, statistics and pending failures."""
+        with self._lock:
+            self.files.clear()
+            self._sessions.clear()
+            self._forced_failures.clear()
+            self._failure_delay = 0
+            self.stats = {'requests': 0, 'failures_injected': 0, 'bytes_received': 0}
+
+    def _next_failure(self):
+        """Return None for no failure, otherwise whether the failure is partial."""
+        with self._lock:
+            if self._forced_failures and self._failure_delay:
+                self._failure_delay -= 1
+            elif self._forced_failures:
+                self.stats['failures_injected'] += 1
+                return self._forced_failures.pop(0)
+            if self.failure_rate and self._random.random() < self.failure_rate:
+                self.stats['failures_injected'] += 1
+                return False
+        return None
+
+    def _throttle(self, size):
+        """Sleep long enough to keep all uploads under the bandwidth cap."""
+        with self._lock:
+            self.stats['bytes_received'] += size
+            if not self.bandwidth:
+                return
+            now = time.monotonic()
+            start = max(now, self._link_free_at)
+            self._link_free_at = start + size / self.bandwidth
+            delay = self._link_free_at - now
+        time.sleep(delay)
+
+    @staticmethod
+    def _metadata_error(metadata):
+        """Why Drive would reject the file metadata, or None if it is valid."""
+        for key, value in (metadata.get('properties') or {}).items():
+            if len(key.encode()) + len(str(value).encode()) > PROPERTY_LIMIT:
+                return f"Property '{key}' exceeds {PROPERTY_LIMIT} bytes"
+        return None
+
+    def _create_file(self, metadata, content_hash=None, size=0, mime_type=None):
+        file_id = uuid.uuid4().hex
+        record = {
+            'kind': 'drive#file',
+            'id': file_id,
+            'name': metadata.get('name', 'Untitled'),
+            'mimeType': metadata.get('mimeType') or mime_type or 'application/octet-stream',
+            'parents': metadata.get('parents') or [],
+            'properties': metadata.get('properties') or {},
+            'size': str(size),
+            'md5Checksum': content_hash.hexdigest() if content_hash else hashlib.md5().hexdigest(),
+        }
+        with self._lock:
+            self.files[file_id] = record
+        return record
+
+
+class _DriveStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    _READ_SIZE = 64 * 1024
+
+    def log_message(self, format, *args):  # pylint: disable=redefined-builtin
+        pass  # Keep benchmark output clean
+
+    @property
+    def stub(self):
+        return self.server.stub
+
+    def do_GET(self):
+        self._begin()
+        path = urlparse(self.path).path
+        if re.fullmatch(r'/discovery/v1/apis/drive/v3/rest', path):
+            doc = dict(self.stub.discovery_document)
+            doc['rootUrl'] = self.stub.url + '/'
+            doc['baseUrl'] = self.stub.url + '/' + doc.get('servicePath', 'drive/v3/')
+            self._send_json(200, doc)
+        elif path.startswith('/drive/v3/files/'):
+            record = self.stub.files.get(path.rsplit('/', 1)[1])
+            if record:
+                self._send_json(200, self._select_fields(record))
+            else:
+                self._send_error(404, 'File not found')
+        else:
+            self._send_error(404, 'Not found')
+
+    def do_POST(self):
+        self._begin()
+        url = urlparse(self.path)
+        query = parse_qs(url.query)
+        upload_type = query.get('uploadType', [None])[0]
+        if url.path == '/drive/v3/files':
+            metadata = json.loads(self._read_body() or b'{}')
+            error = self.stub._metadata_error(metadata)
+            if error:
+                self._send_error(400, error)
+                return
+            self._send_json(200, self._select_fields(self.stub._create_file(metadata)))
+        elif url.path == '/upload/drive/v3/files' and upload_type == 'media':
+            self._simple_upload()
+        elif url.path == '/upload/drive/v3/files' and upload_type == 'multipart':
+            self._multipart_upload()
+        elif url.path == '/upload/drive/v3/files' and upload_type == 'resumable':
+            self._start_resumable()
+        else:
+            self._read_body()
+            self._send_error(400, 'Unsupported request')
+
+    def do_PUT(self):
+        self._begin()
+        query = parse_qs(urlparse(self.path).query)
+        session = self.stub._sessions.get(query.get('upload_id', [None])[0])
+        if session is None:
+            self._read_body()
+            self._send_error(404, 'Unknown upload session')
+            return
+        self._resumable_chunk(session)
+
+    def _begin(self):
+        with self.stub._lock:
+            self.stub.stats['requests'] += 1
+        if self.stub.latency:
+            time.sleep(self.stub.latency)
+
+    def _read_body(self, sink=None):
+        """Read the request body under the bandwidth cap. Returns it unless sink is given."""
+        remaining = int(self.headers.get('Content-Length', 0))
+        chunks = []
+        while remaining > 0:
+            data = self.rfile.read(min(self._READ_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            self.stub._throttle(len(data))
+            if sink:
+                sink(data)
+            else:
+                chunks.append(data)
+        return None if sink else b''.join(chunks)
+
+    def _simple_upload(self):
+        content_hash = hashlib.md5()
+        size = [0]
+
+        def sink(data):
+            content_hash.update(data)
+            size[0] += len(data)
+
+        self._read_body(sink)
+        if self.stub._next_failure() is not None:
+            self._send_error(503, 'Injected failure')
+            return
+        record = self.stub._create_file({}, content_hash, size[0], self.headers.get('Content-Type'))
+        self._send_json(200, self._select_fields(record))
+
+    def _multipart_upload(self):
+        body = self._read_body()
+        if self.stub._next_failure() is not None:
+            self._send_error(503, 'Injected failure')
+            return
+        match = re.search(r'boundary="?([^";]+)"?', self.headers.get('Content-Type', ''))
+        if not match:
+            self._send_error(400, 'Missing multipart boundary')
+            return
+        delimiter = b'--' + match.group(1).encode()
+        parts = [p for p in body.split(delimiter)[1:] if not p.startswith(b'--')]
+        if len(parts) != 2:
+            self._send_error(400, 'Expected metadata and media parts')
+            return
+        sections = []
+        for part in parts:
+            head, _, payload = part.partition(b'\r\n\r\n')
+            if not _:
+                head, _, payload = part.partition(b'\n\n')
+            sections.append((head, payload[:-2] if payload.endswith(b'\r\n') else payload.rstrip(b'\n')))
+        metadata = json.loads(sections[0][1] or b'{}')
+        error = self.stub._metadata_error(metadata)
+        if error:
+            self._send_error(400, error)
+            return
+        media_type = re.search(rb'[Cc]ontent-[Tt]ype:\s*([^\r\n]+)', sections[1][0])
+        media = sections[1][1]
+        record = self.stub._create_file(metadata, hashlib.md5(media), len(media),
+                                        media_type.group(1).decode() if media_type else None)
+        self._send_json(200, self._select_fields(record))
+
+    def _start_resumable(self):
+        metadata = json.loads(self._read_body() or b'{}')
+        error = self.stub._metadata_error(metadata)
+        if error:
+            self._send_error(400, error)
+            return
+        if self.stub._next_failure() is not None:
+            self._send_error(503, 'Injected failure')
+            return
+        upload_id = uuid.uuid4().hex
+        total = self.headers.get('X-Upload-Content-Length')
+        self.stub._sessions[upload_id] = {
+            'metadata': metadata,
+            'mime_type': self.headers.get('X-Upload-Content-Type'),
+            'total': int(total) if total else None,
+            'received': 0,
+            'hash': hashlib.md5(),
+            'record': None,
+            'fields': parse_qs(urlparse(self.path).query).get('fields', [None])[0],
+        }
+        location = f'{self.stub.url}/upload/drive/v3/files?uploadType=resumable&upload_id={upload_id}'
+        self._send(200, b'', {'Location': location})
+
+    def _resumable_chunk(self, session):
+        content_range = self.headers.get('Content-Range', '')
+        status_query = re.fullmatch(r'bytes \*/(\d+|\*)', content_range)
+        chunk = re.fullmatch(r'bytes (\d+)-(\d+)/(\d+|\*)', content_range)
+        failure = None
+
+        if status_query or not chunk:
+            self._read_body()
+            if status_query and status_query.group(1) != '*':
+                session['total'] = int(status_query.group(1))
+        else:
+            start = int(chunk.group(1))
+            if chunk.group(3) != '*':
+                session['total'] = int(chunk.group(3))
+            if start > session['received']:
+                self._read_body()
+                self._send_error(400, 'Chunk does not continue the upload')
+                return
+            failure = self.stub._next_failure()
+            length = int(self.headers.get('Content-Length', 0))
+            # A dropped connection commits half of the chunk, a failed request nothing
+            keep = length if failure is None else length // 2 if failure else 0
+            offset = [start]
+
+            def sink(data):
+                # Skip bytes the server already has (client resent an overlapping chunk)
+                # and, for partial failures, everything past the committed half
+                data_start = offset[0]
+                offset[0] += len(data)
+                low = max(data_start, session['received'])
+                high = min(offset[0], start + keep)
+                if high > low:
+                    session['hash'].update(data[low - data_start:high - data_start])
+                    session['received'] += high - low
+
+            self._read_body(sink)
+
+        if failure is not None:
+            self._send_error(503, 'Injected failure')
+        elif session['record'] is None and session['total'] is not None \
+                and session['received'] >= session['total']:
+            session['record'] = self.stub._create_file(
+                session['metadata'], session['hash'], session['received'], session['mime_type'])
+            self._send_json(200, self._select_fields(session['record'], session['fields']))
+        elif session['record'] is not None:
+            self._send_json(200, self._select_fields(session['record'], session['fields']))
+        else:
+            headers = {}
+            if session['received']:
+                headers['Range'] = f"bytes=0-{session['received'] - 1}"
+            self._send(308, b'', headers)
+
+    def _select_fields(self, record, fields=None):
+        if fields is None:
+            fields = parse_qs(urlparse(self.path).query).get('fields', [None])[0]
+        if not fields:
+            return {key: record[key] for key in ('kind', 'id', 'name', 'mimeType')}
+        keys = [key.strip() for key in fields.split(',')]
+        return {key: record[key] for key in keys if key in record}
+
+    def _send_json(self, status, payload):
+        self._send(status, json.dumps(payload).encode(), {'Content-Type': 'application/json'})
+
+    def _send_error(self, status, message):
+        self._send_json(status, {'error': {'code': status, 'message': message}})
+
+    def _send(self, status, body, headers):
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+if __name__ == '__main__':
+    server = DriveStubServer(port=8765)
+    server.start()
+    print(f'Drive v3 stand-in listening on {server.url}')
+    print(f'Discovery URL: {server.discovery_url}')
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()
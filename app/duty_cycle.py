@@ -0,0 +1,203 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import csv
+import time
+
+# Typical BNO055 supply current (datasheet table 0-2), for the sensor's share of the budget
+NORMAL_CURRENT_MA = 12.3  # NDOF fusion, all sensors on
+SUSPEND_CURRENT_MA = 0.04
+
+BURST_COLUMNS = ["Burst", "Wake", "Start", "End", "First packet", "Last packet",
+                 "Samples", "Wake latency (ms)"]
+
+
+class DutyCycle:
+    """Samples in short bursts and keeps the sensor suspended in between.
+
+    Every `period_seconds` the sensor is woken (resume()), left to settle for
+    `settle_seconds` and sampled at the full rate for `burst_seconds`, then
+    suspended again. Wake-ups start early by the measured transition time plus
+    the settle time, so bursts begin on schedule. If the gap between bursts is
+    too short to be worth a suspend/resume cycle the sensor simply stays on.
+
+    Burst times are wall-clock timestamps like the sample timestamps, so the
+    burst log (write_bursts) lines up with the recording.
+    """
+
+    def __init__(self, sensor, burst_seconds, period_seconds, settle_seconds=0.5,
+                 clock=time.monotonic, sleep=time.sleep):
+        """Initialize the duty cycle.
+
+        Args:
+            sensor: BNO055 driver instance (needs suspend() and resume())
+            burst_seconds: Seconds of full-rate sampling per burst
+            period_seconds: Seconds from the start of one burst to the next
+            settle_seconds: Seconds to wait after waking before sampling
+            clock: Monotonic clock in seconds used for scheduling
+            sleep: Sleep function (seconds)
+        """
+        if not 0 < burst_seconds <= period_seconds:
+            raise ValueError("Duty cycle needs 0 < burst_seconds <= period_seconds")
+        self.sensor = sensor
+        self.burst_seconds = burst_seconds
+        self.period_seconds = period_seconds
+        self.settle_seconds = settle_seconds
+        self.clock = clock
+        self.sleep = sleep
+        self.wake_cost = 0.05  # Decaying peak of the resume() duration (seconds)
+        self.suspend_cost = 0.03  # Decaying peak of the suspend() duration (seconds)
+        self.bursts = []  # One dict per finished burst, see BURST_COLUMNS
+        self.transitions = 0  # Power mode changes (suspend and wake each count)
+        self.suspended = False
+        self.last_activity = clock()  # For watchdogs: sampling or scheduled sleep
+
+        self._started = self.clock()
+        self._next_start = self._started  # Planned start of the next burst's sampling
+        self._burst = None  # Burst in progress
+        self._burst_start = 0.0
+        self._burst_end = 0.0
+        self._sampling_seconds = 0.0  # Of finished bursts
+        self._suspended_since = None
+        self._suspended_seconds = 0.0
+
+    def sampling(self):
+        """True while the current burst is still running."""
+        now = self.clock()
+        if self._burst is not None and now < self._burst_end:
+            self.last_activity = now
+            return True
+        return False
+
+    def wait_for_burst(self, keep_waiting):
+        """End the current burst and return once the next one starts.
+
+        Suspends the sensor when the gap allows it, sleeps in short steps while
+        `keep_waiting()` returns True, wakes it ahead of time and lets it settle.
+
+        Returns:
+            True when the next burst has started, False if waiting was cancelled
+        """
+        if self._burst is not None:
+            self._finish_burst()
+        now = self.clock()
+        if self._burst_end:
+            # Keep the phase, but never try to catch up on missed bursts
+            self._next_start += self.period_seconds
+            while self._next_start < now:
+                self._next_start += self.period_seconds
+        lead = self.wake_cost + self.settle_seconds
+        if not self.suspended and self._next_start - now > lead + self.suspend_cost:
+            self._suspend()
+
+        wake_at = self._next_start - lead if self.suspended else self._next_start
+        while True:
+            now = self.clock()
+            self.last_activity = now
+            if not keep_waiting():
+                return False
+            if now >= wake_at:
+                break
+            self.sleep(min(0.1, wake_at - now))
+
+        wake = time.time()
+        wake_latency = 0.0
+        if self.suspended:
+            wake_latency = self._resume()
+            self.sleep(self.settle_seconds)
+        self._burst_start = self.clock()
+        self._burst_end = self._burst_start + self.burst_seconds
+        self._burst = {"Burst": len(self.bursts) + 1, "Wake": wake, "Start": None, "End": None,
+                       "First packet": None, "Last packet": None, "Samples": 0,
+                       "Wake latency (ms)": round(wake_latency * 1000, 3)}
+        return True
+
+    def record_sample(self, packet_number, timestamp):
+        """Tag a sample of the current burst."""
+        burst = self._burst
+        if burst is None:
+            return
+        if burst["Samples"] == 0:
+            burst["Start"] = timestamp
+            burst["First packet"] = packet_number
+        burst["End"] = timestamp
+        burst["Last packet"] = packet_number
+        burst["Samples"] += 1
+
+    def close(self):
+        """Finish the current burst and leave the sensor awake."""
+        if self._burst is not None:
+            self._finish_burst()
+        if self.suspended:
+            self._resume()
+
+    def sampling_seconds(self):
+        """Seconds spent in bursts so far (what the sample count should be measured against)."""
+        current = 0.0
+        if self._burst is not None:
+            current = min(self.clock(), self._burst_end) - self._burst_start
+        return self._sampling_seconds + current
+
+    def _finish_burst(self):
+        self._sampling_seconds += min(self.clock(), self._burst_end) - self._burst_start
+        if self._burst["Samples"]:
+            self.bursts.append(self._burst)
+        self._burst = None
+
+    def _suspend(self):
+        started = self.clock()
+        try:
+            self.sensor.suspend()
+        except Exception as e:
+            print(f"Error suspending the sensor: {e}")
+            return
+        finished = self.clock()
+        self.suspend_cost = max(finished - started, self.suspend_cost * 0.9)
+        self.suspended = True
+        self._suspended_since = finished
+        self.transitions += 1
+
+    def _resume(self):
+        started = self.clock()
+        try:
+            self.sensor.resume()
+        except Exception as e:
+            print(f"Error waking the sensor: {e}")
+        finished = self.clock()
+        self.wake_cost = max(finished - started, self.wake_cost * 0.9)
+        self._suspended_seconds += started - self._suspended_since
+        self.suspended = False
+        self._suspended_since = None
+        self.transitions += 1
+        return finished - started
+
+    def stats(self):
+        """Energy-relevant metrics of the duty cycle so far."""
+        now = self.clock()
+        elapsed = now - self._started
+        suspended = self._suspended_seconds
+        if self._suspended_since is not None:
+            suspended += now - self._suspended_since
+        active_fraction = 1.0 - suspended / elapsed if elapsed > 0 else 1.0
+        return {
+            'burst_seconds': self.burst_seconds,
+            'period_seconds': self.period_seconds,
+            'bursts': len(self.bursts),
+            'sampling_seconds': round(self.sampling_seconds(), 3),
+            'suspended': self.suspended,
+            'active_fraction': round(active_fraction, 4),
+            'transitions': self.transitions,
+            'transitions_per_hour': round(self.transitions * 3600 / elapsed, 1) if elapsed > 0 else 0.0,
+            'wake_ms': round(self.wake_cost * 1000, 3),
+            'suspend_ms': round(self.suspend_cost * 1000, 3),
+            # Sensor only; the Pi's own draw dominates the pack's runtime
+            'sensor_current_ma': round(active_fraction * NORMAL_CURRENT_MA
+                                       + (1 - active_fraction) * SUSPEND_CURRENT_MA, 3),
+        }
+
+    def write_bursts(self, path):
+        """Write the burst log (one row per burst, see BURST_COLUMNS) as CSV."""
+        with open(path, 'w', newline='') as f:
+            writer = csv.DictWriter(f, fieldnames=BURST_COLUMNS)
+            writer.writeheader()
+            writer.writerows(self.bursts)
@@ -9,96 +9,168 @@ import csv
 import threading
 import os
 from datetime import datetime
-from upload_togoogle import GoogleDriveUploader
-# Import SensorUI from the separate file
-from sensor_ui import SensorUI
+from upload_togoogle import GoogleDriveUploader, BackgroundUploader, AdaptiveRateLimiter
+from recording_writer import RecordingWriter
+from live_stream import SampleStreamServer
+from sensor_plot import SampleRingBuffer
+from sample_snapshot import SampleSnapshot
+from recording_control import RecordingController
+from control_api import ControlServer
+from channel_columns import DEFAULT_CHANNELS, csv_header as channel_csv_header, csv_row
+from realtime import WakeupLatency, configure_thread
+from channel_scheduler import MultiRateScheduler
+from calibration_store import CalibrationStore, encode_profile, unit_key
+from duty_cycle import DutyCycle
 
 
 
 
-i2c = board.I2C()  # uses board.SCL and board.SDA
-sensor = adafruit_bno055.BNO055_I2C(i2c)
-# Set calibration offsets
-# update calibration offsets
-calibration_data = {
-    "accel_offset_x": -35,    
-    "accel_offset_y": -43, 
-    "accel_offset_z": -42,     
+# Adapter number N to read /dev/i2c-N directly with ioctls instead of through
+# Blinka, e.g. 1 on a Raspberry Pi (see bench_i2c.py). None uses board.I2C()
+I2C_DEV_BUS = None
+if I2C_DEV_BUS is None:
+    i2c = board.I2C()  # uses board.SCL and board.SDA
+    sensor = adafruit_bno055.BNO055_I2C(i2c)
+else:
+    sensor = adafruit_bno055.BNO055_I2CDev(I2C_DEV_BUS)
+
+# Calibration profiles are captured automatically once the sensor reports full
+# calibration during a recording (saved when it stops) and restored at start-up
+# with one bulk write. Units without a saved profile start from FALLBACK_CALIBRATION
+CALIBRATION_STORE = "calibration_profiles.json"
+UNIT_ID = None  # Key of this unit's profile; defaults to the host name
+FALLBACK_CALIBRATION = {
+    "accel_offset_x": -35,
+    "accel_offset_y": -43,
+    "accel_offset_z": -42,
     "gyro_offset_x": 0,
     "gyro_offset_y": -1,
     "gyro_offset_z": 2,
     "mag_offset_x": -216,
     "mag_offset_y": -76,
     "mag_offset_z": 250,
-    "accel_radius": 1000,  
+    "accel_radius": 1000,
     "mag_radius": 1000
 }
 
-sensor.offsets_accelerometer = (
-    calibration_data["accel_offset_x"],
-    calibration_data["accel_offset_y"],
-    calibration_data["accel_offset_z"]
-)
-sensor.offsets_gyroscope = (
-    calibration_data["gyro_offset_x"],
-    calibration_data["gyro_offset_y"],
-    calibration_data["gyro_offset_z"]
-)
-sensor.offsets_magnetometer = (
-    calibration_data["mag_offset_x"],
-    calibration_data["mag_offset_y"],
-    calibration_data["mag_offset_z"]
-)
-
-
-google_uploader = GoogleDriveUploader()
+calibration_store = CalibrationStore(CALIBRATION_STORE)
+calibration_key = unit_key(UNIT_ID)
+restored = calibration_store.restore(sensor, calibration_key, encode_profile(FALLBACK_CALIBRATION))
+print(f"Calibration profile for {calibration_key}: {restored or 'none restored'}")
+
+
+UPLOAD_RATE_LIMIT = 256 * 1024  # Upload bytes/s allowed while recording
+UPLOAD_COMPRESSION = 'gzip'  # Codec applied before upload (None uploads plain CSV)
+UPLOAD_COMPRESSION_LEVEL = 6
+
+
+def recorder_load():
+    # Load probe for the upload limiter: None while idle, else (queue depth, sampling lag)
+    writer = global_vars.get('writer')
+    if not global_vars['collecting_data'] or writer is None:
+        return None
+    return writer.queue_depth(), global_vars['sampler_lag']
+
+
+# Uploads that overlap a recording are paced so they never starve the sampler or writer
+upload_limiter = AdaptiveRateLimiter(max_rate=UPLOAD_RATE_LIMIT, load_probe=recorder_load)
+google_uploader = GoogleDriveUploader(rate_limiter=upload_limiter,
+                                      compression=UPLOAD_COMPRESSION,
+                                      compression_level=UPLOAD_COMPRESSION_LEVEL)
+upload_queue = BackgroundUploader(google_uploader)
+
+# Live sample stream for local monitoring, e.g. ('0.0.0.0', 5055) or '/tmp/bno055.sock'
+LIVE_STREAM_ADDRESS = None
+live_stream = SampleStreamServer(LIVE_STREAM_ADDRESS) if LIVE_STREAM_ADDRESS else None
+
+# HTTP/JSON control API for scripted starts and stops, e.g. ('0.0.0.0', 8055)
+CONTROL_API_ADDRESS = None
+CONTROL_API_TOKEN = None  # Required in the X-Api-Token header when set
 
 # CSV file settings
 csv_dir = "sensor_data/"
 csv_filename = ""
-csv_header = ["Packet number", "Gyroscope X (deg/s)", "Gyroscope Y (deg/s)", "Gyroscope Z (deg/s)", 
-            "Accelerometer X (g)", "Accelerometer Y (g)", "Accelerometer Z (g)","Magnetometer X (microteslas)","Magnetometer Y (microteslas)","Magnetometer Z (microteslas)","Timestamp"]
+# Sensor channels recorded per sample, read in as few register bursts as possible.
+# Any of adafruit_bno055.CHANNELS, e.g. add "euler" or "quaternion" for fused orientation
+RECORD_CHANNELS = DEFAULT_CHANNELS
+# Slowly changing channels read at their own rate (Hz) in the slack between samples.
+# They are stored as sparse columns: empty except on the rows where they were read
+SLOW_CHANNELS = {"calibration_status": 1.0, "temperature": 0.2}
+SLOW_READS = {
+    "calibration_status": lambda: sensor.calibration_status,
+    "temperature": lambda: sensor.temperature,
+}
+CSV_CHANNELS = tuple(RECORD_CHANNELS) + tuple(SLOW_CHANNELS)
+csv_header = channel_csv_header(CSV_CHANNELS)
+NO_VALUES = (None, None, None)  # Stands in for channels that are not recorded
 
 # Global variables for UI updates and thread communication
 FREQUENCY = 50
+LIVE_SYNC = False  # Upload finished segments in the background while recording
+SEGMENT_SECONDS = 60  # Segment length used when live sync is enabled
+# Real-time sampling on a loaded Pi (Linux). Needs root or rtprio/memlock limits;
+# whatever is not permitted is skipped with a warning (see realtime.py)
+SAMPLER_REALTIME = {
+    'policy': None,  # 'fifo' or 'rr' to run the sampler thread at real-time priority
+    'priority': 50,  # 1-99; above the kernel's threaded IRQs (50) only if needed
+    'cpus': None,  # e.g. {3} to pin the sampler to a core (best with isolcpus=3)
+    'memory_lock': False,  # mlockall() so page faults never stall the sampler
+}
+INDEX_INTERVAL = 500  # Rows between time index entries (<file>.idx) for fast window reads
+# Running per-channel statistics in the UI and <file>_summary.json (loads numpy)
+RECORDING_SUMMARY = True
+# 'csv', or 'blocks' for crash-safe .rec files: preallocated, CRC-checked blocks
+# that block_recording.py recovers after a power cut (flush_interval of data at risk)
+RECORDING_FORMAT = 'csv'
+# Motion-triggered recording: sample continuously, store only around motion events
+TRIGGER_MODE = None  # None stores everything; 'threshold' or 'energy' (RMS over a window)
+TRIGGER_PRE_SECONDS = 5  # Samples kept in memory and written before each event
+TRIGGER_HOLD_SECONDS = 5  # Keep writing this long after the last motion sample
+TRIGGER_ACCEL_THRESHOLD = 1.5  # Deviation from 1 g in m/s^2
+TRIGGER_GYRO_THRESHOLD = 0.5  # rad/s
+# Duty-cycled sampling for battery deployments: full-rate bursts, sensor suspended
+# in between. E.g. {'burst_seconds': 2, 'period_seconds': 60, 'settle_seconds': 0.5}
+# samples 2 s every minute; each burst is logged in <recording>_bursts.csv
+DUTY_CYCLE = None
 packet_counter = 0
 running = True
 ui_active = False
 collecting_data = False  # Flag to indicate if data collection is active
-
-# These variables will be used to communicate between threads
-latest_gyro = None
-latest_accel = None
-latest_mag = None
-latest_timestamp = None
-latest_timestamp_str = None
-latest_error = None
 start_time = None  # For tracking duration
-elapsed_ms = 0  # Elapsed time in milliseconds
 
 # Create a dictionary to hold global variables that need to be shared with the UI
 global_vars = {
-    'packet_counter': packet_counter,
+    'frequency': FREQUENCY,
     'running': running,
     'ui_active': ui_active,
     'collecting_data': collecting_data,
-    'latest_gyro': latest_gyro,
-    'latest_accel': latest_accel,
-    'latest_mag': latest_mag,
-    'latest_timestamp': latest_timestamp,
-    'latest_timestamp_str': latest_timestamp_str,
-    'latest_error': latest_error,
+    'sample': SampleSnapshot(),  # Latest sample; replaced as a whole, never modified
     'csv_filename': csv_filename,
+    'recording_tags': {},  # Tags of the current recording, uploaded as Drive properties
     'google_uploader': google_uploader,
+    'upload_queue': upload_queue,
+    'live_sync': LIVE_SYNC,
+    'trigger_mode': TRIGGER_MODE,
+    'recording_format': RECORDING_FORMAT,
+    'duty_cycle': DUTY_CYCLE,
+    'duty_cycler': None,  # DutyCycle of the current recording
+    'segment_files': [],  # Files written by the current recording
+    'writer': None,  # RecordingWriter of the current recording
+    'channel_stats': None,  # RunningStats of the current (or last) recording
+    'sampler_lag': 0.0,  # Decaying peak of how late the sampler wakes up (seconds)
+    'sampler_realtime': SAMPLER_REALTIME,
+    'sampler_latency': None,  # WakeupLatency of the current recording
+    'slow_channels': None,  # MultiRateScheduler of the current recording
+    'live_stream': live_stream,
+    'plot_buffer': SampleRingBuffer(),  # Recent samples for the live plots in SensorUI
     'custom_filename_provided': False,  # Flag to indicate if user provided a custom filename
-    'start_time': start_time,  # Time when recording started
-    'elapsed_ms': elapsed_ms  # Elapsed time in milliseconds
+    'start_time': start_time  # Time when recording started
 }
 
 
 # Data collection function - now runs in a separate thread
 def collect_data():
-    global packet_counter, running, latest_gyro, latest_accel, latest_mag, latest_timestamp, latest_timestamp_str, latest_error, collecting_data, csv_filename, global_vars
+    global packet_counter, running, collecting_data, csv_filename, global_vars
     
     print("Data collection function running in separate thread")
     
@@ -118,13 +190,57 @@ def collect_data():
         os.makedirs(os.path.dirname(csv_filename), exist_ok=True)
         print(f"Creating new CSV file with user-provided name: {csv_filename}")
     
-    # Initialize CSV file
-    with open(csv_filename, 'w', newline='') as csvfile:
-        csv_writer = csv.writer(csvfile)
-        csv_writer.writerow(csv_header)
+    # Initialize CSV file(s). In live sync mode every closed segment is queued for upload
+    live_sync = global_vars.get('live_sync', False)
+    upload_queue = global_vars['upload_queue']
+    tags = global_vars.get('recording_tags')
+    if live_sync:
+        upload_queue.reset()
+    segment_seconds = SEGMENT_SECONDS if live_sync else None
+    on_segment_closed = (lambda path: upload_queue.enqueue(path, tags)) if live_sync else None
+    if global_vars.get('recording_format') == 'blocks':
+        from block_recording import BlockRecordingWriter  # Needs numpy, so only for this format
+        writer = BlockRecordingWriter(csv_filename, csv_header, segment_seconds=segment_seconds,
+                                      on_segment_closed=on_segment_closed,
+                                      summary=RECORDING_SUMMARY)
+        csv_filename = writer.csv_filename  # .rec instead of .csv
+        global_vars['csv_filename'] = csv_filename
+    else:
+        writer = RecordingWriter(csv_filename, csv_header, segment_seconds=segment_seconds,
+                                 on_segment_closed=on_segment_closed,
+                                 index_interval=INDEX_INTERVAL, summary=RECORDING_SUMMARY)
+    trigger_mode = global_vars.get('trigger_mode')
+    if trigger_mode:
+        from motion_trigger import MotionDetector, TriggeredWriter  # Needs numpy
+        # Only the pre-trigger window and the event itself reach the writer
+        detector = MotionDetector(trigger_mode, TRIGGER_ACCEL_THRESHOLD, TRIGGER_GYRO_THRESHOLD)
+        writer = TriggeredWriter(writer, csv_header, detector, FREQUENCY,
+                                 pre_seconds=TRIGGER_PRE_SECONDS, hold_seconds=TRIGGER_HOLD_SECONDS)
+    global_vars['segment_files'] = writer.segments
+    global_vars['writer'] = writer
+    global_vars['channel_stats'] = writer.stats
+    writer.start()
+    
+    stream = global_vars.get('live_stream')
+    if stream:
+        stream.start()
+    plot_buffer = global_vars.get('plot_buffer')
     
-    # Initialize recording start time
+    # After the helper threads are started, so they keep normal priority
+    latency = WakeupLatency(applied=configure_thread(**global_vars['sampler_realtime']))
+    global_vars['sampler_latency'] = latency
+    slow_reads = MultiRateScheduler({name: (rate, SLOW_READS[name])
+                                     for name, rate in SLOW_CHANNELS.items()})
+    global_vars['slow_channels'] = slow_reads
+    duty_cycle = None
+    if global_vars.get('duty_cycle'):
+        duty_cycle = DutyCycle(sensor, **global_vars['duty_cycle'])
+    global_vars['duty_cycler'] = duty_cycle
+    
+    # Initialize recording start time; packet numbers restart with every recording
     recording_start_time = None
+    packet_counter = 0
+    calibrated = False  # Sensor reported full calibration during this recording
     running = global_vars['running']
     
     while running:
@@ -141,76 +257,111 @@ def collect_data():
             # Calculate elapsed time since recording started (in milliseconds)
             current_time = time.time()
             elapsed_ms = int((current_time - recording_start_time) * 1000)
-            global_vars['elapsed_ms'] = elapsed_ms
+            
+            if duty_cycle and not duty_cycle.sampling():
+                # Between bursts: suspend until the next one (or until stopped)
+                duty_cycle.wait_for_burst(
+                    lambda: global_vars['collecting_data'] and global_vars['running'])
+                continue
             
             try:
                 # Get sensor data - priority on speed and accuracy
                 iteration_start_time = time.time()  # For timing this iteration
-                gyro = sensor.gyro
-                accel = sensor.acceleration
-                mag = sensor.magnetic
+                values = sensor.read_channels(RECORD_CHANNELS)
                 timestamp = time.time()
-                timestamp_str = datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
-
-                # Write raw data to CSV file
-                if csv_filename:
-                    with open(csv_filename, 'a', newline='') as csvfile:
-                        csv_writer = csv.writer(csvfile)
-                        csv_writer.writerow([
-                            packet_counter,
-                            gyro[0], gyro[1], gyro[2],
-                            accel[0], accel[1], accel[2],
-                            mag[0], mag[1], mag[2],
-                            timestamp
-                        ])
+                # Low-rate channels only in what is left of this sample period
+                deadline = time.perf_counter() + 1/FREQUENCY - (timestamp - iteration_start_time)
+                values.update(slow_reads.run(deadline))
+                if values.get("calibration_status") == (3, 3, 3, 3):
+                    calibrated = True
+                gyro = values.get("gyro", NO_VALUES)
+                accel = values.get("acceleration", NO_VALUES)
+                mag = values.get("magnetic", NO_VALUES)
+
+                # Hand raw data to the writer thread
+                writer.write(csv_row(packet_counter, values, CSV_CHANNELS, timestamp))
+                if duty_cycle:
+                    duty_cycle.record_sample(packet_counter, timestamp)
                 
-                # Update shared variables for UI thread to use
-                latest_gyro = gyro
-                latest_accel = accel
-                latest_mag = mag
-                latest_timestamp = timestamp
-                latest_timestamp_str = timestamp_str
-                latest_error = None
+                # Publish to live subscribers (never blocks on slow clients)
+                if stream:
+                    stream.publish(packet_counter, timestamp, gyro, accel, mag)
+                if plot_buffer:
+                    plot_buffer.append(gyro, accel, mag)
                 
-                # Update the global_vars dictionary
-                global_vars['latest_gyro'] = gyro
-                global_vars['latest_accel'] = accel
-                global_vars['latest_mag'] = mag
-                global_vars['latest_timestamp'] = timestamp
-                global_vars['latest_timestamp_str'] = timestamp_str
-                global_vars['latest_error'] = None
-
                 # Increment counter
                 packet_counter += 1
-                global_vars['packet_counter'] = packet_counter
+
+                # Publish the sample for the UI thread in one reference store,
+                # so readers never see values from two different samples
+                global_vars['sample'] = SampleSnapshot(
+                    global_vars['sample'].seq + 1, packet_counter, timestamp, elapsed_ms,
+                    gyro, accel, mag)
                 
                 # Calculate sleep time to maintain desired frequency
                 iteration_elapsed = time.time() - iteration_start_time
                 sleep_time = max(0, 1/FREQUENCY - iteration_elapsed)  # Ensure we don't get negative sleep time
+                wake_target = time.perf_counter() + sleep_time
                 time.sleep(sleep_time)
+                latency.record(max(0.0, time.perf_counter() - wake_target))
+                
+                # Track how late we woke up so background uploads can back off
+                lag = max(0.0, time.time() - iteration_start_time - 1/FREQUENCY)
+                global_vars['sampler_lag'] = max(lag, global_vars['sampler_lag'] * 0.9)
                 
             except Exception as e:
                 print("Error occurred:", e)
-                latest_error = str(e)
-                global_vars['latest_error'] = str(e)
+                global_vars['sample'] = global_vars['sample'].with_error(str(e), elapsed_ms)
                 time.sleep(0.5)
         else:
             # If not collecting data, reset time tracking
             recording_start_time = None
             global_vars['start_time'] = None
-            global_vars['elapsed_ms'] = 0
+            sample = global_vars['sample']
+            if sample.elapsed_ms:
+                global_vars['sample'] = SampleSnapshot(
+                    sample.seq + 1, sample.packet_counter, sample.timestamp, 0,
+                    sample.gyro, sample.accel, sample.mag, sample.error)
             
             # Sleep briefly to avoid consuming CPU
             time.sleep(0.1)
     
+    # Flush remaining rows and close the last file (queues it for upload in live sync mode)
+    writer.close()
+    global_vars['writer'] = None
+    if duty_cycle:
+        duty_cycle.close()  # Sensor awake again for whatever comes next
+        bursts_path = os.path.splitext(csv_filename)[0] + '_bursts.csv'
+        try:
+            duty_cycle.write_bursts(bursts_path)
+        except OSError as e:
+            print(f"Error writing burst log {bursts_path}: {e}")
+        stats = duty_cycle.stats()
+        print(f"Duty cycle: {stats['bursts']} bursts, active {stats['active_fraction']:.1%}, "
+              f"{stats['transitions_per_hour']} transitions/h, wake {stats['wake_ms']} ms")
+    # Capturing switches the sensor to config mode, so only once sampling has ended
+    if calibrated:
+        calibration_store.capture(sensor, calibration_key)
+    summary = latency.summary()
+    print(f"Sampler wake-up latency: p50 {summary['p50_us']} us, p99 {summary['p99_us']} us, "
+          f"max {summary['max_us']} us (policy {summary['policy'] or 'default'}, "
+          f"cpus {summary['cpus'] or 'any'}, memory locked {summary['memory_locked']})")
     print("Data collection function exited")
 
 # Main function to start the application
 def main():
     global global_vars
     
+    # Imported here so the headless daemon (recorder_daemon.py) never loads Tk
+    from sensor_ui import SensorUI
+    
+    # One state machine for the buttons and the control API
+    controller = RecordingController(collect_data, global_vars, csv_dir=csv_dir)
+    if CONTROL_API_ADDRESS:
+        ControlServer(controller, CONTROL_API_ADDRESS, CONTROL_API_TOKEN).start()
+    
     # Create the UI object with references to the data collection function and global variables
-    sensor_ui = SensorUI(collect_data, global_vars)
+    sensor_ui = SensorUI(collect_data, global_vars, controller)
     
     # Run the UI in the main thread
     sensor_ui.run()
@@ -0,0 +1,226 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Publish live samples to local subscribers over a TCP or UNIX socket.
+
+Wire format: on connect the server sends an 8-byte header (magic b'BNO1',
+uint16 record size, uint16 reserved), followed by fixed-size little-endian
+records:
+
+    uint32  packet number
+    float64 timestamp (seconds since the epoch)
+    float32 gyro x, y, z, accel x, y, z, mag x, y, z   (NaN when unavailable)
+
+A client may send a uint16 decimation factor right after connecting to receive
+every Nth sample only. Each subscriber has its own bounded queue that drops the
+oldest records when full, so a slow client never stalls the sampler.
+
+Run this module as a script to print a live stream:
+    python live_stream.py HOST:PORT|SOCKET_PATH [DECIMATION]
+"""
+
+import collections
+import math
+import os
+import socket
+import struct
+import sys
+import threading
+
+MAGIC = b'BNO1'
+RECORD = struct.Struct('<Id9f')
+HEADER = struct.Struct('<4sHH')
+DECIMATION = struct.Struct('<H')
+_NAN_TRIPLE = (math.nan, math.nan, math.nan)
+
+
+def _create_socket(address):
+    if isinstance(address, str):
+        return socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    return socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+
+
+class _Subscriber:
+    """One connected client with its own drop-oldest queue and sender thread."""
+
+    def __init__(self, server, conn, name):
+        self.server = server
+        self.conn = conn
+        self.name = name
+        self.decimation = 1
+        self.queue = collections.deque(maxlen=server.queue_length)
+        self.dropped = 0
+        self.sent = 0
+        self.ready = threading.Event()
+        self.closed = False
+
+    def offer(self, packet_number, record):
+        if packet_number % self.decimation:
+            return
+        if len(self.queue) == self.queue.maxlen:
+            self.dropped += 1  # deque discards the oldest record on append
+        self.queue.append(record)
+        self.ready.set()
+
+    def run(self):
+        try:
+            self.conn.sendall(HEADER.pack(MAGIC, RECORD.size, 0))
+            self._read_decimation()
+            while not self.closed:
+                self.ready.wait(0.5)
+                self.ready.clear()
+                records = []
+                while self.queue:
+                    records.append(self.queue.popleft())
+                if records:
+                    self.conn.sendall(b''.join(records))
+                    self.sent += len(records)
+        except OSError:
+            pass  # Client went away
+        finally:
+            self.close()
+
+    def _read_decimation(self):
+        self.conn.settimeout(0.5)
+        try:
+            data = self.conn.recv(DECIMATION.size)
+            if len(data) == DECIMATION.size:
+                self.decimation = max(1, DECIMATION.unpack(data)[0])
+        except socket.timeout:
+            pass
+        self.conn.settimeout(None)
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.ready.set()
+            try:
+                self.conn.close()
+            except OSError:
+                pass
+            self.server._remove(self)
+
+
+class SampleStreamServer:
+    """Fan out live samples to any number of local subscribers without blocking."""
+
+    def __init__(self, address, queue_length=256):
+        """Initialize the server (call start() to begin accepting clients).
+
+        Args:
+            address: (host, port) for TCP or a filesystem path for a UNIX socket
+            queue_length: Records buffered per subscriber before the oldest are dropped
+        """
+        self.address = address
+        self.queue_length = queue_length
+        self._subscribers = []
+        self._lock = threading.Lock()
+        self._sock = None
+
+    def start(self):
+        """Bind the socket and start accepting subscribers. Safe to call twice."""
+        if self._sock is not None:
+            return
+        if isinstance(self.address, str) and os.path.exists(self.address):
+            os.remove(self.address)
+        self._sock = _create_socket(self.address)
+        if not isinstance(self.address, str):
+            self._sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._sock.bind(self.address)
+        self._sock.listen()
+        if not isinstance(self.address, str):
+            self.address = self._sock.getsockname()[:2]
+        thread = threading.Thread(target=self._accept_loop, name="live-stream")
+        thread.daemon = True
+        thread.start()
+        print(f'Live sample stream listening on {self.address}')
+
+    def stop(self):
+        """Close the listening socket and disconnect all subscribers."""
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+        for subscriber in self.subscribers():
+            subscriber.close()
+
+    def subscribers(self):
+        with self._lock:
+            return list(self._subscribers)
+
+    def stats(self):
+        """List of (client, decimation, sent, dropped) per subscriber."""
+        return [(s.name, s.decimation, s.sent, s.dropped) for s in self.subscribers()]
+
+    def publish(self, packet_number, timestamp, gyro, accel, mag):
+        """Queue one sample for every subscriber. Never blocks on the network."""
+        subscribers = self._subscribers
+        if not subscribers:
+            return
+        try:
+            record = RECORD.pack(packet_number & 0xFFFFFFFF, timestamp, *gyro, *accel, *mag)
+        except (TypeError, struct.error):
+            # Some modes return None for disabled sensors
+            values = [math.nan if v is None else v
+                      for triple in (gyro, accel, mag) for v in (triple or _NAN_TRIPLE)]
+            record = RECORD.pack(packet_number & 0xFFFFFFFF, timestamp, *values)
+        for subscriber in subscribers:
+            subscriber.offer(packet_number, record)
+
+    def _accept_loop(self):
+        sock = self._sock
+        while True:
+            try:
+                conn, peer = sock.accept()
+            except OSError:
+                break  # Socket closed by stop()
+            subscriber = _Subscriber(self, conn, str(peer) or 'unix')
+            with self._lock:
+                # Copy-on-write so publish() can iterate without taking the lock
+                self._subscribers = self._subscribers + [subscriber]
+            thread = threading.Thread(target=subscriber.run, name="live-stream-client")
+            thread.daemon = True
+            thread.start()
+
+    def _remove(self, subscriber):
+        with self._lock:
+            self._subscribers = [s for s in self._subscribers if s is not subscriber]
+
+
+def read_samples(address, decimation=1):
+    """Connect to a SampleStreamServer and yield samples as tuples.
+
+    Yields:
+        (packet_number, timestamp, gx, gy, gz, ax, ay, az, mx, my, mz)
+    """
+    with _create_socket(address) as sock:
+        sock.connect(address)
+        sock.sendall(DECIMATION.pack(decimation))
+        header = b''
+        while len(header) < HEADER.size:
+            data = sock.recv(HEADER.size - len(header))
+            if not data:
+                return
+            header += data
+        magic, record_size, _ = HEADER.unpack(header)
+        if magic != MAGIC or record_size != RECORD.size:
+            raise RuntimeError(f'Unexpected stream header {header!r}')
+        pending = b''
+        while True:
+            data = sock.recv(64 * 1024)
+            if not data:
+                return
+            pending += data
+            usable = len(pending) - len(pending) % RECORD.size
+            for offset in range(0, usable, RECORD.size):
+                yield RECORD.unpack_from(pending, offset)
+            pending = pending[usable:]
+
+
+if __name__ == '__main__':
+    target = sys.argv[1]
+    if ':' in target:
+        host, port = target.rsplit(':', 1)
+        target = (host, int(port))
+    for sample in read_samples(target, int(sys.argv[2]) if len(sys.argv) > 2 else 1):
+        print(f'{sample[0]:8d} {sample[1]:.3f} gyro {sample[2]:8.3f} {sample[3]:8.3f} {sample[4]:8.3f}'
+              f' accel {sample[5]:7.2f} {sample[6]:7.2f} {sample[7]:7.2f}')
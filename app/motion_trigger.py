@@ -0,0 +1,160 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import collections
+
+import numpy as np
+
+from channel_columns import CHANNEL_COLUMNS
+
+STANDARD_GRAVITY = 9.80665  # m/s^2, the driver's acceleration unit
+
+
+class MotionDetector:
+    """Flags motion in blocks of samples with vectorized detectors.
+
+    Signals are the deviation of the acceleration magnitude from 1 g and the
+    angular rate magnitude. The 'threshold' detector compares each sample with
+    the thresholds; the 'energy' detector compares the RMS of each signal over
+    the last `window` samples, which ignores single-sample spikes.
+    """
+
+    def __init__(self, mode='threshold', accel_threshold=1.5, gyro_threshold=0.5, window=25):
+        """Initialize the detector.
+
+        Args:
+            mode: 'threshold' or 'energy'
+            accel_threshold: Acceleration deviation from 1 g in m/s^2
+            gyro_threshold: Angular rate in rad/s
+            window: Samples per RMS window of the energy detector
+        """
+        if mode not in ('threshold', 'energy'):
+            raise ValueError(f"Unknown trigger mode '{mode}'")
+        self.mode = mode
+        self.accel_threshold = accel_threshold
+        self.gyro_threshold = gyro_threshold
+        self.window = window
+        # Squared signals of the previous window - 1 samples, carried between blocks
+        self._history = np.zeros((max(window - 1, 0), 2))
+
+    def detect(self, gyro, accel):
+        """Return a boolean array: True for every sample of the block that shows motion.
+
+        Args:
+            gyro: (N, 3) array of angular rates in rad/s (NaN = missing)
+            accel: (N, 3) array of accelerations in m/s^2 (NaN = missing)
+        """
+        accel_dev = np.abs(np.sqrt(np.einsum('ij,ij->i', accel, accel)) - STANDARD_GRAVITY)
+        rate = np.sqrt(np.einsum('ij,ij->i', gyro, gyro))
+        signals = np.nan_to_num(np.column_stack((accel_dev, rate)))
+        thresholds = np.array([self.accel_threshold, self.gyro_threshold])
+        if self.mode == 'threshold':
+            return (signals > thresholds).any(axis=1)
+
+        # Moving mean of the squared signals via a running sum over history + block
+        squared = np.concatenate((self._history, signals * signals))
+        if len(self._history):
+            self._history = squared[-len(self._history):]
+        sums = np.cumsum(squared, axis=0)
+        sums = np.concatenate((np.zeros((1, 2)), sums))
+        mean_square = (sums[self.window:] - sums[:-self.window]) / self.window
+        return (mean_square > thresholds * thresholds).any(axis=1)
+
+
+class TriggeredWriter:
+    """Stores only the samples around motion events, in front of a RecordingWriter.
+
+    Sampling continues at the full rate; rows are kept in a pre-trigger ring
+    buffer and checked by a MotionDetector in blocks. When motion is detected
+    the buffered `pre_seconds` before it are written, followed by every row
+    until `hold_seconds` pass without motion. Between events nothing reaches
+    the disk. Offers the same write/queue_depth/close interface as the writer.
+    """
+
+    def __init__(self, writer, header, detector, frequency, pre_seconds=5.0,
+                 hold_seconds=5.0, block_size=10):
+        """Initialize the triggered writer.
+
+        Args:
+            writer: RecordingWriter that receives the rows of each event
+            header: Column names of the rows (used to find the gyro and accel columns)
+            detector: MotionDetector deciding which samples show motion
+            frequency: Sample rate in Hz, to convert seconds to samples
+            pre_seconds: Seconds of samples written before the first motion sample
+            hold_seconds: Seconds after the last motion sample before the event ends
+            block_size: Samples collected before the detector runs
+        """
+        self.writer = writer
+        self.detector = detector
+        self.pre_samples = int(pre_seconds * frequency)
+        self.hold_samples = int(hold_seconds * frequency)
+        self.block_size = block_size
+        self.events = 0  # Motion events seen in this recording
+        self.triggered = False
+
+        for channel in ("gyro", "acceleration"):
+            if CHANNEL_COLUMNS[channel][0] not in header:
+                raise ValueError(f"Triggered recording needs the '{channel}' channel")
+        self._gyro_columns = [header.index(name) for name in CHANNEL_COLUMNS["gyro"]]
+        self._accel_columns = [header.index(name) for name in CHANNEL_COLUMNS["acceleration"]]
+        self._ring = collections.deque(maxlen=self.pre_samples)
+        self._block = []
+        self._hold_left = 0
+
+    @property
+    def segments(self):
+        return self.writer.segments
+
+    @property
+    def stats(self):
+        return self.writer.stats
+
+    def start(self):
+        self.writer.start()
+
+    def write(self, row):
+        """Offer one row. Safe to call from the sampling thread."""
+        self._block.append(row)
+        if len(self._block) >= self.block_size:
+            self._process_block()
+
+    def queue_depth(self):
+        """Number of rows waiting to be written."""
+        return self.writer.queue_depth()
+
+    def close(self, timeout=None):
+        """Decide on the last partial block, then close the underlying writer."""
+        if self._block:
+            self._process_block()
+        self.writer.close(timeout)
+
+    def _column_values(self, columns):
+        # Missing values (None) become NaN
+        return np.array([[row[column] for column in columns] for row in self._block], dtype=float)
+
+    def _process_block(self):
+        motion = self.detector.detect(self._column_values(self._gyro_columns),
+                                      self._column_values(self._accel_columns))
+        for row, moving in zip(self._block, motion):
+            if moving:
+                if not self.triggered:
+                    self._begin_event()
+                self._hold_left = self.hold_samples
+            if self.triggered:
+                self.writer.write(row)
+                if not moving:
+                    self._hold_left -= 1
+                    if self._hold_left <= 0:
+                        self.triggered = False
+                        print(f'Motion event {self.events} ended')
+            elif self.pre_samples:
+                self._ring.append(row)
+        self._block = []
+
+    def _begin_event(self):
+        self.triggered = True
+        self.events += 1
+        print(f'Motion event {self.events} started')
+        # Pre-trigger window first, so the event starts with its lead-in
+        while self._ring:
+            self.writer.write(self._ring.popleft())
@@ -0,0 +1,109 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import json
+import math
+import os
+import threading
+
+import numpy as np
+
+
+def summary_path(path):
+    """Path of the JSON statistics summary of a recording or segment."""
+    return f"{os.path.splitext(path)[0]}_summary.json"
+
+
+class RunningStats:
+    """Per-column count, mean, variance, min, max and RMS of a stream of rows.
+
+    Each batch of rows is reduced to its own count, mean and sum of squared
+    deviations, then merged into the running totals with Chan's parallel form
+    of Welford's update, so the cost per sample is constant and the totals
+    stay accurate over multi-hour recordings. Missing values (NaN) are not
+    counted, which keeps sparse low-rate columns correct. Updated by the
+    writer thread and read by the UI, so access is locked.
+    """
+
+    def __init__(self, columns):
+        """Initialize empty statistics.
+
+        Args:
+            columns: Names of the columns, in the order of the values passed to update()
+        """
+        self.columns = list(columns)
+        size = len(self.columns)
+        self.count = np.zeros(size, dtype=np.int64)
+        self.mean = np.zeros(size)
+        self.min = np.full(size, np.inf)
+        self.max = np.full(size, -np.inf)
+        self._m2 = np.zeros(size)  # Sum of squared deviations from the mean
+        self._lock = threading.Lock()
+
+    def update(self, values):
+        """Add a batch of rows.
+
+        Args:
+            values: (N, columns) array of floats, NaN for missing values
+        """
+        values = np.asarray(values, dtype=np.float64).reshape(-1, len(self.columns))
+        valid = ~np.isnan(values)
+        count = valid.sum(axis=0)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = np.where(valid, values, 0.0).sum(axis=0) / count
+        deviations = np.where(valid, values - mean, 0.0)
+        m2 = np.einsum('ij,ij->j', deviations, deviations)
+        self._merge(count, np.nan_to_num(mean), m2,
+                    np.where(valid, values, np.inf).min(axis=0, initial=np.inf),
+                    np.where(valid, values, -np.inf).max(axis=0, initial=-np.inf))
+
+    def merge(self, other):
+        """Add the statistics of another RunningStats with the same columns."""
+        with other._lock:
+            parts = (other.count.copy(), other.mean.copy(), other._m2.copy(),
+                     other.min.copy(), other.max.copy())
+        self._merge(*parts)
+
+    def _merge(self, count, mean, m2, minimum, maximum):
+        with self._lock:
+            total = self.count + count
+            with np.errstate(invalid='ignore', divide='ignore'):
+                weight = np.where(total > 0, count / total, 0.0)
+            delta = mean - self.mean
+            self._m2 += m2 + delta * delta * self.count * weight
+            self.mean += delta * weight
+            self.count = total
+            np.minimum(self.min, minimum, out=self.min)
+            np.maximum(self.max, maximum, out=self.max)
+
+    def summary(self):
+        """Dict column -> count, mean, variance (sample), std, min, max and rms.
+
+        Values are None for columns without data.
+        """
+        with self._lock:
+            count, mean, m2 = self.count.copy(), self.mean.copy(), self._m2.copy()
+            minimum, maximum = self.min.copy(), self.max.copy()
+        result = {}
+        for index, name in enumerate(self.columns):
+            n = int(count[index])
+            if n == 0:
+                result[name] = {'count': 0, 'mean': None, 'variance': None, 'std': None,
+                                'min': None, 'max': None, 'rms': None}
+                continue
+            variance = m2[index] / (n - 1) if n > 1 else 0.0
+            result[name] = {
+                'count': n,
+                'mean': float(mean[index]),
+                'variance': float(variance),
+                'std': math.sqrt(variance),
+                'min': float(minimum[index]),
+                'max': float(maximum[index]),
+                'rms': math.sqrt(m2[index] / n + mean[index] * mean[index]),
+            }
+        return result
+
+    def write_json(self, path, **info):
+        """Write the summary plus `info` (e.g. file name, rows, time range) as JSON."""
+        with open(path, 'w') as f:
+            json.dump({**info, 'columns': self.summary()}, f, indent=2)
@@ -0,0 +1,370 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Recompute orientation offline from the raw gyro/accel/mag channels.
+
+Orientation filters are recursive, so a single recording cannot be vectorized
+sample by sample. Instead the recording is cut into segments ("lanes") that
+are filtered side by side: every NumPy operation advances all lanes by one
+sample. Each lane starts `warmup` seconds before its segment from the
+absolute accel/mag orientation and converges before its own samples begin;
+the warm-up output is discarded. segment=None runs one exact sequential lane.
+
+Filters:
+    madgwick       Madgwick gradient-descent AHRS (IMU update where mag is missing)
+    complementary  Gyro integration blended towards the accel/mag orientation
+
+Results use the BNO055 conventions: quaternion (w, x, y, z) and Euler heading,
+roll, pitch in degrees. They are written as a sidecar CSV (<name>_orientation.csv)
+or appended as extra columns to a copy of a CSV recording (<name>_fused.csv).
+Sidecars of binary recordings keep the extension (<name>.bin_orientation.csv).
+
+Usage: python orientation_filter.py [--filter madgwick|complementary] [--beta B]
+           [--alpha A] [--output sidecar|columns] [--workers N] RECORDING [...]
+"""
+
+import argparse
+import math
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+
+import numpy as np
+
+import recording_reader
+
+ORIENTATION_COLUMNS = [
+    "Offline quaternion W", "Offline quaternion X", "Offline quaternion Y", "Offline quaternion Z",
+    "Offline heading (deg)", "Offline roll (deg)", "Offline pitch (deg)",
+]
+
+MAX_LANES = 1024  # Lanes filtered together; bounds memory for very long recordings
+
+
+def _normalize(x, y, z):
+    norm = np.sqrt(x * x + y * y + z * z)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return x / norm, y / norm, z / norm
+
+
+def reference_orientation(accel, mag):
+    """Absolute orientation quaternions (w, x, y, z) from accel and mag, vectorized.
+
+    The earth frame has z up (along measured gravity) and x towards magnetic
+    north, the frame the Madgwick filter converges to. Rows with missing or
+    zero vectors give NaN.
+    """
+    up = np.stack(_normalize(*accel.T), axis=1)
+    m = mag - np.sum(mag * up, axis=1, keepdims=True) * up  # Horizontal part of the field
+    north = np.stack(_normalize(*m.T), axis=1)
+    west = np.cross(up, north)
+    # Rows of the sensor-to-earth rotation matrix
+    r00, r01, r02 = north.T
+    r10, r11, r12 = west.T
+    r20, r21, r22 = up.T
+
+    # Matrix to quaternion, picking the numerically safest formula per row
+    trace = r00 + r11 + r22
+    quat = np.empty((len(accel), 4))
+    with np.errstate(invalid='ignore'):
+        cases = [
+            (trace > 0, lambda s: (s / 4, (r21 - r12) / s, (r02 - r20) / s, (r10 - r01) / s),
+             np.sqrt(trace + 1.0) * 2),
+            ((r00 > r11) & (r00 > r22), lambda s: ((r21 - r12) / s, s / 4, (r01 + r10) / s, (r02 + r20) / s),
+             np.sqrt(1.0 + r00 - r11 - r22) * 2),
+            (r11 > r22, lambda s: ((r02 - r20) / s, (r01 + r10) / s, s / 4, (r12 + r21) / s),
+             np.sqrt(1.0 + r11 - r00 - r22) * 2),
+            (np.ones(len(accel), bool), lambda s: ((r10 - r01) / s, (r02 + r20) / s, (r12 + r21) / s, s / 4),
+             np.sqrt(1.0 + r22 - r00 - r11) * 2),
+        ]
+        remaining = np.ones(len(accel), bool)
+        for condition, formula, scale in cases:
+            rows = remaining & condition
+            quat[rows] = np.stack(formula(scale), axis=1)[rows]
+            remaining &= ~condition
+    return quat
+
+
+def quaternion_to_euler(quat):
+    """Heading, roll and pitch in degrees (heading in [0, 360)), vectorized."""
+    w, x, y, z = quat.T
+    heading = np.degrees(np.arctan2(2 * (w * z + x * y), 1 - 2 * (y * y + z * z))) % 360
+    roll = np.degrees(np.arctan2(2 * (w * x + y * z), 1 - 2 * (x * x + y * y)))
+    pitch = np.degrees(np.arcsin(np.clip(2 * (w * y - z * x), -1, 1)))
+    return np.stack((heading, roll, pitch), axis=1)
+
+
+def _gyro_derivative(q0, q1, q2, q3, gx, gy, gz):
+    # Rate of change of the quaternion from the gyroscope: 0.5 * q (x) (0, g)
+    return (0.5 * (-q1 * gx - q2 * gy - q3 * gz),
+            0.5 * (q0 * gx + q2 * gz - q3 * gy),
+            0.5 * (q0 * gy - q1 * gz + q3 * gx),
+            0.5 * (q0 * gz + q1 * gy - q2 * gx))
+
+
+def _madgwick_step(q, g, a, m, dt, beta):
+    """One Madgwick update for all lanes. a and m must be normalized (NaN = missing)."""
+    q0, q1, q2, q3 = q
+    gx, gy, gz = g
+    ax, ay, az = a
+    mx, my, mz = m
+    d0, d1, d2, d3 = _gyro_derivative(q0, q1, q2, q3, gx, gy, gz)
+
+    q0q0, q1q1, q2q2, q3q3 = q0 * q0, q1 * q1, q2 * q2, q3 * q3
+    # Gravity error: estimated minus measured direction of gravity
+    fx = 2 * (q1 * q3 - q0 * q2) - ax
+    fy = 2 * (q0 * q1 + q2 * q3) - ay
+    fz = 1 - 2 * (q1q1 + q2q2) - az
+    # Earth magnetic field direction seen through the current estimate
+    hx = mx * (q0q0 + q1q1 - q2q2 - q3q3) + 2 * my * (q1 * q2 - q0 * q3) + 2 * mz * (q0 * q2 + q1 * q3)
+    hy = 2 * mx * (q0 * q3 + q1 * q2) + my * (q0q0 - q1q1 + q2q2 - q3q3) + 2 * mz * (q2 * q3 - q0 * q1)
+    bx = np.sqrt(hx * hx + hy * hy)
+    bz = 2 * mx * (q1 * q3 - q0 * q2) + 2 * my * (q0 * q1 + q2 * q3) + mz * (q0q0 - q1q1 - q2q2 + q3q3)
+    # Magnetic error: estimated minus measured field direction
+    ex = 2 * bx * (0.5 - q2q2 - q3q3) + 2 * bz * (q1 * q3 - q0 * q2) - mx
+    ey = 2 * bx * (q1 * q2 - q0 * q3) + 2 * bz * (q0 * q1 + q2 * q3) - my
+    ez = 2 * bx * (q0 * q2 + q1 * q3) + 2 * bz * (0.5 - q1q1 - q2q2) - mz
+
+    # Gradient (Jacobian transpose times error) of the gravity part ...
+    s0 = -2 * q2 * fx + 2 * q1 * fy
+    s1 = 2 * q3 * fx + 2 * q0 * fy - 4 * q1 * fz
+    s2 = -2 * q0 * fx + 2 * q3 * fy - 4 * q2 * fz
+    s3 = 2 * q1 * fx + 2 * q2 * fy
+    # ... plus the magnetic part where a field was measured
+    have_mag = ~np.isnan(mx)
+    ex, ey, ez, bx, bz = (np.where(have_mag, v, 0.0) for v in (ex, ey, ez, bx, bz))
+    s0 = s0 - 2 * bz * q2 * ex + (-2 * bx * q3 + 2 * bz * q1) * ey + 2 * bx * q2 * ez
+    s1 = s1 + 2 * bz * q3 * ex + (2 * bx * q2 + 2 * bz * q0) * ey + (2 * bx * q3 - 4 * bz * q1) * ez
+    s2 = s2 + (-4 * bx * q2 - 2 * bz * q0) * ex + (2 * bx * q1 + 2 * bz * q3) * ey + (2 * bx * q0 - 4 * bz * q2) * ez
+    s3 = s3 + (-4 * bx * q3 + 2 * bz * q1) * ex + (-2 * bx * q0 + 2 * bz * q2) * ey + 2 * bx * q1 * ez
+
+    norm = np.sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+    correct = ~np.isnan(ax) & (norm > 0)
+    scale = np.where(correct, beta / np.where(correct, norm, 1.0), 0.0)
+    q0 = q0 + (d0 - scale * np.nan_to_num(s0)) * dt
+    q1 = q1 + (d1 - scale * np.nan_to_num(s1)) * dt
+    q2 = q2 + (d2 - scale * np.nan_to_num(s2)) * dt
+    q3 = q3 + (d3 - scale * np.nan_to_num(s3)) * dt
+    norm = np.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / norm, q1 / norm, q2 / norm, q3 / norm
+
+
+def _complementary_step(q, g, ref, dt, alpha):
+    """Integrate the gyro, then pull the result towards the reference orientation."""
+    q0, q1, q2, q3 = q
+    d0, d1, d2, d3 = _gyro_derivative(q0, q1, q2, q3, *g)
+    q0, q1, q2, q3 = q0 + d0 * dt, q1 + d1 * dt, q2 + d2 * dt, q3 + d3 * dt
+    r0, r1, r2, r3 = ref
+    have_ref = ~np.isnan(r0)
+    # q and -q are the same orientation; blend towards the closer one
+    sign = np.where(q0 * r0 + q1 * r1 + q2 * r2 + q3 * r3 < 0, -1.0, 1.0)
+    weight = np.where(have_ref, 1 - alpha, 0.0)
+    q0 = q0 + weight * (sign * np.nan_to_num(r0) - q0)
+    q1 = q1 + weight * (sign * np.nan_to_num(r1) - q1)
+    q2 = q2 + weight * (sign * np.nan_to_num(r2) - q2)
+    q3 = q3 + weight * (sign * np.nan_to_num(r3) - q3)
+    norm = np.sqrt(q0 * q0 + q1 * q1 + q2 * q2 + q3 * q3)
+    return q0 / norm, q1 / norm, q2 / norm, q3 / norm
+
+
+def _time_steps(timestamps):
+    dt = np.diff(timestamps, prepend=timestamps[0])
+    if len(dt) > 1:
+        typical = np.median(dt[1:])
+        dt[0] = typical
+        # Gaps (e.g. dropped samples) are bridged, not integrated blindly
+        np.clip(dt, 0.0, 10 * typical, out=dt)
+    return dt
+
+
+def run_filter(records, filter_name='madgwick', beta=0.1, alpha=0.98, gyro_scale=1.0,
+               segment=30.0, warmup=5.0):
+    """Compute orientation for a recording.
+
+    Args:
+        records: Structured array from recording_reader (scaled or raw)
+        filter_name: 'madgwick' or 'complementary'
+        beta: Madgwick gain (larger trusts accel/mag more)
+        alpha: Complementary weight of the integrated gyro per sample
+        gyro_scale: Factor converting the gyro columns to rad/s. The driver
+                    already returns rad/s; use math.pi / 180 for deg/s data
+        segment: Seconds per lane (None = one exact sequential pass)
+        warmup: Seconds each lane runs before its segment to converge
+
+    Returns:
+        Tuple (quaternions (N, 4), euler degrees (N, 3))
+    """
+    if filter_name not in ('madgwick', 'complementary'):
+        raise ValueError(f"Unknown filter '{filter_name}'")
+    records = recording_reader.scale_raw(records)
+    n = len(records)
+    if n == 0:
+        return np.zeros((0, 4)), np.zeros((0, 3))
+    timestamps = np.asarray(records['timestamp'], dtype=np.float64)
+    dt = _time_steps(timestamps)
+    rate = 1.0 / np.median(dt) if np.median(dt) > 0 else 1.0
+    gyro = np.asarray(records['gyro'], dtype=np.float64) * gyro_scale
+    accel = np.asarray(records['accel'], dtype=np.float64)
+    mag = np.asarray(records['mag'], dtype=np.float64)
+    reference = reference_orientation(accel, mag)
+    if filter_name == 'madgwick':
+        accel = np.stack(_normalize(*accel.T), axis=1)
+        mag = np.stack(_normalize(*mag.T), axis=1)
+
+    segment_samples = n if segment is None else max(1, int(segment * rate))
+    warmup_samples = 0 if segment is None else int(warmup * rate)
+    quat = np.empty((n, 4))
+    lanes = math.ceil(n / segment_samples)
+    for first_lane in range(0, lanes, MAX_LANES):
+        lane_ids = np.arange(first_lane, min(lanes, first_lane + MAX_LANES))
+        _run_lanes(quat, lane_ids, segment_samples, warmup_samples, filter_name, beta, alpha,
+                   gyro, accel, mag, reference, dt)
+    return quat, quaternion_to_euler(quat)
+
+
+def _initial_orientation(reference, start):
+    # First usable reference orientation at or after `start` (identity if none)
+    valid = np.flatnonzero(~np.isnan(reference[start:, 0]))
+    return reference[start + valid[0]] if len(valid) else np.array([1.0, 0.0, 0.0, 0.0])
+
+
+def _run_lanes(quat, lane_ids, segment_samples, warmup_samples, filter_name, beta, alpha,
+               gyro, accel, mag, reference, dt):
+    n = len(dt)
+    segment_start = lane_ids * segment_samples
+    lane_start = np.maximum(segment_start - warmup_samples, 0)
+    steps = segment_samples + warmup_samples
+    # Time-major sample indices: row t holds the t-th sample of every lane
+    index = lane_start[np.newaxis, :] + np.arange(steps)[:, np.newaxis]
+    active = index < np.minimum(segment_start + segment_samples, n)[np.newaxis, :]
+    emit = active & (index >= segment_start[np.newaxis, :])
+    index = np.minimum(index, n - 1)
+
+    def lanes_of(values):
+        return tuple(np.ascontiguousarray(values[index, axis]) for axis in range(values.shape[1]))
+
+    g, lane_dt = lanes_of(gyro), dt[index]
+    if filter_name == 'madgwick':
+        a, m = lanes_of(accel), lanes_of(mag)
+    else:
+        ref = lanes_of(reference)
+    q = tuple(np.array(component) for component in
+              np.stack([_initial_orientation(reference, start) for start in lane_start], axis=1))
+
+    for t in range(steps):
+        g_t = (g[0][t], g[1][t], g[2][t])
+        if filter_name == 'madgwick':
+            new = _madgwick_step(q, g_t, (a[0][t], a[1][t], a[2][t]),
+                                 (m[0][t], m[1][t], m[2][t]), lane_dt[t], beta)
+        else:
+            new = _complementary_step(q, g_t, (ref[0][t], ref[1][t], ref[2][t], ref[3][t]),
+                                      lane_dt[t], alpha)
+        q = tuple(np.where(active[t], new_c, old_c) for new_c, old_c in zip(new, q))
+        rows = index[t][emit[t]]
+        quat[rows] = np.stack(q, axis=1)[emit[t]]
+
+
+def _output_path(path, output):
+    root, extension = os.path.splitext(path)
+    if extension != '.csv':
+        root = path  # Keep r.bin and r.csv from sharing a sidecar
+    return f"{root}_orientation.csv" if output == 'sidecar' else f"{root}_fused.csv"
+
+
+def write_results(path, records, quat, euler, output='sidecar'):
+    """Write filter results next to the recording.
+
+    Args:
+        path: Path of the source recording
+        records: Its records (for packet numbers and timestamps)
+        quat, euler: Results of run_filter()
+        output: 'sidecar' for a separate CSV, 'columns' to append the results
+                to a copy of a CSV recording
+
+    Returns:
+        Path of the written file
+    """
+    out_path = _output_path(path, output)
+    results = np.column_stack((quat, euler))
+    if output == 'sidecar':
+        table = np.column_stack((records['packet'], records['timestamp'], results))
+        header = ','.join(['Packet number', 'Timestamp'] + ORIENTATION_COLUMNS)
+        np.savetxt(out_path, table, delimiter=',', header=header, comments='',
+                   fmt=['%d', '%.6f'] + ['%.6f'] * 4 + ['%.3f'] * 3)
+        return out_path
+    if output != 'columns':
+        raise ValueError(f"Unknown output '{output}'")
+    if recording_reader.recording_format(path) != 'csv':
+        raise ValueError('Extra columns need a CSV recording; use a sidecar for binary and block ones')
+
+    rows = iter(results)
+    with open(path, 'r', newline='') as source, open(out_path, 'w', newline='') as target:
+        header = source.readline().rstrip('\r\n')
+        if header[:1].isdigit():
+            source.seek(0)  # No header row to extend
+        else:
+            target.write(f"{header},{','.join(ORIENTATION_COLUMNS)}\n")
+        for line in source:
+            if not line.strip():
+                continue
+            w, x, y, z, heading, roll, pitch = next(rows)
+            target.write(f"{line.rstrip()},{w:.6f},{x:.6f},{y:.6f},{z:.6f},"
+                         f"{heading:.3f},{roll:.3f},{pitch:.3f}\n")
+    return out_path
+
+
+def reprocess_file(path, output='sidecar', **filter_args):
+    """Load, filter and write one recording. Returns a summary dictionary."""
+    started = time.perf_counter()
+    records = recording_reader.load(path)
+    quat, euler = run_filter(records, **filter_args)
+    out_path = write_results(path, records, quat, euler, output)
+    return {'path': path, 'output': out_path, 'samples': len(records),
+            'seconds': time.perf_counter() - started}
+
+
+def reprocess_files(paths, workers=None, output='sidecar', **filter_args):
+    """Reprocess many recordings in parallel, one process per file.
+
+    Returns:
+        List of summary dictionaries in the order of `paths`
+    """
+    job = partial(reprocess_file, output=output, **filter_args)
+    if workers == 1:
+        return [job(path) for path in paths]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        return list(pool.map(job, paths))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Recompute orientation from raw recordings')
+    parser.add_argument('recordings', nargs='+', help='CSV or binary recordings')
+    parser.add_argument('--filter', dest='filter_name', default='madgwick',
+                        choices=('madgwick', 'complementary'))
+    parser.add_argument('--beta', type=float, default=0.1, help='Madgwick gain')
+    parser.add_argument('--alpha', type=float, default=0.98, help='complementary gyro weight')
+    parser.add_argument('--gyro-deg', action='store_true', help='gyro columns are in deg/s')
+    parser.add_argument('--segment', type=float, default=30.0,
+                        help='seconds per parallel lane (0 = exact sequential pass)')
+    parser.add_argument('--warmup', type=float, default=5.0, help='lane warm-up in seconds')
+    parser.add_argument('--output', default='sidecar', choices=('sidecar', 'columns'))
+    parser.add_argument('--workers', type=int, help='processes (default: one per CPU)')
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    results = reprocess_files(args.recordings, workers=args.workers, output=args.output,
+                              filter_name=args.filter_name, beta=args.beta, alpha=args.alpha,
+                              gyro_scale=math.pi / 180 if args.gyro_deg else 1.0,
+                              segment=args.segment or None, warmup=args.warmup)
+    for result in results:
+        print(f"{result['path']} -> {result['output']}: {result['samples']} samples "
+              f"in {result['seconds']:.2f} s")
+    elapsed = time.perf_counter() - started
+    total = sum(result['samples'] for result in results)
+    print(f'{len(results)} files, {total} samples in {elapsed:.2f} s '
+          f'({total / elapsed if elapsed else 0:.0f} samples/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,127 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Opt-in real-time settings for the sampling thread (Linux only).
+
+Priority and affinity apply to the calling thread only, so call
+configure_thread() from the sampler after it has started its helper threads
+(those would inherit the priority). Settings that are not permitted (no
+CAP_SYS_NICE, RLIMIT_RTPRIO of 0, not Linux) are skipped with a warning and
+sampling continues with normal scheduling. To allow them without root::
+
+    # /etc/security/limits.d/recorder.conf
+    pi  -  rtprio   60
+    pi  -  memlock  unlimited
+"""
+
+import ctypes
+import ctypes.util
+import math
+import os
+from array import array
+
+POLICIES = {
+    'fifo': getattr(os, 'SCHED_FIFO', None),
+    'rr': getattr(os, 'SCHED_RR', None),
+}
+
+# mlockall() flags on Linux (x86 and ARM)
+MCL_CURRENT = 1
+MCL_FUTURE = 2
+
+
+def lock_memory():
+    """Lock the process's pages in RAM so page faults cannot stall the sampler.
+
+    Future allocations are locked too only when the memlock limit cannot make
+    them fail (unlimited, or running as root); otherwise just the current pages.
+
+    Returns:
+        True if the pages were locked
+    """
+    try:
+        import resource  # pylint: disable=import-outside-toplevel
+        soft, _ = resource.getrlimit(resource.RLIMIT_MEMLOCK)
+        flags = MCL_CURRENT
+        if os.geteuid() == 0 or soft == resource.RLIM_INFINITY:
+            flags |= MCL_FUTURE
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        if libc.mlockall(flags) != 0:
+            raise OSError(ctypes.get_errno(), os.strerror(ctypes.get_errno()))
+        return True
+    except (ImportError, AttributeError, OSError) as e:
+        print(f'Warning: cannot lock memory: {e}')
+        return False
+
+
+def configure_thread(policy=None, priority=50, cpus=None, memory_lock=False):
+    """Apply real-time settings to the calling thread, skipping what is not permitted.
+
+    Args:
+        policy: 'fifo' or 'rr' for real-time scheduling (None keeps the default)
+        priority: Real-time priority, 1 (lowest) to 99
+        cpus: Iterable of CPU numbers to pin the thread to (None = any)
+        memory_lock: Lock the process's memory with mlockall()
+
+    Returns:
+        Dict of the settings that took effect: 'policy', 'priority', 'cpus',
+        'memory_locked'
+    """
+    applied = {'policy': None, 'priority': 0, 'cpus': None, 'memory_locked': False}
+    if policy:
+        try:
+            if POLICIES.get(policy) is None:
+                raise ValueError(f"Unknown or unsupported policy '{policy}'")
+            os.sched_setscheduler(0, POLICIES[policy], os.sched_param(priority))
+            applied['policy'] = policy
+            applied['priority'] = priority
+        except (AttributeError, OSError, ValueError) as e:
+            print(f'Warning: cannot use real-time scheduling, keeping the default: {e}')
+    if cpus:
+        try:
+            os.sched_setaffinity(0, cpus)
+            applied['cpus'] = sorted(os.sched_getaffinity(0))
+        except (AttributeError, OSError, ValueError) as e:
+            print(f'Warning: cannot pin the sampler to CPUs {sorted(cpus)}: {e}')
+    if memory_lock:
+        applied['memory_locked'] = lock_memory()
+    return applied
+
+
+class WakeupLatency:
+    """Distribution of how late the sampler wakes up after each sleep.
+
+    Keeps the last `capacity` measurements for percentiles plus the all-time
+    maximum. Written by the sampling thread, summarized by any other thread.
+    """
+
+    def __init__(self, capacity=4096, applied=None):
+        self.capacity = capacity
+        self.applied = applied or {}  # Result of configure_thread()
+        self._values = array('d', [math.nan]) * capacity
+        self.count = 0
+        self.max = 0.0
+
+    def record(self, seconds):
+        self._values[self.count % self.capacity] = seconds
+        self.count += 1
+        if seconds > self.max:
+            self.max = seconds
+
+    def summary(self):
+        """Percentiles in microseconds plus the real-time settings in effect."""
+        values = sorted(value for value in self._values[:min(self.count, self.capacity)])
+
+        def percentile(fraction):
+            if not values:
+                return 0.0
+            return round(values[min(len(values) - 1, int(fraction * len(values)))] * 1e6, 1)
+
+        return {
+            'count': self.count,
+            'p50_us': percentile(0.5),
+            'p99_us': percentile(0.99),
+            'p999_us': percentile(0.999),
+            'max_us': round(self.max * 1e6, 1),
+            **self.applied,
+        }
@@ -0,0 +1,303 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Headless recorder daemon for unattended units.
+
+Runs the same recording pipeline as the Tk UI (collect_data, RecordingWriter,
+background uploads) without a display. Recordings are started and stopped by
+signals or a daily schedule:
+
+    SIGUSR1          start a recording
+    SIGUSR2          stop the current recording
+    SIGTERM, SIGINT  stop, flush and close the current recording, then exit
+
+Inside a --schedule window one recording is started. Once it stops, whether by
+SIGUSR2, the control API or --duration, it is not started again until the
+next window (SIGUSR1 still starts one by hand).
+
+With --control-api the same recordings can be driven over HTTP (see
+control_api.py), e.g. to start many units at the same instant.
+
+Under systemd it reports readiness and feeds the watchdog only while the
+sampler is making progress. Example unit::
+
+    [Service]
+    Type=notify
+    WorkingDirectory=/home/pi/recorder/app
+    ExecStart=/usr/bin/python3 recorder_daemon.py --schedule 08:00-18:00 --upload
+    WatchdogSec=30
+    NotifyAccess=main
+    Restart=on-failure
+
+With --format blocks, recordings left open by a power cut are recovered
+(truncated to their last valid block) when the daemon starts.
+
+For --rt-policy and --mlock without root, also allow them in the unit with
+LimitRTPRIO=60 and LimitMEMLOCK=infinity.
+
+Usage: python recorder_daemon.py [--start] [--schedule HH:MM-HH:MM[,...]]
+                                 [--duration SECONDS] [--live-sync] [--upload]
+                                 [--trigger threshold|energy] [--format csv|blocks]
+                                 [--duty-cycle BURST/PERIOD]
+                                 [--rt-policy fifo|rr] [--rt-priority N] [--cpus N[,N...]] [--mlock]
+                                 [--control-api HOST:PORT] [--control-token TOKEN]
+"""
+
+import argparse
+import os
+import signal
+import socket
+import threading
+import time
+from datetime import datetime
+
+import i2c_data_recorderUI as recorder
+from control_api import ControlServer
+from recording_control import RecordingController, ControlError, RECORDING, STOPPED
+
+
+def sd_notify(message):
+    """Send a notification to systemd. Does nothing when not run by systemd."""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]  # Abstract namespace socket
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as sock:
+            sock.connect(address)
+            sock.sendall(message.encode())
+        return True
+    except OSError as e:
+        print(f'Error notifying systemd: {e}')
+        return False
+
+
+def parse_schedule(text):
+    """Parse 'HH:MM-HH:MM[,HH:MM-HH:MM...]' into a list of (start, end) minute pairs."""
+    windows = []
+    for window in text.split(','):
+        start, end = window.strip().split('-')
+        windows.append(tuple(int(part.split(':')[0]) * 60 + int(part.split(':')[1])
+                             for part in (start, end)))
+    return windows
+
+
+def in_schedule(windows, now=None):
+    """True if `now` falls into one of the windows (windows may wrap past midnight)."""
+    now = now or datetime.now()
+    minute = now.hour * 60 + now.minute
+    for start, end in windows:
+        if start <= end and start <= minute < end:
+            return True
+        if start > end and (minute >= start or minute < end):
+            return True
+    return False
+
+
+class RecorderDaemon:
+    """Drives the recording pipeline from signals and a schedule instead of Tk."""
+
+    def __init__(self, schedule=None, duration=None, upload=False, stall_timeout=5.0):
+        """Initialize the daemon.
+
+        Args:
+            schedule: List of (start, end) minute-of-day windows to record in
+            duration: Stop each recording after this many seconds (None = no limit)
+            upload: Queue every finished recording for background upload
+            stall_timeout: Seconds without new samples after which the watchdog
+                           is no longer fed while recording
+        """
+        self.globals = recorder.global_vars
+        self.controller = RecordingController(recorder.collect_data, self.globals,
+                                              csv_dir=recorder.csv_dir)
+        self.schedule = schedule
+        self.duration = duration
+        self.upload = upload
+        self.stall_timeout = stall_timeout
+
+        self._start_requested = threading.Event()
+        self._stop_requested = threading.Event()
+        self._exit_requested = threading.Event()
+        self._window_recorded = False  # A recording ran in the current schedule window
+        self._last_packet_count = 0
+        self._last_progress = time.monotonic()
+
+    @property
+    def recording(self):
+        return self.controller.state == RECORDING
+
+    def install_signal_handlers(self):
+        # Handlers only set flags; the main loop does the actual work
+        signal.signal(signal.SIGUSR1, lambda signum, frame: self._start_requested.set())
+        signal.signal(signal.SIGUSR2, lambda signum, frame: self._stop_requested.set())
+        signal.signal(signal.SIGTERM, lambda signum, frame: self._exit_requested.set())
+        signal.signal(signal.SIGINT, lambda signum, frame: self._exit_requested.set())
+
+    def request_start(self):
+        self._start_requested.set()
+
+    def request_stop(self):
+        self._stop_requested.set()
+
+    def start_recording(self, filename=None):
+        """Start a recording, optionally under the given name (without .csv)."""
+        try:
+            self.controller.start(filename)
+        except ControlError:
+            return
+        self._last_packet_count = self.globals['sample'].packet_counter
+        self._last_progress = time.monotonic()
+        sd_notify('STATUS=Recording')
+
+    def stop_recording(self):
+        """Stop the current recording (or armed start) and wait until its last rows are on disk."""
+        try:
+            self.controller.stop()
+        except ControlError:
+            pass  # Nothing recording
+        self.hand_off()
+
+    def hand_off(self):
+        """Queue a stopped recording for upload (or just keep it) and become ready again."""
+        if self.controller.state != STOPPED:
+            return
+        try:
+            if self.upload:
+                # In live sync mode the writer already queued every segment
+                self.controller.upload(background=True)
+            else:
+                self.controller.release()
+        except ControlError:
+            return  # Already handled through the control API
+        sd_notify('STATUS=Idle')
+
+    def sampler_healthy(self):
+        """False if recording but no new samples arrived for stall_timeout seconds."""
+        if not self.recording:
+            return True
+        packet_count = self.globals['sample'].packet_counter
+        if packet_count != self._last_packet_count:
+            self._last_packet_count = packet_count
+            self._last_progress = time.monotonic()
+        # Recordings started over the control API count from their own start
+        last_progress = max(self._last_progress, self.controller.recording_started or 0)
+        duty_cycle = self.globals.get('duty_cycler')
+        if duty_cycle:
+            last_progress = max(last_progress, duty_cycle.last_activity)  # Asleep on schedule
+        return time.monotonic() - last_progress < self.stall_timeout
+
+    def run(self):
+        """Main loop: handle requests, follow the schedule and feed the watchdog."""
+        watchdog_usec = int(os.environ.get('WATCHDOG_USEC', 0))
+        watchdog_interval = watchdog_usec / 2e6 if watchdog_usec else None
+        last_watchdog = 0.0
+
+        sd_notify('READY=1\nSTATUS=Idle')
+        print('Recorder daemon ready')
+
+        while not self._exit_requested.is_set():
+            if self._start_requested.is_set():
+                self._start_requested.clear()
+                self.start_recording()
+            if self._stop_requested.is_set():
+                self._stop_requested.clear()
+                self.stop_recording()
+            # Recordings stopped over the control API
+            self.hand_off()
+
+            if self.schedule is not None:
+                if in_schedule(self.schedule):
+                    # Recordings stopped inside the window stay stopped until the next one
+                    if not self.recording and not self._window_recorded:
+                        self.start_recording()
+                    self._window_recorded = self._window_recorded or self.recording
+                else:
+                    self._window_recorded = False
+                    if self.recording:
+                        self.stop_recording()
+
+            started = self.controller.recording_started
+            if (self.recording and started is not None and self.duration is not None
+                    and time.monotonic() - started >= self.duration):
+                self.stop_recording()
+                if self.schedule is None:
+                    self._exit_requested.set()
+
+            now = time.monotonic()
+            if watchdog_interval and now - last_watchdog >= watchdog_interval:
+                if self.sampler_healthy():
+                    sd_notify('WATCHDOG=1')
+                    last_watchdog = now
+                else:
+                    sd_notify('STATUS=Sampler stalled')
+
+            self._exit_requested.wait(0.5)
+
+        # Graceful shutdown: flush the open recording before exiting
+        sd_notify('STOPPING=1')
+        self.stop_recording()
+        if self.upload:
+            print('Waiting for pending uploads...')
+            self.globals['upload_queue'].wait(timeout=60)
+        print('Recorder daemon exited')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Headless BNO055 recorder daemon')
+    parser.add_argument('--start', action='store_true', help='start recording immediately')
+    parser.add_argument('--schedule', help='daily recording windows, e.g. 08:00-12:00,14:00-18:00')
+    parser.add_argument('--duration', type=float,
+                        help='stop each recording after this many seconds; with --schedule, '
+                             'record once per window')
+    parser.add_argument('--live-sync', action='store_true',
+                        help='upload finished segments while recording')
+    parser.add_argument('--upload', action='store_true', help='upload recordings when they finish')
+    parser.add_argument('--trigger', choices=('threshold', 'energy'),
+                        help='store only samples around motion events')
+    parser.add_argument('--format', choices=('csv', 'blocks'), default=recorder.RECORDING_FORMAT,
+                        help='recording file format; blocks writes crash-safe .rec files')
+    parser.add_argument('--duty-cycle', metavar='BURST/PERIOD',
+                        help='sample BURST seconds every PERIOD seconds, suspending the sensor '
+                             'in between, e.g. 2/60')
+    parser.add_argument('--rt-policy', choices=('fifo', 'rr'),
+                        help='run the sampler thread with real-time scheduling')
+    parser.add_argument('--rt-priority', type=int, default=50, help='real-time priority (1-99)')
+    parser.add_argument('--cpus', help='pin the sampler thread to these CPUs, e.g. 3')
+    parser.add_argument('--mlock', action='store_true', help='lock the recorder in RAM')
+    parser.add_argument('--control-api', metavar='HOST:PORT',
+                        help='serve the HTTP control API, e.g. 0.0.0.0:8055')
+    parser.add_argument('--control-token', help='token clients must send in X-Api-Token')
+    args = parser.parse_args()
+
+    recorder.global_vars['live_sync'] = args.live_sync
+    recorder.global_vars['trigger_mode'] = args.trigger
+    recorder.global_vars['recording_format'] = args.format
+    if args.duty_cycle:
+        burst, period = (float(value) for value in args.duty_cycle.split('/'))
+        recorder.global_vars['duty_cycle'] = {'burst_seconds': burst, 'period_seconds': period}
+    recorder.global_vars['sampler_realtime'] = {
+        'policy': args.rt_policy,
+        'priority': args.rt_priority,
+        'cpus': {int(cpu) for cpu in args.cpus.split(',')} if args.cpus else None,
+        'memory_lock': args.mlock,
+    }
+    recorder.global_vars['plot_buffer'] = None  # No plots without a display
+    daemon = RecorderDaemon(schedule=parse_schedule(args.schedule) if args.schedule else None,
+                            duration=args.duration, upload=args.upload or args.live_sync)
+    if args.format == 'blocks' and os.path.isdir(recorder.csv_dir):
+        from block_recording import recover_directory  # Needs numpy, so only for this format
+        for path, result in recover_directory(recorder.csv_dir).items():
+            print(f"Recovered {path}: {result['blocks']} blocks kept, "
+                  f"{result['truncated']} bytes truncated")
+    daemon.install_signal_handlers()
+    if args.control_api:
+        host, port = args.control_api.rsplit(':', 1)
+        ControlServer(daemon.controller, (host, int(port)), args.control_token).start()
+    if args.start:
+        daemon.request_start()
+    daemon.run()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,277 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Recording state machine shared by SensorUI, the daemon and the control API.
+
+    ready --start--> [armed --start_at reached-->] recording --stop--> stopped
+    stopped --upload--> uploading --> ready
+    stopped --release--> ready           (headless: keep the files, skip the upload)
+
+Every front end drives the recorder through one RecordingController, so a
+recording started over HTTP shows up in the Tk window and vice versa.
+"""
+
+import os
+import re
+import shutil
+import threading
+import time
+
+from sample_snapshot import SampleSnapshot
+
+READY = 'ready'
+ARMED = 'armed'
+RECORDING = 'recording'
+STOPPED = 'stopped'
+UPLOADING = 'uploading'
+
+_FILENAME_PATTERN = re.compile(r'[A-Za-z0-9][A-Za-z0-9_.-]{0,127}')
+
+
+class ControlError(Exception):
+    """Raised when a request does not fit the current recording state."""
+
+
+class RecordingController:
+    """Starts, stops and uploads recordings by driving collect_data and global_vars."""
+
+    def __init__(self, collect_data_function, global_vars, csv_dir="sensor_data/", join_timeout=10):
+        """Initialize the controller.
+
+        Args:
+            collect_data_function: Sampling loop run on its own thread per recording
+            global_vars: Shared state dictionary of the recorder
+            csv_dir: Directory recordings are written to
+            join_timeout: Seconds to wait for the sampler to close its files on stop
+        """
+        self.collect_data_function = collect_data_function
+        self.globals = global_vars
+        self.csv_dir = csv_dir
+        self.join_timeout = join_timeout
+        self.state = READY
+        self.recording_started = None  # time.monotonic() when sampling began
+        self.data_thread = None
+        self._start_timer = None
+        self._lock = threading.RLock()
+
+    def start(self, filename=None, tags=None, start_at=None):
+        """Start a recording, optionally at a given wall-clock time.
+
+        Args:
+            filename: Recording name without .csv (None = current date and time)
+            tags: Dict of short strings stored with the upload as Drive properties
+            start_at: time.time() value to begin sampling at, so several units
+                      with synchronized clocks start together (None = now)
+        """
+        if filename is not None and not _FILENAME_PATTERN.fullmatch(filename):
+            raise ValueError(f"Invalid recording name '{filename}'")
+        if start_at is not None:
+            start_at = float(start_at)
+        tags = dict(tags or {})
+        for key, value in tags.items():
+            if not isinstance(key, str) or not isinstance(value, str):
+                raise ValueError('Tags must map strings to strings')
+            if len(key.encode()) + len(value.encode()) > 124:
+                raise ValueError(f"Tag '{key}' is too long")  # Drive property limit
+
+        with self._lock:
+            if self.state != READY:
+                raise ControlError(f'Cannot start while {self.state}')
+            if filename:
+                self.globals['csv_filename'] = f"{self.csv_dir}{filename}.csv"
+                self.globals['custom_filename_provided'] = True
+            else:
+                self.globals['custom_filename_provided'] = False
+            self.globals['recording_tags'] = tags
+            # Reset upload status for new recording
+            self.globals['file_uploaded'] = False
+
+            delay = start_at - time.time() if start_at is not None else 0
+            if delay > 0:
+                self.state = ARMED
+                self._start_timer = threading.Timer(delay, self._begin)
+                self._start_timer.daemon = True
+                self._start_timer.start()
+                print(f'Recording armed, starting in {delay:.3f} s')
+            else:
+                self._begin()
+
+    def _begin(self):
+        with self._lock:
+            if self.state not in (READY, ARMED):
+                return  # Stopped while armed
+            self._start_timer = None
+            self.globals['running'] = True
+            self.globals['collecting_data'] = True
+            if self.data_thread is None or not self.data_thread.is_alive():
+                self.data_thread = threading.Thread(target=self.collect_data_function)
+                self.data_thread.daemon = True
+                self.data_thread.start()
+            self.recording_started = time.monotonic()
+            self.state = RECORDING
+            print('Recording started')
+
+    def stop(self):
+        """Stop the recording (or cancel an armed start) and wait for its files to close."""
+        with self._lock:
+            if self.state == ARMED:
+                self._start_timer.cancel()
+                self._start_timer = None
+                self.state = READY
+                print('Armed recording cancelled')
+                return
+            if self.state != RECORDING:
+                raise ControlError(f'Cannot stop while {self.state}')
+            self.globals['running'] = False
+            self.globals['collecting_data'] = False
+            # Let the collection thread close its file so the last segment is complete
+            if self.data_thread and self.data_thread.is_alive():
+                self.data_thread.join(timeout=self.join_timeout)
+                if self.data_thread.is_alive():
+                    print('Warning: data collection thread did not finish in time')
+            self.data_thread = None
+            self.recording_started = None
+            self.state = STOPPED
+            print(f"Recording stopped: {self.globals['csv_filename']}")
+
+    def upload(self, background=False, progress=None):
+        """Upload the stopped recording and return to ready.
+
+        Args:
+            background: Hand the files to the BackgroundUploader and return at once
+            progress: Optional callable receiving progress messages while waiting
+
+        Returns:
+            Tuple (level, message), level being 'ok', 'warning' or 'error'
+        """
+        with self._lock:
+            if self.state != STOPPED:
+                raise ControlError(f'Cannot upload while {self.state}')
+            self.state = UPLOADING
+        try:
+            if background:
+                return self._upload_in_background()
+            return self._upload(progress or (lambda message: None))
+        finally:
+            # Reset key values for the next recording cycle
+            self.globals['sample'] = SampleSnapshot(seq=self.globals['sample'].seq + 1)
+            self.globals['start_time'] = None
+            with self._lock:
+                self.state = READY
+
+    def release(self):
+        """Leave the stopped state without uploading; the files stay on disk."""
+        with self._lock:
+            if self.state != STOPPED:
+                raise ControlError(f'Cannot release while {self.state}')
+            self.state = READY
+
+    def _finished(self):
+        # Reset file tracking for next recording cycle
+        self.globals['csv_filename'] = None
+        self.globals['custom_filename_provided'] = False
+        self.globals['file_uploaded'] = False
+
+    def _upload_in_background(self):
+        upload_queue = self.globals['upload_queue']
+        segment_files = self.globals.get('segment_files') or []
+        if not segment_files:
+            return 'warning', 'No data file to upload'
+        if self.globals.get('live_sync'):
+            # The writer already queued every segment; retry the ones that failed
+            upload_queue.retry_failed()
+        else:
+            for file_path in segment_files:
+                upload_queue.enqueue(file_path, self.globals.get('recording_tags'))
+        self._finished()
+        return 'ok', f'Queued {len(segment_files)} files for upload'
+
+    def _upload(self, progress):
+        csv_filename = self.globals['csv_filename']
+        # Check if file already uploaded in this session
+        if self.globals.get('file_uploaded', False):
+            return 'warning', 'This file has already been uploaded'
+        # In live sync mode segments are already uploading; only wait for the rest
+        if self.globals.get('live_sync') and self.globals.get('segment_files'):
+            return self._finish_live_sync(progress)
+        if not csv_filename or not os.path.exists(csv_filename):
+            return 'warning', 'No data file to upload'
+
+        progress(f"Uploading {os.path.basename(csv_filename)} to Google Drive...")
+        print(f"Uploading {csv_filename} to Google Drive...")
+        try:
+            file_id = self.globals['google_uploader'].upload_file(
+                csv_filename, properties=self.globals.get('recording_tags'))
+        except Exception as e:
+            print(f"Error uploading file to Google Drive: {e}")
+            return 'error', f"Error: {str(e)}"
+        if not file_id:
+            print(f"Failed to upload {csv_filename} to Google Drive")
+            return 'error', "Failed to upload to Google Drive"
+        print(f"Successfully uploaded {csv_filename} to Google Drive with ID: {file_id}")
+        self._finished()
+        return 'ok', f"Successfully uploaded to Google Drive with ID: {file_id}"
+
+    def _finish_live_sync(self, progress):
+        # Wait for the background uploader to drain
+        upload_queue = self.globals['upload_queue']
+        segment_files = self.globals['segment_files']
+
+        for attempt in range(2):
+            while not upload_queue.wait(timeout=0.1):
+                progress(f"Uploading last segments ({upload_queue.pending()} remaining)...")
+            if not upload_queue.failed or attempt:
+                break
+            # Give failed segments one more chance now that recording has stopped
+            upload_queue.retry_failed()
+
+        if upload_queue.failed:
+            print(f"Failed to upload segments: {upload_queue.failed}")
+            return 'error', f"Failed to upload {len(upload_queue.failed)} of {len(segment_files)} segments"
+        success_msg = f"Successfully uploaded {len(segment_files)} segments to Google Drive"
+        print(success_msg)
+        self._finished()
+        return 'ok', success_msg
+
+    def status(self):
+        """Snapshot of the recorder state as a JSON-serializable dictionary."""
+        sample = self.globals['sample']
+        frequency = self.globals.get('frequency', 0)
+        recording = self.state == RECORDING
+        elapsed = sample.elapsed_ms / 1000 if recording else 0
+        samples = sample.packet_counter if recording else 0
+        writer = self.globals.get('writer')
+        upload_queue = self.globals.get('upload_queue')
+        stream = self.globals.get('live_stream')
+        latency = self.globals.get('sampler_latency')
+        slow_channels = self.globals.get('slow_channels')
+        duty_cycle = self.globals.get('duty_cycler')
+        channel_stats = self.globals.get('channel_stats')
+        # Duty-cycled recordings only sample during their bursts
+        sampled = duty_cycle.sampling_seconds() if recording and duty_cycle else elapsed
+        directory = os.path.dirname(self.globals.get('csv_filename') or '') or self.csv_dir
+        if not os.path.isdir(directory):
+            directory = '.'
+        return {
+            'state': self.state,
+            'csv_filename': self.globals.get('csv_filename'),
+            'tags': self.globals.get('recording_tags') or {},
+            'elapsed_ms': sample.elapsed_ms if recording else 0,
+            'samples': samples,
+            'frequency': frequency,
+            'rate': round(samples / sampled, 2) if sampled else 0.0,
+            # Samples the sampler should have taken by now but did not
+            'missed_samples': max(0, int(sampled * frequency) - samples),
+            'stream_drops': sum(dropped for _, _, _, dropped in stream.stats()) if stream else 0,
+            'sampler_lag_ms': round(self.globals.get('sampler_lag', 0.0) * 1000, 3),
+            'sampler_latency': latency.summary() if latency else None,
+            'slow_channels': slow_channels.stats() if slow_channels else None,
+            'duty_cycle': duty_cycle.stats() if duty_cycle else None,
+            'channel_stats': channel_stats.summary() if channel_stats else None,
+            'error': sample.error,
+            'writer_queue_depth': writer.queue_depth() if writer else 0,
+            'trigger_events': getattr(writer, 'events', None),  # None unless triggered
+            'upload_pending': upload_queue.pending() if upload_queue else 0,
+            'upload_failed': len(upload_queue.failed) if upload_queue else 0,
+            'disk_free_bytes': shutil.disk_usage(directory).free,
+        }
@@ -0,0 +1,518 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Load recordings as NumPy structured arrays for offline analysis.
+
+Binary recordings (.bin) start with a 64-byte header followed by fixed-width
+little-endian records and are opened with np.memmap: opening is instant for
+any file size and pages are only read when touched. Scaled records use the same
+48-byte layout as the live stream (live_stream.RECORD):
+
+    uint32  packet      float64 timestamp
+    float32 gyro[3]     float32 accel[3]     float32 mag[3]
+
+Raw records keep the sensor's int16 register values (see RAW_DTYPE) and are
+converted with scale_raw(). Legacy CSV recordings are parsed in chunks, so
+even multi-hour sessions never need more than one chunk of text in memory;
+csv_to_binary() converts them once for memory-mapped access.
+
+All helpers work on any array with these fields, including memmap views::
+
+    records = load('sensor_data/run1.bin')
+    window = time_slice(records, t0, t0 + 60)
+    print(channel_stats(window)['accel']['mean'])
+    uniform = resample(window, 100)
+
+Crash-safe block recordings (.rec, see block_recording) load through the same
+load() call; their extra channels are skipped like those of CSV recordings.
+iter_records() streams a recording of any format in bounded-memory chunks.
+
+read_window() extracts a time window without scanning the file: binary
+recordings are binary-searched in place, CSV recordings through the sparse
+time index (<file>.idx) the recorder writes next to them. build_index() adds
+the index to older CSV recordings.
+
+Command line:
+    python recording_reader.py convert RECORDING.csv [OUTPUT.bin]
+    python recording_reader.py stats RECORDING.csv|RECORDING.bin
+    python recording_reader.py index RECORDING.csv [INTERVAL]
+    python recording_reader.py extract RECORDING START END OUTPUT.bin
+"""
+
+import itertools
+import os
+import struct
+import sys
+
+import numpy as np
+
+from block_recording import BLOCK_MAGIC, iter_blocks, read_blocks, read_header as read_block_header
+from channel_columns import CHANNEL_COLUMNS, DEFAULT_CHANNELS, csv_header
+from recording_writer import INDEX_ENTRY, INDEX_HEADER, INDEX_MAGIC, index_path
+
+MAGIC = b'BNOREC1\0'
+HEADER = struct.Struct('<8sHHI')  # magic, version, flags, record size
+HEADER_SIZE = 64  # Header is zero-padded so records start aligned
+VERSION = 1
+FLAG_RAW = 0x0001  # Channels stored as raw int16 register values
+
+CHANNELS = ('gyro', 'accel', 'mag')
+
+SCALED_DTYPE = np.dtype([
+    ('packet', '<u4'),
+    ('timestamp', '<f8'),
+    ('gyro', '<f4', (3,)),
+    ('accel', '<f4', (3,)),
+    ('mag', '<f4', (3,)),
+])
+RAW_DTYPE = np.dtype([
+    ('packet', '<u4'),
+    ('timestamp', '<f8'),
+    ('gyro', '<i2', (3,)),
+    ('accel', '<i2', (3,)),
+    ('mag', '<i2', (3,)),
+    ('reserved', '<u2'),  # Pads records to 32 bytes
+])
+
+# Units per LSB of the raw registers, same factors as adafruit_bno055.BNO055_I2C
+SCALE = {
+    'gyro': 0.001090830782496456,  # rad/s
+    'accel': 1 / 100,  # m/s^2
+    'mag': 1 / 16,  # microtesla
+}
+
+INDEX_DTYPE = np.dtype([('offset', '<u8'), ('packet', '<u4'), ('timestamp', '<f8')])
+
+CSV_CHUNK_ROWS = 64 * 1024
+STATS_CHUNK_RECORDS = 1 << 20  # ~48 MB of scaled records per step
+
+
+def _read_header(path):
+    with open(path, 'rb') as f:
+        header = f.read(HEADER_SIZE)
+    if len(header) < HEADER_SIZE or header[:len(MAGIC)] != MAGIC:
+        raise ValueError(f'{path} is not a binary recording')
+    _, version, flags, record_size = HEADER.unpack_from(header)
+    if version != VERSION:
+        raise ValueError(f'{path}: unsupported recording version {version}')
+    dtype = RAW_DTYPE if flags & FLAG_RAW else SCALED_DTYPE
+    if record_size != dtype.itemsize:
+        raise ValueError(f'{path}: record size {record_size} does not match {dtype.itemsize}')
+    return dtype
+
+
+def open_binary(path, mode='r'):
+    """Memory-map a binary recording.
+
+    Args:
+        path: Path of the .bin file
+        mode: np.memmap mode ('r' read-only, 'r+' to edit in place, 'c' copy-on-write)
+
+    Returns:
+        np.memmap structured array with SCALED_DTYPE or RAW_DTYPE records. A
+        partially written last record (e.g. after a power cut) is left out.
+    """
+    dtype = _read_header(path)
+    count = (os.path.getsize(path) - HEADER_SIZE) // dtype.itemsize
+    if count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode=mode, offset=HEADER_SIZE, shape=(count,))
+
+
+def write_binary(path, records):
+    """Write a structured array (SCALED_DTYPE or RAW_DTYPE) as a binary recording."""
+    with open(path, 'wb') as f:
+        _write_header(f, records.dtype)
+        np.ascontiguousarray(records).tofile(f)
+
+
+def _write_header(f, dtype):
+    if dtype not in (SCALED_DTYPE, RAW_DTYPE):
+        raise ValueError(f'Unsupported record dtype {dtype}')
+    flags = FLAG_RAW if dtype == RAW_DTYPE else 0
+    f.write(HEADER.pack(MAGIC, VERSION, flags, dtype.itemsize).ljust(HEADER_SIZE, b'\0'))
+
+
+# Record field -> driver channel whose CSV columns fill it
+_CSV_CHANNELS = {'gyro': 'gyro', 'accel': 'acceleration', 'mag': 'magnetic'}
+
+
+def _csv_columns(header):
+    """Column positions per record field (None where the recording lacks the channel).
+
+    Positions refer to the parsed columns listed under 'usecols'; the others
+    (e.g. sparse low-rate channels with empty cells) are never converted.
+    """
+    names = [name.strip() for name in header]
+    wanted = {'packet': names.index('Packet number'), 'timestamp': names.index('Timestamp')}
+    for field, channel in _CSV_CHANNELS.items():
+        columns = CHANNEL_COLUMNS[channel]
+        wanted[field] = [names.index(name) for name in columns] if columns[0] in names else None
+    usecols = sorted({wanted['packet'], wanted['timestamp']}.union(
+        *(indexes for indexes in wanted.values() if isinstance(indexes, list))))
+    position = {column: index for index, column in enumerate(usecols)}
+    columns = {field: None if indexes is None else
+               position[indexes] if isinstance(indexes, int) else [position[i] for i in indexes]
+               for field, indexes in wanted.items()}
+    columns['usecols'] = usecols
+    return columns
+
+
+def _header_fields(line):
+    if line[:1].isdigit():
+        return csv_header(DEFAULT_CHANNELS)  # No header row: the default channel layout
+    return line.rstrip('\r\n').split(',')
+
+
+def _parse_csv_chunk(lines, columns):
+    try:
+        values = np.loadtxt(lines, delimiter=',', dtype=np.float64, ndmin=2,
+                            usecols=columns['usecols'])
+    except ValueError:
+        # Rows with 'None' for disabled sensors: slower parser, stored as NaN
+        values = np.genfromtxt(lines, delimiter=',', dtype=np.float64, ndmin=2,
+                               usecols=columns['usecols'])
+    records = np.empty(len(values), dtype=SCALED_DTYPE)
+    records['packet'] = values[:, columns['packet']]
+    records['timestamp'] = values[:, columns['timestamp']]
+    for field in _CSV_CHANNELS:
+        records[field] = np.nan if columns[field] is None else values[:, columns[field]]
+    return records
+
+
+def iter_csv(path, chunk_rows=CSV_CHUNK_ROWS):
+    """Parse a CSV recording chunk by chunk.
+
+    Columns are matched by their header names, so recordings with another
+    channel selection load too; gyro, accel or mag channels that were not
+    recorded come back as NaN. Extra channels are skipped.
+
+    Yields:
+        SCALED_DTYPE arrays of up to chunk_rows records
+    """
+    with open(path, 'r', newline='') as f:
+        header = f.readline()
+        if header[:1].isdigit():
+            f.seek(0)
+        columns = _csv_columns(_header_fields(header))
+        while True:
+            lines = [line for line in itertools.islice(f, chunk_rows) if line.strip()]
+            if not lines:
+                return
+            yield _parse_csv_chunk(lines, columns)
+
+
+def load_csv(path, chunk_rows=CSV_CHUNK_ROWS):
+    """Parse a whole CSV recording into one SCALED_DTYPE array."""
+    chunks = list(iter_csv(path, chunk_rows))
+    if not chunks:
+        return np.zeros(0, dtype=SCALED_DTYPE)
+    return np.concatenate(chunks)
+
+
+def csv_to_binary(csv_path, bin_path=None, chunk_rows=CSV_CHUNK_ROWS):
+    """Convert a CSV recording to a binary one, chunk by chunk.
+
+    Returns:
+        Path of the binary recording (csv_path with a .bin extension by default)
+    """
+    bin_path = bin_path or os.path.splitext(csv_path)[0] + '.bin'
+    with open(bin_path, 'wb') as f:
+        _write_header(f, SCALED_DTYPE)
+        for records in iter_csv(csv_path, chunk_rows):
+            records.tofile(f)
+    return bin_path
+
+
+def load_blocks(path):
+    """Read a block recording (up to its last valid block) as a SCALED_DTYPE array."""
+    return _scaled_blocks(*read_blocks(path))
+
+
+def _scaled_blocks(columns, stored):
+    names = columns[1:-1]  # Columns of the stored 'values'
+    records = np.empty(len(stored), dtype=SCALED_DTYPE)
+    records['packet'] = stored['packet']
+    records['timestamp'] = stored['timestamp']
+    for field, channel in _CSV_CHANNELS.items():
+        channel_columns = CHANNEL_COLUMNS[channel]
+        records[field] = (stored['values'][:, [names.index(name) for name in channel_columns]]
+                          if channel_columns[0] in names else np.nan)
+    return records
+
+
+def recording_format(path):
+    """Format of a recording from its first bytes: 'binary', 'blocks' or 'csv'."""
+    with open(path, 'rb') as f:
+        magic = f.read(len(MAGIC))
+    if magic == MAGIC:
+        return 'binary'
+    return 'blocks' if magic == BLOCK_MAGIC else 'csv'
+
+
+def load(path):
+    """Open a recording: memory-mapped if binary, read if a block recording, parsed if CSV."""
+    kind = recording_format(path)
+    if kind == 'binary':
+        return open_binary(path)
+    return load_blocks(path) if kind == 'blocks' else load_csv(path)
+
+
+def iter_records(path, chunk_records=CSV_CHUNK_ROWS):
+    """Stream any recording as SCALED_DTYPE chunks of up to chunk_records records.
+
+    Memory stays bounded by the chunk size whatever the file size: CSV is parsed
+    chunk by chunk, binary recordings are sliced from the memory map (raw ones
+    scaled per chunk) and block recordings are read a run of blocks at a time.
+    """
+    kind = recording_format(path)
+    if kind == 'binary':
+        records = open_binary(path)
+        for first in range(0, len(records), chunk_records):
+            yield scale_raw(records[first:first + chunk_records])
+    elif kind == 'blocks':
+        blocks_per_chunk = max(1, chunk_records // read_block_header(path)['records_per_block'])
+        for columns, stored in iter_blocks(path, blocks_per_chunk):
+            yield _scaled_blocks(columns, stored)
+    else:
+        yield from iter_csv(path, chunk_records)
+
+
+def scale_raw(records):
+    """Convert RAW_DTYPE records to SCALED_DTYPE using the driver's scale factors."""
+    if records.dtype == SCALED_DTYPE:
+        return records
+    scaled = np.empty(len(records), dtype=SCALED_DTYPE)
+    scaled['packet'] = records['packet']
+    scaled['timestamp'] = records['timestamp']
+    for channel in CHANNELS:
+        np.multiply(records[channel], SCALE[channel], out=scaled[channel], casting='unsafe')
+    return scaled
+
+
+def channel_stats(records, chunk_records=STATS_CHUNK_RECORDS):
+    """Per-axis count, mean, std, min and max of every channel.
+
+    Works through the records in chunks with float64 accumulators, so memory
+    use stays bounded for memory-mapped files of any size. NaN samples are
+    ignored.
+
+    Returns:
+        Dict channel -> dict of 3-element arrays ('count', 'mean', 'std', 'min', 'max')
+    """
+    totals = {channel: [np.zeros(3, np.int64), np.zeros(3), np.zeros(3),
+                        np.full(3, np.inf), np.full(3, -np.inf)] for channel in CHANNELS}
+    for start in range(0, len(records), chunk_records):
+        chunk = scale_raw(records[start:start + chunk_records])
+        for channel in CHANNELS:
+            # One contiguous row per axis; reducing along rows vectorizes far better
+            values = np.ascontiguousarray(chunk[channel].T, dtype=np.float64)
+            count, total, squares, low, high = totals[channel]
+            missing = np.isnan(values)
+            if missing.any():
+                count += (~missing).sum(axis=1)
+                total += np.nansum(values, axis=1)
+                squares += np.nansum(np.square(values), axis=1)
+            else:
+                count += values.shape[1]
+                total += values.sum(axis=1)
+                squares += np.einsum('ij,ij->i', values, values)
+            # fmin/fmax skip NaN
+            np.fmin(low, np.fmin.reduce(values, axis=1), out=low)
+            np.fmax(high, np.fmax.reduce(values, axis=1), out=high)
+
+    stats = {}
+    for channel, (count, total, squares, low, high) in totals.items():
+        with np.errstate(invalid='ignore', divide='ignore'):
+            mean = total / count
+            variance = np.maximum(squares / count - np.square(mean), 0.0)
+        empty = count == 0
+        stats[channel] = {
+            'count': count,
+            'mean': mean,
+            'std': np.sqrt(variance),
+            'min': np.where(empty, np.nan, low),
+            'max': np.where(empty, np.nan, high),
+        }
+    return stats
+
+
+def time_slice(records, start=None, end=None):
+    """Records with start <= timestamp < end, as a view (no copy for memmaps).
+
+    Timestamps must be increasing, which holds for every recording written by
+    the recorder.
+    """
+    timestamps = records['timestamp']
+    first = 0 if start is None else np.searchsorted(timestamps, start, side='left')
+    last = len(records) if end is None else np.searchsorted(timestamps, end, side='left')
+    return records[first:last]
+
+
+def read_index(path):
+    """Time index of a CSV recording as an INDEX_DTYPE array, or None without one.
+
+    Entries pointing past the end of the recording (e.g. after a crash while
+    the index was flushed first) are dropped.
+    """
+    try:
+        with open(index_path(path), 'rb') as f:
+            magic, _ = INDEX_HEADER.unpack(f.read(INDEX_HEADER.size))
+            if magic != INDEX_MAGIC:
+                raise ValueError(f'{index_path(path)} is not a recording index')
+            data = f.read()
+    except FileNotFoundError:
+        return None
+    index = np.frombuffer(data[:len(data) - len(data) % INDEX_DTYPE.itemsize], dtype=INDEX_DTYPE)
+    return index[index['offset'] < os.path.getsize(path)]
+
+
+def build_index(path, interval=500):
+    """Write the time index of an existing CSV recording (one sequential scan).
+
+    Returns:
+        Path of the index file
+    """
+    with open(path, 'rb') as f, open(index_path(path), 'wb') as index:
+        index.write(INDEX_HEADER.pack(INDEX_MAGIC, interval))
+        header = f.readline()
+        if header[:1].isdigit():
+            f.seek(0)
+        offset = f.tell()
+        row = 0
+        for line in f:
+            if line.strip():
+                if row % interval == 0:
+                    fields = line.split(b',')
+                    index.write(INDEX_ENTRY.pack(offset, int(float(fields[0])), float(fields[-1])))
+                row += 1
+            offset += len(line)
+    return index_path(path)
+
+
+def iter_window(path, start=None, end=None, key='timestamp', chunk_rows=CSV_CHUNK_ROWS):
+    """Stream the records with start <= key < end from a recording.
+
+    Binary recordings are searched in the memory map, block recordings after
+    reading them. CSV recordings use their time index to seek straight to the
+    window and stop reading after it; without an index the whole file is scanned.
+
+    Args:
+        path: CSV or binary recording
+        start, end: Window bounds (None = open)
+        key: 'timestamp' or 'packet'; both increase within a recording file
+
+    Yields:
+        Record arrays of up to chunk_rows records
+    """
+    if key not in ('timestamp', 'packet'):
+        raise ValueError(f"Cannot search by '{key}'")
+    if recording_format(path) != 'csv':
+        records = _key_slice(load(path), start, end, key)
+        for first in range(0, len(records), chunk_rows):
+            yield records[first:first + chunk_rows]
+        return
+
+    index = read_index(path)
+    if index is None or not len(index):
+        for chunk in iter_csv(path, chunk_rows):
+            chunk = _key_slice(chunk, start, end, key)
+            if len(chunk):
+                yield chunk
+        return
+
+    # Read from the last entry before the window to the first entry after it
+    first = 0 if start is None else max(np.searchsorted(index[key], start, side='right') - 1, 0)
+    last = len(index) if end is None else np.searchsorted(index[key], end, side='left')
+    offset = int(index['offset'][first])
+    stop = int(index['offset'][last]) if last < len(index) else None
+    with open(path, 'rb') as f:
+        columns = _csv_columns(_header_fields(f.readline().decode()))
+        f.seek(offset)
+        while True:
+            lines = []
+            while len(lines) < chunk_rows and (stop is None or offset < stop):
+                line = f.readline()
+                if not line:
+                    break
+                offset += len(line)
+                if line.strip():
+                    lines.append(line.decode())
+            if not lines:
+                return
+            chunk = _key_slice(_parse_csv_chunk(lines, columns), start, end, key)
+            if len(chunk):
+                yield chunk
+
+
+def read_window(path, start=None, end=None, key='timestamp'):
+    """Records with start <= key < end from a recording as one array (see iter_window)."""
+    chunks = list(iter_window(path, start, end, key))
+    if not chunks:
+        return np.zeros(0, dtype=SCALED_DTYPE)
+    return np.concatenate(chunks)
+
+
+def _key_slice(records, start, end, key):
+    values = records[key]
+    first = 0 if start is None else np.searchsorted(values, start, side='left')
+    last = len(records) if end is None else np.searchsorted(values, end, side='left')
+    return records[first:last]
+
+
+def resample(records, rate, start=None, end=None):
+    """Linearly interpolate the channels onto a uniform time grid.
+
+    Args:
+        records: Recording with increasing timestamps
+        rate: Output samples per second
+        start: First output timestamp (defaults to the first record)
+        end: Output stops before this timestamp (defaults to the last record)
+
+    Returns:
+        SCALED_DTYPE array; 'packet' numbers the output samples from 0
+    """
+    records = scale_raw(records)
+    timestamps = records['timestamp']
+    if len(records) == 0:
+        return np.zeros(0, dtype=SCALED_DTYPE)
+    start = timestamps[0] if start is None else start
+    end = timestamps[-1] + 0.5 / rate if end is None else end
+    grid = start + np.arange(int(np.ceil((end - start) * rate))) / rate
+
+    resampled = np.empty(len(grid), dtype=SCALED_DTYPE)
+    resampled['packet'] = np.arange(len(grid))
+    resampled['timestamp'] = grid
+    for channel in CHANNELS:
+        for axis in range(3):
+            resampled[channel][:, axis] = np.interp(grid, timestamps, records[channel][:, axis])
+    return resampled
+
+
+def _print_stats(path):
+    records = load(path)
+    print(f'{path}: {len(records)} records')
+    if len(records):
+        duration = records['timestamp'][-1] - records['timestamp'][0]
+        print(f'  duration {duration:.3f} s, {len(records) / duration if duration else 0:.2f} samples/s')
+    for channel, stats in channel_stats(records).items():
+        print(f"  {channel:5s} mean {np.array2string(stats['mean'], precision=4)}"
+              f" std {np.array2string(stats['std'], precision=4)}"
+              f" min {np.array2string(stats['min'], precision=4)}"
+              f" max {np.array2string(stats['max'], precision=4)}")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) >= 3 and sys.argv[1] == 'convert':
+        print(csv_to_binary(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None))
+    elif len(sys.argv) == 3 and sys.argv[1] == 'stats':
+        _print_stats(sys.argv[2])
+    elif len(sys.argv) in (3, 4) and sys.argv[1] == 'index':
+        print(build_index(sys.argv[2], *(int(arg) for arg in sys.argv[3:])))
+    elif len(sys.argv) == 6 and sys.argv[1] == 'extract':
+        window = read_window(sys.argv[2], float(sys.argv[3]), float(sys.argv[4]))
+        write_binary(sys.argv[5], window)
+        print(f'{len(window)} records written to {sys.argv[5]}')
+    else:
+        print(__doc__.split('Command line:')[1])
+        sys.exit(2)
@@ -0,0 +1,249 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import os
+import queue
+import struct
+import threading
+import time
+
+from csv_emitter import CsvEmitter
+
+# Sparse time index written next to every file (<file>.idx): a header with the
+# interval, then one entry every `index_interval` rows with the byte offset of
+# that row, its packet number and its timestamp (see recording_reader.read_window)
+INDEX_MAGIC = b'BNOIDX1\0'
+INDEX_HEADER = struct.Struct('<8sI4x')  # magic, interval
+INDEX_ENTRY = struct.Struct('<QId')  # byte offset, packet number, timestamp
+
+# Rows are collected and formatted as one block (csv_emitter) at every flush,
+# or earlier once this many are waiting; larger blocks format faster per row
+CSV_BLOCK_ROWS = 1000
+
+
+def index_path(path):
+    """Path of the time index sidecar of a recording."""
+    return f"{path}.idx"
+
+
+class RecordingWriter:
+    """Background writer that appends sample rows to (optionally segmented) CSV files.
+
+    The sampling thread only puts rows on a queue; a dedicated writer thread drains
+    the queue in batches, so SD card latency never blocks the sampler. Rows are
+    formatted in blocks with a fixed precision per column (see csv_emitter).
+    """
+
+    def __init__(self, csv_filename, header, segment_seconds=None,
+                 on_segment_closed=None, batch_size=50, flush_interval=1.0,
+                 index_interval=None, summary=False):
+        """Initialize the writer.
+
+        Args:
+            csv_filename: Path of the recording. With segmentation enabled each
+                          segment gets a ``_partNNN`` suffix before the extension
+            header: List of column names written at the top of every file
+            segment_seconds: Close the current file and start a new one after this
+                             many seconds (None keeps a single file)
+            on_segment_closed: Callback invoked with the path of every closed file
+            batch_size: Maximum number of rows written per batch
+            flush_interval: Seconds between explicit flushes of the open file
+            index_interval: Write a time index entry every this many rows
+                            (None writes no index)
+            summary: Keep running per-column statistics (see stats) and write them
+                     as <file>_summary.json next to every segment and the recording.
+                     Needs numpy, which is only imported when this is set
+        """
+        self.csv_filename = csv_filename
+        self.header = header
+        self.segment_seconds = segment_seconds
+        self.on_segment_closed = on_segment_closed
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.index_interval = index_interval
+        self.segments = []  # Paths of closed files, in order
+        # Statistics of the channel columns (all but packet number and timestamp)
+        self.stats = None
+        if summary:
+            from online_stats import RunningStats
+            self.stats = RunningStats(header[1:-1])
+
+        self._queue = queue.Queue()
+        self._thread = None
+        self._file = None
+        self._emitter = CsvEmitter(header)
+        self._pending = []  # Rows not formatted yet
+        self._index_file = None
+        self._offset = 0  # Bytes written to the open file
+        self._segment_rows = 0
+        self._segment_index = 0
+        self._segment_path = None
+        self._segment_opened = 0.0
+        self._last_flush = 0.0
+        self._segment_stats = None
+        # Rows, first/last packet and start/end time of the open segment and the recording
+        self._segment_extent = {}
+        self._recording_extent = {}
+
+    def start(self):
+        """Open the first file and start the writer thread."""
+        self._open_segment()
+        self._thread = threading.Thread(target=self._run, name="recording-writer")
+        self._thread.daemon = True
+        self._thread.start()
+
+    def write(self, row):
+        """Queue one row for writing. Safe to call from the sampling thread."""
+        self._queue.put(row)
+
+    def queue_depth(self):
+        """Number of rows waiting to be written."""
+        return self._queue.qsize()
+
+    def close(self, timeout=None):
+        """Write all queued rows, close the open file and stop the writer thread."""
+        if self._thread is None:
+            return
+        self._queue.put(None)
+        self._thread.join(timeout)
+        self._thread = None
+
+    def _segment_filename(self):
+        if self.segment_seconds is None:
+            return self.csv_filename
+        root, ext = os.path.splitext(self.csv_filename)
+        return f"{root}_part{self._segment_index:03d}{ext}"
+
+    def _open_segment(self):
+        self._segment_index += 1
+        self._segment_path = self._segment_filename()
+        directory = os.path.dirname(self._segment_path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._open_file(self._segment_path)
+        self._segment_rows = 0
+        if self.stats is not None:
+            from online_stats import RunningStats
+            self._segment_stats = RunningStats(self.stats.columns)
+            self._segment_extent = {}
+        self._segment_opened = time.monotonic()
+        self._last_flush = self._segment_opened
+
+    def _open_file(self, path):
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        header_line = self._emitter.header_line()
+        self._file.write(header_line)
+        self._offset = len(header_line.encode('utf-8'))
+        if self.index_interval:
+            self._index_file = open(index_path(path), 'wb')
+            self._index_file.write(INDEX_HEADER.pack(INDEX_MAGIC, self.index_interval))
+
+    def _flush(self):
+        self._emit()
+        self._file.flush()
+        if self._index_file is not None:
+            self._index_file.flush()
+
+    def _close_file(self):
+        self._emit()
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        self._file = None
+        if self._index_file is not None:
+            self._index_file.close()
+            self._index_file = None
+
+    def _close_segment(self):
+        self._close_file()
+        if self._segment_stats is not None:
+            self._write_summary(self._segment_path, self._segment_stats, self._segment_extent)
+        self.segments.append(self._segment_path)
+        if self.on_segment_closed:
+            try:
+                self.on_segment_closed(self._segment_path)
+            except Exception as e:
+                print(f"Error handing off segment {self._segment_path}: {e}")
+
+    def _update_stats(self, rows):
+        import numpy as np
+        from online_stats import RunningStats
+        values = np.array(rows, dtype=np.float64)  # None (missing) becomes NaN
+        batch = RunningStats(self.stats.columns)
+        batch.update(values[:, 1:-1])
+        self._segment_stats.merge(batch)
+        self.stats.merge(batch)
+        for extent in (self._segment_extent, self._recording_extent):
+            if not extent:
+                extent.update(first_packet=int(values[0, 0]), start=float(values[0, -1]), rows=0)
+            extent.update(last_packet=int(values[-1, 0]), end=float(values[-1, -1]),
+                          rows=extent['rows'] + len(rows))
+
+    def _write_summary(self, path, stats, extent, **info):
+        from online_stats import summary_path
+        try:
+            stats.write_json(summary_path(path), file=os.path.basename(path), **extent, **info)
+        except OSError as e:
+            print(f"Error writing statistics summary for {path}: {e}")
+
+    def _write_rows(self, rows):
+        self._pending.extend(rows)
+        if len(self._pending) >= CSV_BLOCK_ROWS:
+            self._emit()
+
+    def _emit(self):
+        """Format the pending rows and write them to the open file."""
+        rows, self._pending = self._pending, []
+        if not rows:
+            return
+        if self._index_file is None:
+            self._write_text(self._emitter.format(rows))
+        else:
+            # Index the rows whose number in this file is a multiple of the interval
+            first = -self._segment_rows % self.index_interval
+            self._write_text(self._emitter.format(rows[:first]))
+            for start in range(first, len(rows), self.index_interval):
+                row = rows[start]
+                self._index_file.write(INDEX_ENTRY.pack(self._offset, int(row[0]), float(row[-1])))
+                self._write_text(self._emitter.format(rows[start:start + self.index_interval]))
+        self._segment_rows += len(rows)
+
+    def _write_text(self, text):
+        self._file.write(text)
+        # Formatted rows are plain ASCII: one byte per character, so no tell() needed
+        self._offset += len(text)
+
+    def _run(self):
+        finished = False
+        while not finished:
+            rows = [self._queue.get()]
+            while len(rows) < self.batch_size:
+                try:
+                    rows.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if rows[-1] is None:
+                rows.pop()
+                finished = True
+
+            now = time.monotonic()
+            if (self.segment_seconds is not None and rows
+                    and now - self._segment_opened >= self.segment_seconds):
+                self._close_segment()
+                self._open_segment()
+
+            try:
+                self._write_rows(rows)
+                if self.stats is not None and rows:
+                    self._update_stats(rows)
+                if finished or now - self._last_flush >= self.flush_interval:
+                    self._flush()
+                    self._last_flush = now
+            except Exception as e:
+                print(f"Error writing recording data: {e}")
+
+        self._close_segment()
+        if self.stats is not None and self.segment_seconds is not None:
+            # Whole recording; an unsegmented recording's summary is its segment's
+            self._write_summary(self.csv_filename, self.stats, self._recording_extent,
+                                segments=[os.path.basename(path) for path in self.segments])
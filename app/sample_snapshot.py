@@ -0,0 +1,46 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+from datetime import datetime
+
+
+class SampleSnapshot:
+    """Immutable view of the latest sample, published by the sampling thread.
+
+    The sampler builds a new snapshot per sample and publishes it with a single
+    reference store (``global_vars['sample'] = snapshot``). Readers take the
+    reference once and always see fields from the same sample; `seq` increases
+    with every publish, so readers can tell whether anything changed, like the
+    sequence counter of a seqlock but without any retry loop. Snapshots are
+    never modified after they are published.
+    """
+
+    __slots__ = ('seq', 'packet_counter', 'timestamp', 'elapsed_ms', 'gyro', 'accel', 'mag', 'error')
+
+    def __init__(self, seq=0, packet_counter=0, timestamp=None, elapsed_ms=0,
+                 gyro=None, accel=None, mag=None, error=None):
+        self.seq = seq
+        self.packet_counter = packet_counter
+        self.timestamp = timestamp
+        self.elapsed_ms = elapsed_ms
+        self.gyro = gyro
+        self.accel = accel
+        self.mag = mag
+        self.error = error
+
+    @property
+    def timestamp_str(self):
+        """Timestamp formatted for display, computed only when someone asks."""
+        if self.timestamp is None:
+            return None
+        return datetime.fromtimestamp(self.timestamp).strftime("%Y-%m-%d %H:%M:%S.%f")[:-3]
+
+    def with_error(self, error, elapsed_ms):
+        """Next snapshot keeping this sample's values but reporting an error."""
+        return SampleSnapshot(self.seq + 1, self.packet_counter, self.timestamp, elapsed_ms,
+                              self.gyro, self.accel, self.mag, error)
+
+    def __repr__(self):
+        return (f'SampleSnapshot(seq={self.seq}, packet_counter={self.packet_counter}, '
+                f'timestamp={self.timestamp}, gyro={self.gyro}, accel={self.accel}, '
+                f'mag={self.mag}, error={self.error!r})')
@@ -0,0 +1,212 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import collections
+import math
+import time
+from array import array
+
+CHANNEL_GROUPS = [
+    ("Gyro (deg/s)", (0, 1, 2)),
+    ("Accel (g)", (3, 4, 5)),
+    ("Mag (uT)", (6, 7, 8)),
+]
+AXIS_COLORS = ("#cc0000", "#008800", "#0044cc")
+
+
+class SampleRingBuffer:
+    """Fixed-size ring buffer of the nine sensor channels.
+
+    Written by the sampling thread only and read by the UI thread. The writer
+    fills the slot before bumping `count`, so readers never need a lock; a
+    reader that falls more than `capacity` samples behind skips ahead.
+    """
+
+    def __init__(self, capacity=2048, channels=9):
+        self.capacity = capacity
+        self.channels = channels
+        self.data = [array('d', [math.nan]) * capacity for _ in range(channels)]
+        self.count = 0  # Total samples ever written
+
+    def append(self, gyro, accel, mag):
+        """Store one sample (None values are stored as NaN)."""
+        slot = self.count % self.capacity
+        channel = 0
+        for triple in (gyro, accel, mag):
+            for value in triple:
+                self.data[channel][slot] = math.nan if value is None else value
+                channel += 1
+        self.count += 1
+
+    def read_since(self, start):
+        """Return (new_count, samples) with the samples written since `start`.
+
+        Each sample is a tuple of the channel values. At most `capacity` samples
+        are returned; older ones have been overwritten.
+        """
+        end = self.count
+        # The oldest slot may be overwritten by the writer right now, so skip it
+        start = max(start, end - self.capacity + 1)
+        samples = []
+        for index in range(start, end):
+            slot = index % self.capacity
+            samples.append(tuple(channel[slot] for channel in self.data))
+        return end, samples
+
+
+class EnvelopePlot:
+    """Scrolling min/max envelope plots of all nine channels on one Tk Canvas.
+
+    Samples are decimated incrementally to one (min, max) pair per pixel column
+    as they arrive, so redraw cost depends on the canvas width, not the number
+    of samples. Each channel is a single canvas line updated in place. Redraws
+    back off while the sampler reports more lag than `max_lag`, so plotting can
+    never push sampling jitter past that threshold for long.
+
+    The redraw also holds the GIL the sampler needs, so its cost is limited up
+    front: each pane's last redraw is timed, and an update only redraws the
+    panes (round-robin) whose cost fits in the sampler's slack, `max_lag` minus
+    its current lag. When not even one pane fits, one is still redrawn every
+    `max_interval` so the plot does not freeze; that redraw may exceed the slack.
+    """
+
+    def __init__(self, canvas, ring_buffer, global_vars, window_seconds=10.0,
+                 sample_rate=50, max_lag=0.005, max_interval=2.0):
+        """Initialize the plot.
+
+        Args:
+            canvas: tk.Canvas to draw on (its configured width/height are used)
+            ring_buffer: SampleRingBuffer filled by the sampling thread
+            global_vars: Shared state; 'sampler_lag' drives the redraw governor
+            window_seconds: Time span shown across the canvas width
+            sample_rate: Expected samples per second
+            max_lag: Sampling lag in seconds above which redraws are skipped
+            max_interval: Longest time between redraws while backing off or
+                over budget
+        """
+        self.canvas = canvas
+        self.ring = ring_buffer
+        self.globals = global_vars
+        self.max_lag = max_lag
+        self.max_interval = max_interval
+        self.width = int(canvas.cget("width"))
+        self.height = int(canvas.cget("height"))
+        self.samples_per_column = max(1, math.ceil(window_seconds * sample_rate / self.width))
+        self.redraw_interval = 0.0
+        self.skipped_redraws = 0
+        self.pane_costs = [0.0] * len(CHANNEL_GROUPS)  # Seconds of each pane's last redraw
+
+        self._read_count = 0
+        self._columns = [collections.deque(maxlen=self.width) for _ in range(ring_buffer.channels)]
+        self._bucket_lo = [math.inf] * ring_buffer.channels
+        self._bucket_hi = [-math.inf] * ring_buffer.channels
+        self._bucket_size = 0
+        self._last_redraw = 0.0
+        self._next_pane = 0
+        self._lines = []
+        self._labels = []
+        self._create_items()
+
+    def _create_items(self):
+        pane_height = self.height / len(CHANNEL_GROUPS)
+        for pane, (title, channels) in enumerate(CHANNEL_GROUPS):
+            top = pane * pane_height
+            if pane:
+                self.canvas.create_line(0, top, self.width, top, fill="#cccccc")
+            for axis, channel in enumerate(channels):
+                self._lines.append(self.canvas.create_line(0, 0, 0, 0, fill=AXIS_COLORS[axis]))
+            self._labels.append(self.canvas.create_text(
+                4, top + 2, anchor="nw", text=title, font=("Arial", 8)))
+
+    def reset(self):
+        """Forget plotted data (e.g. when a new recording starts)."""
+        self._read_count = self.ring.count
+        for columns in self._columns:
+            columns.clear()
+        self._reset_bucket()
+        for line in self._lines:
+            self.canvas.coords(line, 0, 0, 0, 0)
+
+    def _reset_bucket(self):
+        self._bucket_lo = [math.inf] * self.ring.channels
+        self._bucket_hi = [-math.inf] * self.ring.channels
+        self._bucket_size = 0
+
+    def _decimate_new_samples(self):
+        self._read_count, samples = self.ring.read_since(self._read_count)
+        lo, hi = self._bucket_lo, self._bucket_hi
+        for sample in samples:
+            for channel, value in enumerate(sample):
+                if value < lo[channel]:
+                    lo[channel] = value
+                if value > hi[channel]:
+                    hi[channel] = value
+            self._bucket_size += 1
+            if self._bucket_size >= self.samples_per_column:
+                for channel, columns in enumerate(self._columns):
+                    columns.append((lo[channel], hi[channel]))
+                self._reset_bucket()
+                lo, hi = self._bucket_lo, self._bucket_hi
+
+    def update(self):
+        """Fold in new samples and redraw unless the sampler is under pressure."""
+        self._decimate_new_samples()
+
+        now = time.monotonic()
+        lag = self.globals.get('sampler_lag', 0.0)
+        if lag > self.max_lag:
+            # Back off: redraw less often until the sampler recovers
+            self.redraw_interval = min(self.max_interval, max(0.2, self.redraw_interval * 2))
+        else:
+            self.redraw_interval /= 2
+        if now - self._last_redraw < self.redraw_interval:
+            self.skipped_redraws += 1
+            return
+
+        # Redraw only the panes whose last cost fits in the sampler's slack
+        budget = self.max_lag - lag
+        panes = []
+        for offset in range(len(CHANNEL_GROUPS)):
+            pane = (self._next_pane + offset) % len(CHANNEL_GROUPS)
+            budget -= self.pane_costs[pane]
+            if budget < 0:
+                break
+            panes.append(pane)
+        if not panes:
+            if now - self._last_redraw < self.max_interval:
+                self.skipped_redraws += 1
+                return
+            panes = [self._next_pane]  # Over budget: keep the plot alive, one pane at a time
+        self._last_redraw = now
+        for pane in panes:
+            started = time.perf_counter()
+            self._redraw_pane(pane)
+            self.pane_costs[pane] = time.perf_counter() - started
+        self._next_pane = (panes[-1] + 1) % len(CHANNEL_GROUPS)
+
+    def _redraw_pane(self, pane):
+        pane_height = self.height / len(CHANNEL_GROUPS)
+        channels = CHANNEL_GROUPS[pane][1]
+        # Shared autoscale per pane, from the envelope (O(pixels))
+        values = [v for channel in channels for column in self._columns[channel]
+                  for v in column if not math.isnan(v) and not math.isinf(v)]
+        if values:
+            low, high = min(values), max(values)
+        else:
+            low, high = -1.0, 1.0
+        if high - low < 1e-9:
+            low, high = low - 1.0, high + 1.0
+        top = pane * pane_height + 14
+        scale = (pane_height - 18) / (high - low)
+        for channel in channels:
+            columns = self._columns[channel]
+            start_x = self.width - len(columns)
+            coords = []
+            for x, (column_lo, column_hi) in enumerate(columns, start_x):
+                if math.isnan(column_lo) or math.isinf(column_lo):
+                    continue
+                coords.extend((x, top + (high - column_lo) * scale,
+                               x, top + (high - column_hi) * scale))
+            if len(coords) < 4:
+                coords = [0, 0, 0, 0]
+            self.canvas.coords(self._lines[channel], *coords)
@@ -4,16 +4,19 @@
 import time
 import tkinter as tk
 from tkinter import ttk
-import threading
-import os
 from datetime import datetime
+from sensor_plot import EnvelopePlot
+from channel_columns import CHANNEL_COLUMNS
+from recording_control import RecordingController, ControlError, READY, ARMED, RECORDING, STOPPED, UPLOADING
 
 # This class has been moved to a separate file for better organization
 class SensorUI:
-    def __init__(self, collect_data_function, global_vars):
+    def __init__(self, collect_data_function, global_vars, controller=None):
         # Store the data collection function and global variables
         self.collect_data_function = collect_data_function
         self.globals = global_vars
+        # Recording state machine, shared with the control API when one is running
+        self.controller = controller or RecordingController(collect_data_function, global_vars)
         
         # Initialize UI components
         self.root = None
@@ -25,16 +28,20 @@ class SensorUI:
         self.gyro_label = None
         self.accel_label = None
         self.mag_label = None
+        self.stats_label = None
         self.error_label = None
         self.status_label = None
         self.upload_label = None
-        self.data_thread = None
+        self.plot = None
+        self._shown_state = None
+        self._update_job = None
 
     def setup_ui(self):
         # Create the GUI
         self.root = tk.Tk()
         self.root.title("I2C Data Recorder")
-        self.root.geometry("500x350")  # Standard size to fit all elements
+        plot_buffer = self.globals.get('plot_buffer')
+        self.root.geometry("500x650" if plot_buffer else "500x350")  # Standard size to fit all elements
         self.root.resizable(False, False)
         self.root.protocol("WM_DELETE_WINDOW", self.exit_application)
 
@@ -69,6 +76,15 @@ class SensorUI:
         # Sensor value labels (initially blank - will be shown during recording)
         self.gyro_label = ttk.Label(data_frame, text="", font=("Arial", 12))
         self.accel_label = ttk.Label(data_frame, text="", font=("Arial", 12))
+        # Running statistics of the recording, kept visible after stopping for a quick QC
+        self.stats_label = ttk.Label(data_frame, text="", font=("Courier", 9), justify=tk.LEFT)
+
+        # Scrolling min/max plots of all nine channels
+        if plot_buffer:
+            canvas = tk.Canvas(frame, width=460, height=290, background="white", highlightthickness=0)
+            canvas.pack(pady=5)
+            self.plot = EnvelopePlot(canvas, plot_buffer, self.globals,
+                                     sample_rate=self.globals.get('frequency', 50))
 
         # Add spacer with a horizontal line for better visual separation
         separator = ttk.Separator(frame, orient='horizontal')
@@ -160,170 +176,150 @@ class SensorUI:
         # If user cancelled, don't start collection
         if filename is None:
             return
-            
-        # Update the filename in globals
-        csv_dir = "sensor_data/"
-        csv_filename = f"{csv_dir}{filename}.csv"
-        self.globals['csv_filename'] = csv_filename
-        self.globals['custom_filename_provided'] = True
-        
-        # Reset upload status for new recording
-        self.globals['file_uploaded'] = False
         
-        # Set global variables through the globals dictionary
-        self.globals['running'] = True
-        self.globals['collecting_data'] = True
-        
-        # Clear any previous upload messages
-        self.upload_label.config(text="")
+        try:
+            self.controller.start(filename)
+        except (ControlError, ValueError) as e:
+            self.upload_label.config(text=f"Cannot start: {e}", foreground="orange")
+            return
+        self.show_state()
+        print(f"Data collection started with filename: {self.globals['csv_filename']}")
 
+    def show_state(self):
+        # Bring labels and buttons in line with the recording state, which may also
+        # have been changed through the control API
+        state = self.controller.state
+        if state == self._shown_state:
+            return
+        self._shown_state = state
         
-        
-        # Start data collection thread if not already running
-        if self.data_thread is None or not self.data_thread.is_alive(): 
-            self.data_thread = threading.Thread(target=self.collect_data_function)
-            self.data_thread.daemon = True
-            self.data_thread.start()
+        if state == RECORDING:
+            # Clear any previous upload messages
+            self.upload_label.config(text="")
+            if self.plot:
+                self.plot.reset()
             # Start UI updates
+            if self._update_job:
+                self.root.after_cancel(self._update_job)
             self.update_ui()
-
             # Show sensor labels when recording starts
             self.gyro_label.pack(pady=2)
             self.accel_label.pack(pady=2)
-        
-        self.status_label.config(text="Status: RECORDING", foreground="green", font=("Arial", 14, "bold"))
-        self.start_button.config(state="disabled")
-        self.stop_button.config(state="normal")
-        self.upload_button.config(state="disabled")
-        self.exit_button.config(state="disabled")
-        print(f"Data collection started with filename: {csv_filename}")
+            self.stats_label.pack(pady=2)
+            self.status_label.config(text="Status: RECORDING", foreground="green", font=("Arial", 14, "bold"))
+            self._set_buttons(start="disabled", stop="normal", upload="disabled", exit_app="disabled")
+        elif state == ARMED:
+            self.status_label.config(text="Status: ARMED", foreground="orange", font=("Arial", 14, "bold"))
+            self._set_buttons(start="disabled", stop="normal", upload="disabled", exit_app="disabled")
+        elif state == STOPPED:
+            self.status_label.config(text="Status: STOPPED", foreground="red", font=("Arial", 14, "bold"))
+            # Keep start button disabled - only allow upload or exit after stopping
+            self._set_buttons(start="disabled", stop="disabled", upload="normal", exit_app="normal")
+            # Hide sensor labels when recording stops
+            self.gyro_label.pack_forget()
+            self.accel_label.pack_forget()
+            self.stats_label.config(text=self._stats_text())  # Final values
+        elif state == UPLOADING:
+            self.status_label.config(text="Status: UPLOADING TO CLOUD", foreground="blue", font=("Arial", 14, "bold"))
+            self._set_buttons(start="disabled", stop="disabled", upload="disabled", exit_app="disabled")
+        elif state == READY:
+            # Update the UI to reflect reset values
+            self.packet_label.config(text="Data Count: 0")
+            self.duration_label.config(text="Duration: 0 ms")
+            self.gyro_label.pack_forget()
+            self.accel_label.pack_forget()
+            self.stats_label.pack_forget()
+            self.status_label.config(text="Status: Ready", foreground="blue", font=("Arial", 14, "bold"))
+            self._set_buttons(start="normal", stop="disabled", upload="disabled", exit_app="normal")
+
+    def _set_buttons(self, start, stop, upload, exit_app):
+        self.start_button.config(state=start)
+        self.stop_button.config(state=stop)
+        self.upload_button.config(state=upload)
+        self.exit_button.config(state=exit_app)
+
+    def watch_state(self):
+        self.show_state()
+        self.root.after(250, self.watch_state)
 
     def update_ui(self):
-        # Get global variables from the globals dictionary
-        packet_counter = self.globals['packet_counter']
-        latest_gyro = self.globals['latest_gyro']
-        latest_accel = self.globals['latest_accel']
-        latest_mag = self.globals['latest_mag']
-        latest_timestamp_str = self.globals['latest_timestamp_str']
-        latest_error = self.globals['latest_error']
+        # Take the latest sample once so every field below comes from the same sample
+        sample = self.globals['sample']
         running = self.globals['running']
-        elapsed_ms = self.globals.get('elapsed_ms', 0)  # Get elapsed time in milliseconds
         if running:
             # Update data display with more prominent formatting
-            self.packet_label.config(text=f"Data Count: {packet_counter}")
+            self.packet_label.config(text=f"Data Count: {sample.packet_counter}")
             
             # Update duration display
-            if elapsed_ms is not None:
-                self.duration_label.config(text=f"Duration: {elapsed_ms} ms")
+            self.duration_label.config(text=f"Duration: {sample.elapsed_ms} ms")
             
-            if latest_error:
-                self.error_label.config(text=f"Error: {latest_error}")
+            if sample.error:
+                self.error_label.config(text=f"Error: {sample.error}")
+            if self.plot:
+                self.plot.update()
+            self.stats_label.config(text=self._stats_text())
             # Wait for 100ms (less frequent to not slow down data collection)
-            self.root.after(100, self.update_ui)
+            self._update_job = self.root.after(100, self.update_ui)
         else:
             # Stop the UI update loop
-            self.root.after_cancel(self.update_ui)
+            self._update_job = None
         
         # Update sensor value displays
-        if latest_gyro is not None:
-            self.gyro_label.config(text=f"Gyro (deg/s): {latest_gyro[0]:.2f}, {latest_gyro[1]:.2f}, {latest_gyro[2]:.2f}")
-        if latest_accel is not None:
-            self.accel_label.config(text=f"Accel (g): {latest_accel[0]:.2f}, {latest_accel[1]:.2f}, {latest_accel[2]:.2f}")
+        gyro, accel = sample.gyro, sample.accel
+        if gyro is not None:
+            self.gyro_label.config(text=f"Gyro (deg/s): {gyro[0]:.2f}, {gyro[1]:.2f}, {gyro[2]:.2f}")
+        if accel is not None:
+            self.accel_label.config(text=f"Accel (g): {accel[0]:.2f}, {accel[1]:.2f}, {accel[2]:.2f}")
     
+    def _stats_text(self):
+        # Mean, standard deviation and RMS per axis from the recorder's running statistics
+        stats = self.globals.get('channel_stats')
+        if stats is None:
+            return ""
+        summary = stats.summary()
+        lines = []
+        for title, channel in (("Gyro", "gyro"), ("Accel", "acceleration"), ("Mag", "magnetic")):
+            columns = [summary.get(name) for name in CHANNEL_COLUMNS[channel]]
+            if not columns[0] or not columns[0]['count']:
+                continue
+            for key in ('mean', 'std', 'rms'):
+                values = ", ".join(f"{column[key]:8.3f}" for column in columns)
+                lines.append(f"{title if key == 'mean' else '':5s} {key:4s} {values}")
+        return "\n".join(lines)
+
     def stop_collection(self):
-        # Update global variables through the globals dictionary
-        self.globals['running'] = False
-        self.globals['collecting_data'] = False
-        
-        self.status_label.config(text="Status: STOPPED", foreground="red", font=("Arial", 14, "bold"))
-        self.stop_button.config(state="disabled")
-        # Keep start button disabled as requested - only allow upload or exit after stopping
-        self.start_button.config(state="disabled")
-        self.upload_button.config(state="normal")
-        self.exit_button.config(state="normal")
-        self.data_thread = None
+        try:
+            self.controller.stop()
+        except ControlError as e:
+            print(f"Cannot stop: {e}")
+        self.show_state()
         print("Data collection stopped - can only upload or exit")
-
-        # Hide sensor labels when recording stops
-        self.gyro_label.pack_forget()
-        self.accel_label.pack_forget()
     
     def upload_to_drive(self):
-        # Get CSV filename from globals
-        csv_filename = self.globals['csv_filename']
-        google_uploader = self.globals['google_uploader']
-        file_uploaded = self.globals.get('file_uploaded', False)
-        
         # Disable all buttons during upload
-        self.upload_button.config(state="disabled")
-        self.start_button.config(state="disabled")
-        self.stop_button.config(state="disabled")
-        self.exit_button.config(state="disabled")
+        self._set_buttons(start="disabled", stop="disabled", upload="disabled", exit_app="disabled")
         
         # Show uploading status with larger text
         self.status_label.config(text="Status: UPLOADING TO CLOUD", foreground="blue", font=("Arial", 14, "bold"))
+        self.root.update()
         
-        # Check if file already uploaded in this session
-        if file_uploaded:
-            self.upload_label.config(text="This file has already been uploaded", foreground="orange")
-            self.root.update()
-            time.sleep(2)
-        # Upload the CSV file to Google Drive if it exists
-        elif csv_filename and os.path.exists(csv_filename):
-            try:
-                self.upload_label.config(text=f"Uploading {os.path.basename(csv_filename)} to Google Drive...")
-                self.root.update()  # Force UI update
-                
-                print(f"Uploading {csv_filename} to Google Drive...")
-                file_id = google_uploader.upload_file(csv_filename)
-                
-                if file_id:
-                    success_msg = f"Successfully uploaded to Google Drive with ID: {file_id}"
-                    self.upload_label.config(text=success_msg, foreground="green")
-                    print(f"Successfully uploaded {csv_filename} to Google Drive with ID: {file_id}")
-                    # Reset file tracking for next recording cycle
-                    self.globals['csv_filename'] = None
-                    self.globals['custom_filename_provided'] = False
-                    self.globals['file_uploaded'] = False
-                    # Display the success message for 1 second per requirements
-                    self.root.update()
-                    time.sleep(1)
-                else:
-                    fail_msg = f"Failed to upload to Google Drive"
-                    self.upload_label.config(text=fail_msg, foreground="red")
-                    print(f"Failed to upload {csv_filename} to Google Drive")
-                    # Display the failure message for 3 seconds per requirements
-                    self.root.update()
-                    time.sleep(3)
-                
-            except Exception as e:
-                error_msg = f"Error: {str(e)}"
-                self.upload_label.config(text=error_msg, foreground="red")
-                self.root.update()
-                print(f"Error uploading file to Google Drive: {e}")
-                # Display the error message for 3 seconds per requirements
-                time.sleep(3)
-        else:
-            self.upload_label.config(text="No data file to upload", foreground="orange")
-            self.root.update()
-            time.sleep(2)
-        
-        # After upload is complete, enable both start and exit buttons
-        # This allows starting a new recording cycle after uploading
-        self.start_button.config(state="normal")
-        self.exit_button.config(state="normal")
-        
-        # Reset key values for the next recording cycle
-        self.globals['packet_counter'] = 0
-        self.globals['elapsed_ms'] = 0
-        self.globals['start_time'] = None
-        
-        # Update the UI to reflect reset values
-        self.packet_label.config(text="Data Count: 0")
-        self.duration_label.config(text="Duration: 0 ms")
-        
-        # Update status to ready for new recording
-        self.status_label.config(text="Status: Ready", foreground="blue", font=("Arial", 14, "bold"))
+        def progress(message):
+            self.upload_label.config(text=message, foreground="blue")
+            self.root.update()  # Force UI update
+        
+        try:
+            level, message = self.controller.upload(progress=progress)
+        except ControlError as e:
+            level, message = 'warning', str(e)
+        
+        # Display the result: success for 1 second, warnings for 2, failures for 3
+        colors = {'ok': "green", 'warning': "orange", 'error': "red"}
+        self.upload_label.config(text=message, foreground=colors[level])
+        self.root.update()
+        time.sleep({'ok': 1, 'warning': 2, 'error': 3}[level])
+        
+        # Back to ready: this allows starting a new recording cycle after uploading
+        self.show_state()
     
     def exit_application(self):
         # Update global variables through the globals dictionary
@@ -332,9 +328,9 @@ class SensorUI:
         self.globals['collecting_data'] = False
         
         # Wait for data collection thread to finish if it's running
-        if self.data_thread and self.data_thread.is_alive():
+        if self.controller.state in (ARMED, RECORDING):
             print("Waiting for data collection thread to terminate...")
-            self.data_thread.join(timeout=2)
+            self.controller.stop()
         
         # Now we can safely exit
         self.root.destroy()
@@ -344,5 +340,6 @@ class SensorUI:
         self.globals['ui_active'] = True
         
         self.setup_ui()
+        self.watch_state()
         self.root.mainloop()
         print("UI thread terminated")
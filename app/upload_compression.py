@@ -0,0 +1,94 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+import bz2
+import gzip
+import hashlib
+import lzma
+import os
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+# Codec name -> (file extension, MIME type, default level)
+CODECS = {
+    'gzip': ('.gz', 'application/gzip', 6),
+    'bz2': ('.bz2', 'application/x-bzip2', 9),
+    'xz': ('.xz', 'application/x-xz', 3),
+    'zstd': ('.zst', 'application/zstd', 3),
+}
+
+READ_SIZE = 64 * 1024  # Bytes read per step; the only data held in memory
+PROPERTY_LIMIT = 124  # Drive's limit on the bytes of a property, key and value together
+
+
+def _open_compressed(path, codec, level):
+    if codec == 'gzip':
+        # mtime=0 keeps the output reproducible for identical input
+        return gzip.GzipFile(path, 'wb', compresslevel=level, mtime=0)
+    if codec == 'bz2':
+        return bz2.BZ2File(path, 'wb', compresslevel=level)
+    if codec == 'xz':
+        return lzma.LZMAFile(path, 'wb', preset=level)
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError("zstd compression needs the 'zstandard' package")
+        return zstandard.ZstdCompressor(level=level).stream_writer(open(path, 'wb'))
+    raise ValueError(f"Unknown compression codec '{codec}'")
+
+
+def compress_file(file_path, codec='gzip', level=None, output_dir=None):
+    """Compress a file as a stream into a temporary file next to it.
+
+    Data is processed in READ_SIZE steps, so memory use does not depend on the
+    file size. The temporary file is written to output_dir, by default the
+    source's directory on the SD card rather than /tmp, which may be RAM-backed.
+
+    Args:
+        file_path: Path of the file to compress
+        codec: One of the names in CODECS
+        level: Compression level (codec default if None)
+        output_dir: Directory for the compressed file (defaults to the source's)
+
+    Returns:
+        Tuple (compressed_path, upload_name, mime_type, properties). properties
+        holds the original size and SHA-256 for the Drive file, and the original
+        name unless it is too long for a Drive property (upload_name keeps it)
+    """
+    if codec not in CODECS:
+        raise ValueError(f"Unknown compression codec '{codec}'")
+    extension, mime_type, default_level = CODECS[codec]
+    level = default_level if level is None else level
+
+    name = os.path.basename(file_path)
+    directory = output_dir or os.path.dirname(file_path) or '.'
+    compressed_path = os.path.join(directory, f'.{name}{extension}.part')
+
+    sha256 = hashlib.sha256()
+    size = 0
+    try:
+        with open(file_path, 'rb') as source, \
+                _open_compressed(compressed_path, codec, level) as target:
+            while True:
+                data = source.read(READ_SIZE)
+                if not data:
+                    break
+                sha256.update(data)
+                size += len(data)
+                target.write(data)
+    except Exception:
+        if os.path.exists(compressed_path):
+            os.remove(compressed_path)
+        raise
+
+    properties = {
+        'original_size': str(size),
+        'original_sha256': sha256.hexdigest(),
+        'compression': codec,
+        'compression_level': str(level),
+    }
+    if len('original_name'.encode()) + len(name.encode()) <= PROPERTY_LIMIT:
+        properties['original_name'] = name
+    return compressed_path, name + extension, mime_type, properties
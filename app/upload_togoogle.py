@@ -1,23 +1,226 @@
+from google.auth.transport.requests import Request
 from google.oauth2 import service_account
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaFileUpload
+from googleapiclient import discovery_cache
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.errors import HttpError
+from googleapiclient.http import MediaFileUpload, MediaIoBaseUpload, DEFAULT_CHUNK_SIZE
+import datetime
+import httplib2
+import json
 import os
+import queue
+import random
+import threading
+import time
+
+from upload_compression import compress_file
+
+# Access tokens are persisted here so warm starts skip the token mint
+TOKEN_CACHE_FILE = os.path.expanduser('~/.cache/i2c_data_recorder/drive_token.json')
+
+# With a rate limiter, file data is read in slices of this size, each paid for
+# before it is read, and sent in chunks of this size (the smallest chunk Drive
+# accepts before the last one) so that neither the SD card reads nor the sends
+# come in large bursts
+THROTTLE_SLICE = 32 * 1024
+THROTTLED_CHUNK_SIZE = 256 * 1024
+
+
+def _utcnow():
+    # google-auth compares token expiry against naive UTC datetimes
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+def _backoff_delay(failures):
+    # Randomized exponential backoff, as googleapiclient uses for its own retries
+    return random.random() * 2 ** failures
+
+
+class TokenBucket:
+    """Token-bucket limiter for upload bytes per second."""
+
+    def __init__(self, rate, burst=None, clock=time.monotonic, sleep=time.sleep):
+        """Initialize the limiter.
+
+        Args:
+            rate: Sustained rate in bytes/s (None = unlimited)
+            burst: Largest amount that may be sent at once, in bytes
+                   (defaults to a quarter second worth of data)
+            clock: Callable returning monotonic seconds (replaceable in tests)
+            sleep: Callable waiting the given seconds (replaceable in tests)
+        """
+        self.rate = rate
+        self.burst = burst or max(int((rate or 0) / 4), 16 * 1024)
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.burst
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def current_rate(self):
+        """Rate currently enforced, in bytes/s (None = unlimited)."""
+        return self.rate
+
+    def consume(self, amount):
+        """Block until `amount` bytes may be sent."""
+        while amount > 0:
+            take = min(amount, self.burst)
+            with self._lock:
+                rate = self.current_rate()
+                now = self.clock()
+                if rate is None:
+                    self._tokens = self.burst
+                    self._last = now
+                    return
+                self._tokens = min(self.burst, self._tokens + (now - self._last) * rate)
+                self._last = now
+                # Take the tokens now and wait until the bucket is out of debt again
+                self._tokens -= take
+                wait = -self._tokens / rate
+            amount -= take
+            if wait > 0:
+                self.sleep(wait)
+
+
+class AdaptiveRateLimiter(TokenBucket):
+    """Token bucket whose rate backs off while the recorder is under pressure.
+
+    The rate follows additive-increase/multiplicative-decrease between min_rate
+    and max_rate, driven by a load probe that reports the recorder's write queue
+    depth and sampling lag. While the recorder is idle uploads run unlimited.
+    """
+
+    def __init__(self, max_rate, load_probe, min_rate=16 * 1024, max_queue_depth=50,
+                 max_lag=0.005, interval=0.5, burst=None, clock=time.monotonic, sleep=time.sleep):
+        """Initialize the limiter.
+
+        Args:
+            max_rate: Highest rate in bytes/s allowed while recording
+            load_probe: Callable returning (queue_depth, lag_seconds), or None when
+                        the recorder is idle
+            min_rate: Lowest rate in bytes/s the limiter backs off to
+            max_queue_depth: Queue depth above which the rate is halved
+            max_lag: Sampling lag in seconds above which the rate is halved
+            interval: Seconds between rate adjustments
+            burst: Largest amount that may be sent at once, in bytes
+            clock: See TokenBucket
+            sleep: See TokenBucket
+        """
+        super().__init__(max_rate, burst or max(int(min_rate / 4), 4 * 1024), clock, sleep)
+        self.max_rate = max_rate
+        self.min_rate = min_rate
+        self.load_probe = load_probe
+        self.max_queue_depth = max_queue_depth
+        self.max_lag = max_lag
+        self.interval = interval
+        self._idle = True
+        self._last_adjust = 0.0
+
+    def current_rate(self):
+        now = self.clock()
+        if now - self._last_adjust >= self.interval:
+            self._last_adjust = now
+            self._adjust()
+        return None if self._idle else self.rate
+
+    def _adjust(self):
+        try:
+            load = self.load_probe()
+        except Exception as e:
+            print(f'Error reading recorder load: {e}')
+            load = (0, 0.0)
+        if load is None:
+            self._idle = True
+            return
+        if self._idle:
+            # Recording just started: begin at the floor and ramp up
+            self._idle = False
+            self.rate = self.min_rate
+        queue_depth, lag = load
+        if queue_depth > self.max_queue_depth or lag > self.max_lag:
+            self.rate = max(self.min_rate, self.rate / 2)
+        else:
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 10)
+
+
+class _ThrottledFile:
+    """File wrapper whose reads are paced by a rate limiter, one small slice at a time."""
+
+    def __init__(self, fileobj, limiter):
+        self._file = fileobj
+        self._limiter = limiter
+
+    def read(self, size=-1):
+        parts = []
+        while size is None or size < 0 or size > 0:
+            step = THROTTLE_SLICE if size is None or size < 0 else min(THROTTLE_SLICE, size)
+            self._limiter.consume(step)
+            data = self._file.read(step)
+            if not data:
+                break
+            parts.append(data)
+            if size is not None and size > 0:
+                size -= len(data)
+        return b''.join(parts)
+
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
 
 class GoogleDriveUploader:
     """Class for uploading files to Google Drive using service account."""
     
+    _static_discovery_document = None  # Parsed once per process, shared by all instances
+    
     def __init__(self, service_account_file='heroic-idea-430007-m2-ea9afcaa98f9.json', 
-                 folder_id='1Ty2lTwjSDpZOyte5wE05lx5BGpOk1fY9'):
+                 folder_id='1Ty2lTwjSDpZOyte5wE05lx5BGpOk1fY9', credentials=None,
+                 discovery_url=None, chunk_size=DEFAULT_CHUNK_SIZE, resumable=True,
+                 num_retries=0, token_cache_file=TOKEN_CACHE_FILE, refresh_margin=300,
+                 rate_limiter=None, compression=None, compression_level=None, retry_delay=None):
         """Initialize the uploader with service account credentials.
         
         Args:
             service_account_file: Path to the service account JSON file
             folder_id: Default Google Drive folder ID to upload files to
+            credentials: Ready-made credentials to use instead of the service account
+                         file (e.g. AnonymousCredentials for a local stand-in server)
+            discovery_url: Discovery service URL template; points the client at
+                           another Drive v3 endpoint such as drive_stub_server
+            chunk_size: Bytes sent per request in resumable uploads (-1 = whole file).
+                        With a rate limiter at most THROTTLED_CHUNK_SIZE is used
+            resumable: Use the resumable protocol instead of a single multipart request
+            num_retries: Retries with exponential backoff for failed requests
+            token_cache_file: File the service account access token and its expiry
+                              are persisted to (None disables the cache)
+            refresh_margin: Seconds before expiry at which the token is refreshed
+                            in the background
+            rate_limiter: TokenBucket pacing how fast file data is read and sent
+                          (see THROTTLE_SLICE)
+            compression: Codec from upload_compression.CODECS applied before upload
+                         (None uploads files as they are)
+            compression_level: Level for the codec (codec default if None)
+            retry_delay: Callable returning the seconds to wait before retry number
+                         `failures` of a resumable upload (default: random
+                         exponential backoff)
         """
         self.service_account_file = service_account_file
         self.folder_id = folder_id
         self.scopes = ['https://www.googleapis.com/auth/drive.file']
+        self.credentials = credentials
+        self.discovery_url = discovery_url
+        self.chunk_size = chunk_size
+        self.resumable = resumable
+        self.num_retries = num_retries
+        self.token_cache_file = token_cache_file
+        self.refresh_margin = refresh_margin
+        self.rate_limiter = rate_limiter
+        self.compression = compression
+        self.compression_level = compression_level
+        self.retry_delay = retry_delay or _backoff_delay
         self.service = None
+        self._service_credentials = None  # Kept across service rebuilds
+        self._saved_token = None
+        self._refresh_timer = None
         
         # Initialize the service
         self._initialize_service()
@@ -25,22 +228,105 @@ class GoogleDriveUploader:
     def _initialize_service(self):
         """Create and initialize the Google Drive service."""
         try:
-            credentials = service_account.Credentials.from_service_account_file(
-                self.service_account_file, scopes=self.scopes)
-            self.service = build('drive', 'v3', credentials=credentials)
+            credentials = self.credentials or self._get_service_credentials()
+            if self.discovery_url:
+                self.service = build('drive', 'v3', credentials=credentials,
+                                     discoveryServiceUrl=self.discovery_url,
+                                     static_discovery=False, cache_discovery=False)
+            else:
+                # Build from the discovery document bundled with the client library
+                # instead of fetching it, and parse it only once per process
+                if GoogleDriveUploader._static_discovery_document is None:
+                    GoogleDriveUploader._static_discovery_document = json.loads(
+                        discovery_cache.get_static_doc('drive', 'v3'))
+                self.service = build_from_document(
+                    GoogleDriveUploader._static_discovery_document, credentials=credentials)
             return True
         except Exception as e:
             print(f'Error initializing Drive service: {e}')
             self.service = None
             return False
     
-    def upload_file(self, file_path, folder_id=None):
+    def _get_service_credentials(self):
+        """Load the service account once, seeded with the cached access token."""
+        if self._service_credentials is None:
+            credentials = service_account.Credentials.from_service_account_file(
+                self.service_account_file, scopes=self.scopes)
+            self._load_cached_token(credentials)
+            self._service_credentials = credentials
+            self._schedule_refresh()
+        return self._service_credentials
+
+    def _load_cached_token(self, credentials):
+        if not self.token_cache_file:
+            return
+        try:
+            with open(self.token_cache_file) as f:
+                cache = json.load(f)
+            if (cache.get('account') != credentials.service_account_email
+                    or cache.get('scopes') != self.scopes):
+                return
+            # google-auth keeps expiry as a naive UTC datetime
+            expiry = datetime.datetime.fromtimestamp(
+                cache['expiry'], datetime.timezone.utc).replace(tzinfo=None)
+        except (OSError, ValueError, KeyError, TypeError):
+            return
+        if expiry > _utcnow():
+            credentials.token = cache['token']
+            credentials.expiry = expiry
+            self._saved_token = cache['token']
+
+    def _save_token(self):
+        """Persist the current access token in a file readable only by this user."""
+        credentials = self._service_credentials
+        if (not self.token_cache_file or credentials is None or not credentials.token
+                or credentials.expiry is None or credentials.token == self._saved_token):
+            return
+        cache = {
+            'account': credentials.service_account_email,
+            'scopes': self.scopes,
+            'token': credentials.token,
+            'expiry': credentials.expiry.replace(tzinfo=datetime.timezone.utc).timestamp(),
+        }
+        try:
+            os.makedirs(os.path.dirname(self.token_cache_file), mode=0o700, exist_ok=True)
+            temp_file = self.token_cache_file + '.tmp'
+            fd = os.open(temp_file, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(cache, f)
+            os.replace(temp_file, self.token_cache_file)
+            self._saved_token = credentials.token
+        except OSError as e:
+            print(f'Could not write token cache: {e}')
+
+    def _schedule_refresh(self, delay=None):
+        """Refresh the access token in the background shortly before it expires."""
+        if delay is None:
+            expiry = self._service_credentials.expiry
+            if self._service_credentials.token and expiry:
+                delay = (expiry - _utcnow()).total_seconds() - self.refresh_margin
+            delay = max(0, delay or 0)
+        self._refresh_timer = threading.Timer(delay, self._refresh_token)
+        self._refresh_timer.daemon = True
+        self._refresh_timer.start()
+
+    def _refresh_token(self):
+        try:
+            self._service_credentials.refresh(Request())
+            self._save_token()
+            self._schedule_refresh()
+        except Exception as e:
+            print(f'Error refreshing Drive access token: {e}')
+            self._schedule_refresh(60)
+
+    def upload_file(self, file_path, folder_id=None, properties=None):
         """Upload a file to Google Drive.
         
         Args:
             file_path: Path to the local file to upload
             folder_id: ID of the Google Drive folder to upload to (optional)
                       If not provided, uses the default folder_id from initialization
+            properties: Extra Drive properties for the file, e.g. recording tags (optional)
         
         Returns:
             File ID if successful, None if failed
@@ -55,24 +341,55 @@ class GoogleDriveUploader:
                 return None
 
         target_folder = folder_id or self.folder_id
+        throttled_file = None
+        compressed_path = None
 
         try:
             file_metadata = {
                 'name': os.path.basename(file_path),
                 'parents': [target_folder] if target_folder else None
             }
+            if properties:
+                file_metadata['properties'] = dict(properties)
 
             # Determine MIME type based on file extension
             mime_type = 'text/csv' if file_path.endswith('.csv') else 'application/octet-stream'
-            media = MediaFileUpload(file_path, mimetype=mime_type, resumable=True)
+            upload_path = file_path
+            if self.compression:
+                # Upload a compressed copy; Drive properties keep the original's size and hash
+                compressed_path, upload_name, mime_type, properties = compress_file(
+                    file_path, self.compression, self.compression_level)
+                file_metadata['name'] = upload_name
+                file_metadata['properties'] = {**file_metadata.get('properties', {}), **properties}
+                upload_path = compressed_path
+                print(f"Compressed {file_path}: {properties['original_size']} -> "
+                      f"{os.path.getsize(compressed_path)} bytes")
+
+            if self.rate_limiter:
+                # Pace the reads so uploads don't starve the recorder of disk and CPU
+                throttled_file = _ThrottledFile(open(upload_path, 'rb'), self.rate_limiter)
+                chunk_size = THROTTLED_CHUNK_SIZE
+                if 0 < self.chunk_size < THROTTLED_CHUNK_SIZE:
+                    chunk_size = self.chunk_size
+                media = MediaIoBaseUpload(throttled_file, mimetype=mime_type,
+                                          chunksize=chunk_size, resumable=self.resumable)
+            else:
+                media = MediaFileUpload(upload_path, mimetype=mime_type,
+                                        chunksize=self.chunk_size, resumable=self.resumable)
 
-            file = self.service.files().create(
+            request = self.service.files().create(
                 body=file_metadata,
                 media_body=media,
                 fields='id'
-            ).execute()
+            )
+            if self.resumable:
+                file = self._execute_resumable(request)
+            else:
+                file = request.execute(num_retries=self.num_retries)
 
             file_id = file.get('id')
+            # The client refreshes expired tokens on its own; keep the cache current
+            self._save_token()
             print(f'Successfully uploaded {file_path}')
             print(f'File ID: {file_id}')
             return file_id
@@ -80,6 +397,130 @@ class GoogleDriveUploader:
         except Exception as e:
             print(f'Error uploading file: {e}')
             return None
+        finally:
+            if throttled_file:
+                throttled_file.close()
+            if compressed_path and os.path.exists(compressed_path):
+                os.remove(compressed_path)
+
+    def _execute_resumable(self, request):
+        """Run a resumable upload chunk by chunk, resuming after failed chunks.
+
+        googleapiclient's own chunk retry re-sends an already consumed file slice,
+        so failures are retried here instead: the next call asks the server how
+        much it received and continues from there with a fresh slice.
+        """
+        response = None
+        failures = 0
+        while response is None:
+            try:
+                _, response = request.next_chunk()
+                failures = 0
+            except (HttpError, httplib2.HttpLib2Error, OSError) as e:
+                status = getattr(getattr(e, 'resp', None), 'status', None)
+                retryable = status is None or status >= 500 or status == 429
+                if not retryable or failures >= self.num_retries:
+                    raise
+                failures += 1
+                print(f'Upload interrupted ({e}), retry {failures} of {self.num_retries}')
+                time.sleep(self.retry_delay(failures))
+        return response
+
+
+class BackgroundUploader:
+    """Uploads queued files on a low-priority background thread.
+
+    Used for live sync: finished recording segments are handed over while the
+    recorder keeps running, so only the last segment is left at the end.
+    """
+
+    def __init__(self, uploader, niceness=10):
+        """Initialize the background uploader.
+
+        Args:
+            uploader: GoogleDriveUploader used for the actual transfers
+            niceness: Nice value applied to the upload thread. On Linux the
+                      best-effort I/O priority follows the nice value, so the
+                      upload also yields disk access to the recording writer
+        """
+        self.uploader = uploader
+        self.niceness = niceness
+        self.uploaded = {}  # file path -> Drive file ID
+        self.failed = []  # file paths that could not be uploaded
+        self._properties = {}  # file path -> Drive properties to upload it with
+        self._queue = queue.Queue()
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def enqueue(self, file_path, properties=None):
+        """Queue a file for upload, starting the worker thread if needed.
+
+        Args:
+            file_path: Path of the file to upload
+            properties: Extra Drive properties for the file (optional)
+        """
+        if properties:
+            self._properties[file_path] = properties
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name="drive-upload")
+                self._thread.daemon = True
+                self._thread.start()
+        print(f'Queued {file_path} for background upload')
+        self._queue.put(file_path)
+
+    def pending(self):
+        """Number of queued files not uploaded yet (including the one in progress)."""
+        return self._queue.unfinished_tasks
+
+    def wait(self, timeout=None):
+        """Wait until the queue is empty.
+
+        Returns:
+            True if all queued files were processed, False on timeout
+        """
+        with self._queue.all_tasks_done:
+            if timeout is None:
+                while self._queue.unfinished_tasks:
+                    self._queue.all_tasks_done.wait()
+                return True
+            return self._queue.all_tasks_done.wait_for(
+                lambda: not self._queue.unfinished_tasks, timeout)
+
+    def retry_failed(self):
+        """Re-queue all files whose upload failed."""
+        failed, self.failed = self.failed, []
+        for file_path in failed:
+            self.enqueue(file_path, self._properties.get(file_path))
+
+    def reset(self):
+        """Forget the results of the previous recording."""
+        self.uploaded = {}
+        self.failed = []
+        self._properties = {}
+
+    def _lower_priority(self):
+        try:
+            # Linux applies nice values per thread when given the thread's native ID
+            os.setpriority(os.PRIO_PROCESS, threading.get_native_id(), self.niceness)
+        except (AttributeError, OSError) as e:
+            print(f'Could not lower upload thread priority: {e}')
+
+    def _run(self):
+        self._lower_priority()
+        while True:
+            file_path = self._queue.get()
+            try:
+                file_id = self.uploader.upload_file(file_path, properties=self._properties.get(file_path))
+                if file_id:
+                    self.uploaded[file_path] = file_id
+                else:
+                    self.failed.append(file_path)
+            except Exception as e:
+                print(f'Error in background upload of {file_path}: {e}')
+                self.failed.append(file_path)
+            finally:
+                self._queue.task_done()
 
 
 def test_uploader():
@@ -0,0 +1,90 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of archive conversion: chunked resampling and the up-to-date manifest."""
+
+import json
+import os
+
+import numpy as np
+import pytest
+
+import recording_reader
+from batch_convert import MANIFEST_NAME, convert_archive, convert_file
+from channel_columns import DEFAULT_CHANNELS, csv_header
+from csv_emitter import CsvEmitter
+
+ROWS = 101
+
+
+def write_recording(path, rows=ROWS, seed=0):
+    """CSV recording at about 100 Hz with jittered timestamps."""
+    rng = np.random.default_rng(seed)
+    timestamps = 1700000000 + np.cumsum(rng.uniform(0.007, 0.013, rows))
+    values = np.column_stack([np.arange(rows), np.round(rng.normal(0, 100, (rows, 9))) / 100,
+                              timestamps])
+    emitter = CsvEmitter(csv_header(DEFAULT_CHANNELS))
+    with open(path, 'w', newline='') as f:
+        f.write(emitter.header_line())
+        f.write(emitter.format(values))
+    return str(path)
+
+
+def options(**changes):
+    return {'format': 'binary', 'offset': {}, 'scale': {}, 'resample': None, 'derive': None,
+            **changes}
+
+
+@pytest.mark.parametrize('output_format', ['binary', 'csv'])
+# The last record is 0.73 and 0.12 grid steps past a grid point at 40 Hz
+@pytest.mark.parametrize('rows', [100, 101])
+def test_resampling_does_not_depend_on_the_chunk_size(tmp_path, output_format, rows):
+    source = write_recording(tmp_path / 'r.csv', rows)
+    outputs = []
+    for chunk_records in (1, 7, rows):
+        output = str(tmp_path / f'out_{chunk_records}.{output_format}')
+        result = convert_file(source, output, options(format=output_format, resample=40.0),
+                              chunk_records=chunk_records)
+        assert 'error' not in result
+        with open(output, 'rb') as f:
+            outputs.append(f.read())
+    assert outputs[0] == outputs[1] == outputs[2]
+
+    if output_format == 'binary':
+        converted = recording_reader.load(str(tmp_path / f'out_{rows}.binary'))
+        expected = recording_reader.resample(recording_reader.load(source), 40.0)
+        assert result['records'] == len(expected) == len(converted)
+        for field in expected.dtype.names:
+            assert np.array_equal(converted[field], expected[field]), field
+
+
+def test_manifest_skips_up_to_date_inputs(tmp_path):
+    source = tmp_path / 'sensor_data'
+    source.mkdir()
+    first = write_recording(source / 'a.csv', seed=1)
+    second = write_recording(source / 'b.csv', seed=2)
+    output = str(tmp_path / 'converted')
+
+    def run(use_hash=False, **changes):
+        summary = convert_archive([str(source)], output, options(**changes), workers=1,
+                                  use_hash=use_hash)
+        assert not summary['failed']
+        return ([os.path.basename(result['path']) for result in summary['converted']],
+                [os.path.basename(path) for path in summary['skipped']])
+
+    assert sorted(run(use_hash=True)[0]) == ['a.csv', 'b.csv']
+    assert run() == ([], ['a.csv', 'b.csv'])
+
+    # Copied back with a new mtime but the same content: only --hash sees it is unchanged
+    stat = os.stat(first)
+    os.utime(first, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+    assert run(use_hash=True) == ([], ['a.csv', 'b.csv'])
+    with open(os.path.join(output, MANIFEST_NAME)) as f:
+        assert json.load(f)['a.bin']['mtime_ns'] == stat.st_mtime_ns + 10 ** 9
+    assert run() == ([], ['a.csv', 'b.csv'])  # The refreshed mtime is kept
+
+    write_recording(second, rows=ROWS + 1, seed=2)
+    assert run(use_hash=True) == (['b.csv'], ['a.csv'])
+    os.remove(os.path.join(output, 'a.bin'))
+    assert run() == (['a.csv'], ['b.csv'])
+    assert sorted(run(resample=50.0)[0]) == ['a.csv', 'b.csv']  # Other options
@@ -0,0 +1,110 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of block recordings: writing, damage after a crash and recovery."""
+
+import os
+import struct
+
+import numpy as np
+import pytest
+
+import block_recording
+import recording_reader
+from block_recording import BLOCK_SIZE, BlockRecordingWriter, read_header, recover
+from channel_columns import DEFAULT_CHANNELS, csv_header
+
+HEADER = csv_header(DEFAULT_CHANNELS)
+ROWS = 300  # Three full blocks of 85 records and one of 45
+
+
+def make_rows(count):
+    # Multiples of 1/16 are exact in float32, so rows compare exactly after a round trip
+    return [[packet, *(packet / 16 + axis for axis in range(9)), 1000 + packet / 100]
+            for packet in range(count)]
+
+
+@pytest.fixture
+def recording(tmp_path):
+    writer = BlockRecordingWriter(str(tmp_path / 'r.csv'), HEADER, flush_interval=60)
+    writer.start()
+    for row in make_rows(ROWS):
+        writer.write(row)
+    writer.close()
+    return writer.segments[0]
+
+
+def committed_rows(path):
+    records = np.concatenate(list(recording_reader.iter_records(path)))
+    expected = np.array(make_rows(len(records)))
+    assert np.array_equal(records['packet'], expected[:, 0])
+    assert np.array_equal(records['timestamp'], expected[:, -1])
+    assert np.array_equal(np.hstack([records['gyro'], records['accel'], records['mag']]),
+                          expected[:, 1:-1])
+    return len(records)
+
+
+def set_marker(path, blocks, closed):
+    with open(path, 'r+b') as f:
+        f.seek(block_recording.COMMIT_OFFSET)
+        f.write(block_recording._commit_marker(blocks, closed))
+
+
+def test_closed_recording_needs_no_recovery(recording):
+    header = read_header(recording)
+    assert header['records_per_block'] == 85
+    assert (header['committed'], header['closed']) == (4, True)
+    assert os.path.getsize(recording) == 5 * BLOCK_SIZE
+    assert recover(recording) == {'blocks': 4, 'checked': 0, 'truncated': 0}
+    assert committed_rows(recording) == ROWS
+
+
+def test_recover_drops_a_torn_block(recording):
+    # The end of the last block was lost although the marker already covers it
+    set_marker(recording, 4, False)
+    os.truncate(recording, 4 * BLOCK_SIZE + 1000)
+    assert recover(recording) == {'blocks': 3, 'checked': 0, 'truncated': 1000}
+    assert os.path.getsize(recording) == 4 * BLOCK_SIZE
+    assert (read_header(recording)['committed'], read_header(recording)['closed']) == (3, True)
+    assert committed_rows(recording) == 3 * 85
+
+
+def test_recover_stops_at_a_bad_crc_after_a_stale_marker(recording):
+    # Only one block committed, and the third block's records were damaged
+    set_marker(recording, 1, False)
+    with open(recording, 'r+b') as f:
+        f.seek(3 * BLOCK_SIZE + 100)
+        f.write(b'\xff')
+    assert committed_rows(recording) == 2 * 85  # Reading stops at the bad block too
+    assert recover(recording) == {'blocks': 2, 'checked': 2, 'truncated': 2 * BLOCK_SIZE}
+    assert read_header(recording)['committed'] == 2
+    assert committed_rows(recording) == 2 * 85
+
+
+def test_recover_checks_every_block_after_a_damaged_marker(recording):
+    with open(recording, 'r+b') as f:
+        f.seek(block_recording.COMMIT_OFFSET)
+        f.write(b'\0')
+    assert read_header(recording)['committed'] is None
+    assert recover(recording) == {'blocks': 4, 'checked': 4, 'truncated': 0}
+    assert (read_header(recording)['committed'], read_header(recording)['closed']) == (4, True)
+    assert committed_rows(recording) == ROWS
+
+
+def test_read_header_rejects_other_files(tmp_path):
+    path = tmp_path / 'other.rec'
+    path.write_bytes(b'BNOREC1\0' + bytes(BLOCK_SIZE))
+    with pytest.raises(ValueError, match='not a block recording'):
+        read_header(str(path))
+
+
+def test_read_header_rejects_a_layout_not_matching_the_columns(recording):
+    with open(recording, 'r+b') as f:
+        data = bytearray(f.read(BLOCK_SIZE))
+        # Record size of a recording with one column less
+        record_size = block_recording.record_dtype(HEADER[:1] + HEADER[2:]).itemsize
+        struct.pack_into('<I', data, 12, record_size)
+        f.seek(0)
+        f.write(data)
+    with pytest.raises(ValueError, match='does not match its columns'):
+        read_header(recording)
@@ -0,0 +1,122 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the HTTP control API with a fake sampling loop (no sensor needed)."""
+
+import http.client
+import json
+import time
+
+import pytest
+
+from control_api import ControlServer
+from recording_control import RecordingController
+from sample_snapshot import SampleSnapshot
+
+TOKEN = 'secret'
+
+
+class FakeUploadQueue:
+    def __init__(self):
+        self.enqueued = []
+        self.failed = []
+
+    def enqueue(self, file_path, properties=None):
+        self.enqueued.append((file_path, properties))
+
+    def pending(self):
+        return len(self.enqueued)
+
+
+@pytest.fixture
+def global_vars():
+    return {'sample': SampleSnapshot(), 'running': False, 'collecting_data': False,
+            'csv_filename': None, 'frequency': 100, 'upload_queue': FakeUploadQueue()}
+
+
+def make_server(global_vars, tmp_path, token=None):
+    def collect_data():
+        # Stands in for the recorder's sampling loop: one segment, closed on stop
+        global_vars['segment_files'] = [global_vars['csv_filename']]
+        while global_vars['running']:
+            time.sleep(0.01)
+
+    controller = RecordingController(collect_data, global_vars, csv_dir=f'{tmp_path}/')
+    server = ControlServer(controller, ('127.0.0.1', 0), token)
+    server.start()
+    return server
+
+
+@pytest.fixture
+def server(global_vars, tmp_path):
+    server = make_server(global_vars, tmp_path)
+    yield server
+    server.stop()
+
+
+@pytest.fixture
+def token_server(global_vars, tmp_path):
+    server = make_server(global_vars, tmp_path, TOKEN)
+    yield server
+    server.stop()
+
+
+def request(server, method, path, body=None, token=None):
+    connection = http.client.HTTPConnection(*server.address, timeout=5)
+    headers = {'X-Api-Token': token} if token is not None else {}
+    try:
+        connection.request(method, path, body=None if body is None else json.dumps(body),
+                           headers=headers)
+        response = connection.getresponse()
+        return response.status, json.loads(response.read())
+    finally:
+        connection.close()
+
+
+def test_start_stop_and_upload(server, global_vars, tmp_path):
+    status, reply = request(server, 'GET', '/status')
+    assert (status, reply['ok'], reply['status']['state']) == (200, True, 'ready')
+
+    status, reply = request(server, 'POST', '/start', {'filename': 'run1', 'tags': {'site': 'A'}})
+    assert (status, reply['message']) == (200, 'Recording started')
+    assert reply['status']['state'] == 'recording'
+    assert reply['status']['csv_filename'] == f'{tmp_path}/run1.csv'
+    assert reply['status']['tags'] == {'site': 'A'}
+
+    status, reply = request(server, 'POST', '/stop')
+    assert (status, reply['status']['state']) == (200, 'stopped')
+
+    status, reply = request(server, 'POST', '/upload')
+    assert (status, reply['ok'], reply['status']['state']) == (200, True, 'ready')
+    assert global_vars['upload_queue'].enqueued == [(f'{tmp_path}/run1.csv', {'site': 'A'})]
+
+
+def test_requests_out_of_state_answer_409(server):
+    status, reply = request(server, 'POST', '/stop')
+    assert (status, reply['ok']) == (409, False)
+    assert reply['message'] == 'Cannot stop while ready'
+    assert request(server, 'POST', '/upload')[0] == 409
+    assert request(server, 'POST', '/start')[0] == 200
+    status, reply = request(server, 'POST', '/start')
+    assert (status, reply['message']) == (409, 'Cannot start while recording')
+    assert request(server, 'POST', '/stop')[0] == 200
+
+
+def test_bad_requests_answer_400_and_404(server):
+    status, reply = request(server, 'POST', '/start', {'filename': '../etc/passwd'})
+    assert (status, reply['status']['state']) == (400, 'ready')
+    assert request(server, 'POST', '/start', ['run1'])[0] == 400
+    assert request(server, 'GET', '/nothing')[0] == 404
+
+
+@pytest.mark.parametrize('token', [None, '', 'wrong', 'sécret'])
+def test_wrong_tokens_are_refused(token_server, token):
+    status, reply = request(token_server, 'POST', '/start', {'filename': 'run1'}, token=token)
+    assert (status, reply['ok']) == (401, False)
+    assert 'status' not in reply
+    assert token_server.controller.state == 'ready'
+
+
+def test_right_token_is_accepted(token_server):
+    status, reply = request(token_server, 'GET', '/status', token=TOKEN)
+    assert (status, reply['status']['state']) == (200, 'ready')
@@ -0,0 +1,107 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the block CSV formatter against plain per-value formatting and the reader."""
+
+import math
+
+import numpy as np
+import pytest
+
+import csv_emitter
+import recording_reader
+from channel_columns import CHANNEL_RESOLUTION, DEFAULT_CHANNELS, csv_header
+from csv_emitter import CsvEmitter
+
+HEADER = csv_header(DEFAULT_CHANNELS)
+GYRO = CHANNEL_RESOLUTION['gyro']
+
+
+def plain(emitter, rows):
+    """What csv.writer would write with the emitter's formats (None and NaN empty)."""
+    return ''.join(','.join('' if value is None or value != value else column_format % value
+                            for column_format, value in zip(emitter.formats, row)) + '\r\n'
+                   for row in rows)
+
+
+def as_array(rows):
+    return np.array([[np.nan if value is None else value for value in row] for row in rows])
+
+
+def round_trip(emitter, rows, tmp_path):
+    path = tmp_path / 'r.csv'
+    path.write_text(emitter.header_line() + emitter.format(rows), newline='')
+    return np.concatenate(list(recording_reader.iter_csv(str(path), chunk_rows=7)))
+
+
+def step_rows(count, missing_every=None):
+    rows = []
+    for packet in range(count):
+        accel = [None] * 3 if missing_every and packet % missing_every == 0 else \
+            [packet / 100, (packet % 3 - 1) * 0.01, 9.81]
+        rows.append([packet, (packet - 50) * GYRO, 3 * GYRO, -8000 * GYRO, *accel,
+                     packet / 16, -512.0, 0.0625, 1700000000 + packet / 100])
+    return rows
+
+
+def test_list_and_array_rows_match_plain_formatting(tmp_path):
+    rows = step_rows(200, missing_every=3)
+    emitter = CsvEmitter(HEADER)
+    assert emitter.format(rows) == plain(emitter, rows)
+    assert emitter.format(as_array(rows)) == plain(emitter, rows)
+    assert all(table is not None for _, table in emitter._tables.values())  # Tables used
+
+    records = round_trip(emitter, rows, tmp_path)
+    expected = as_array(rows)
+    assert records['packet'].tolist() == list(range(200))
+    assert np.allclose(records['gyro'], expected[:, 1:4], rtol=0, atol=0.5e-5)
+    assert np.allclose(records['accel'], expected[:, 4:7], rtol=0, atol=0.5e-2, equal_nan=True)
+    assert np.isnan(records['accel'][::3]).all()
+    assert np.array_equal(records['timestamp'], expected[:, -1])
+
+
+@pytest.mark.parametrize('value', [0.123456789, 1e-7, 100.0, -1e6])
+def test_values_off_the_grid_or_outside_the_table_are_formatted_directly(value):
+    rows = step_rows(20)
+    rows[7][5] = value  # Accelerometer Y
+    rows[11][2] = value  # Gyroscope Y
+    emitter = CsvEmitter(HEADER)
+    assert emitter.format(as_array(rows)) == plain(emitter, rows)
+    assert emitter.format(rows) == plain(emitter, rows)
+
+
+def test_mixed_runs_of_missing_values():
+    rows = step_rows(12)
+    for packet, row in enumerate(rows):
+        if packet in (0, 1, 5, 11):
+            row[1:4] = [None] * 3
+        if packet in (1, 2, 3, 11):
+            row[7:10] = [None] * 3
+    rows[6][4] = math.nan  # NaN stays an empty cell in list rows too
+    emitter = CsvEmitter(HEADER)
+    expected = plain(emitter, rows)
+    assert ',,,' in expected and '\r\n,' not in expected
+    assert emitter.format(rows) == expected
+    assert emitter.format(as_array(rows)) == expected
+    assert emitter.format([]) == emitter.format(np.zeros((0, len(HEADER)))) == ''
+
+
+def test_fixed_timestamps_match_printf_formatting():
+    timestamps = [0.0, 2.5e-7, 0.9999995, 0.99999949999, 1.0000005, 1000.07,
+                  1700000000.9999996, 1700788428.7034285, 1700724789.9407735]
+    rng = np.random.default_rng(0)
+    timestamps += (1.7e9 + rng.uniform(0, 1e6, 5000)).tolist()
+    timestamps += (np.round(rng.uniform(0, 5000, 5000), 6) + 5e-7).tolist()
+    emitter = CsvEmitter(HEADER)
+    values = np.zeros((len(timestamps), len(HEADER)))
+    values[:, -1] = timestamps
+    lines = emitter.format(values).splitlines()
+    assert [line.rsplit(',', 1)[1] for line in lines] == ['%.6f' % t for t in timestamps]
+
+
+def test_step_tables_are_shared_and_exact():
+    table = csv_emitter._step_table(GYRO, '%.5f')
+    assert csv_emitter._step_table(GYRO, '%.5f') is table
+    steps = range(-csv_emitter.TABLE_STEPS, csv_emitter.TABLE_STEPS + 1, 997)
+    assert [table[step + csv_emitter.TABLE_STEPS] for step in steps] == \
+        ['%.5f' % (step * GYRO) for step in steps]
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the i2c-dev transport against a fake adapter (no hardware needed)."""
+
+import struct
+
+import pytest
+
+import adafruit_bno055
+
+FAKE_FD = 99
+ADDRESS = 0x28
+
+
+class FakeAdapter:
+    """Serves I2C_RDWR ioctls from a 256-byte register map, like the BNO055.
+
+    A write sets the register pointer to its first byte and stores the rest;
+    a read returns registers from the pointer on. Every transfer is logged as
+    a list of (addr, flags, len, data) per message.
+    """
+
+    def __init__(self):
+        self.registers = bytearray(256)
+        self.pointer = 0
+        self.transfers = []
+
+    def ioctl(self, fd, request, data):
+        assert fd == FAKE_FD
+        assert request == adafruit_bno055._I2C_RDWR
+        messages = []
+        for index in range(data.nmsgs):
+            msg = data.msgs[index]
+            if msg.flags & adafruit_bno055._I2C_M_RD:
+                payload = bytes(self.registers[self.pointer:self.pointer + msg.len])
+                for offset, value in enumerate(payload):
+                    msg.buf[offset] = value
+                self.pointer += msg.len
+            else:
+                payload = bytes(msg.buf[offset] for offset in range(msg.len))
+                self.pointer = payload[0]
+                self.registers[self.pointer:self.pointer + len(payload) - 1] = payload[1:]
+            messages.append((msg.addr, msg.flags, msg.len, payload))
+        self.transfers.append(messages)
+        return 0
+
+
+@pytest.fixture
+def adapter():
+    return FakeAdapter()
+
+
+@pytest.fixture
+def device(adapter):
+    return adafruit_bno055.I2CDevDevice(address=ADDRESS, fd=FAKE_FD, ioctl=adapter.ioctl,
+                                        max_length=32)
+
+
+def test_read_registers_is_one_combined_transfer(adapter, device):
+    adapter.registers[0x14:0x1A] = bytes(range(1, 7))
+    assert device.read_registers(0x14, 6) == bytes(range(1, 7))
+    assert adapter.transfers == [[
+        (ADDRESS, 0, 1, b'\x14'),
+        (ADDRESS, adafruit_bno055._I2C_M_RD, 6, bytes(range(1, 7))),
+    ]]
+
+
+def test_write_then_readinto_uses_slices(adapter, device):
+    adapter.registers[0x00:0x04] = b'\xa0\xfb\x32\x0f'
+    out_buffer = b'\xff\x01\xff'
+    in_buffer = bytearray(6)
+    device.write_then_readinto(out_buffer, in_buffer, out_start=1, out_end=2, in_start=2, in_end=5)
+    assert in_buffer == bytearray(b'\x00\x00\xfb\x32\x0f\x00')
+    assert adapter.transfers == [[
+        (ADDRESS, 0, 1, b'\x01'),
+        (ADDRESS, adafruit_bno055._I2C_M_RD, 3, b'\xfb\x32\x0f'),
+    ]]
+
+
+def test_write_and_readinto_are_single_messages(adapter, device):
+    device.write(b'\x3d\x0c')
+    assert adapter.registers[0x3D] == 0x0C
+    device.write(b'\x3d')
+    buffer = bytearray(2)
+    device.readinto(buffer, end=1)
+    assert buffer == bytearray(b'\x0c\x00')
+    assert adapter.transfers == [
+        [(ADDRESS, 0, 2, b'\x3d\x0c')],
+        [(ADDRESS, 0, 1, b'\x3d')],
+        [(ADDRESS, adafruit_bno055._I2C_M_RD, 1, b'\x0c')],
+    ]
+
+
+def test_max_length_is_enforced(adapter, device):
+    with pytest.raises(ValueError):
+        device.read_registers(0x00, 33)
+    with pytest.raises(ValueError):
+        device.write(bytes(33))
+    with pytest.raises(ValueError):
+        device.write_then_readinto(b'\x00', bytearray(33))
+    assert device.read_registers(0x00, 32) == bytes(32)
+    assert len(adapter.transfers) == 1
+
+
+def test_driver_reads_channels_through_the_transport(adapter, monkeypatch):
+    monkeypatch.setattr(adafruit_bno055.time, 'sleep', lambda seconds: None)
+    adapter.registers[0x00] = 0xA0  # Chip ID
+    sensor = adafruit_bno055.BNO055_I2CDev(address=ADDRESS, fd=FAKE_FD, ioctl=adapter.ioctl)
+    adapter.registers[0x08:0x0E] = struct.pack('<hhh', 100, -200, 981)  # Accelerometer
+    adapter.transfers.clear()
+    assert sensor.acceleration == pytest.approx((1.0, -2.0, 9.81))
+    assert adapter.transfers == [[
+        (ADDRESS, 0, 1, b'\x08'),
+        (ADDRESS, adafruit_bno055._I2C_M_RD, 6, adapter.registers[0x08:0x0E]),
+    ]]
@@ -0,0 +1,111 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the running per-column statistics and the recording summaries."""
+
+import itertools
+import json
+import os
+import types
+
+import numpy as np
+import pytest
+
+import recording_reader
+import recording_writer
+from channel_columns import DEFAULT_CHANNELS, csv_header
+from online_stats import RunningStats, summary_path
+from recording_writer import RecordingWriter
+
+COLUMNS = ['a', 'b', 'c', 'empty']
+
+
+def reference(values):
+    """Summary of `values` computed over the whole array with NumPy's NaN reductions."""
+    result = {}
+    for index, name in enumerate(COLUMNS):
+        column = values[:, index]
+        count = int(np.count_nonzero(~np.isnan(column)))
+        if not count:
+            result[name] = None
+            continue
+        result[name] = {'count': count, 'mean': np.nanmean(column),
+                        'std': np.nanstd(column, ddof=1), 'min': np.nanmin(column),
+                        'max': np.nanmax(column), 'rms': np.sqrt(np.nanmean(column ** 2))}
+    return result
+
+
+def test_merged_uneven_batches_with_nan_match_numpy():
+    rng = np.random.default_rng(0)
+    values = np.column_stack([rng.normal(1e6, 0.01, 1000),  # Large offset, tiny spread
+                              rng.normal(0, 5, 1000),
+                              rng.uniform(-1, 1, 1000),
+                              np.full(1000, np.nan)])
+    values[rng.random(1000) < 0.2, 0] = np.nan
+    values[::3, 1] = np.nan
+    values[:500, 2] = np.nan  # Missing from the first batches entirely
+    total, direct = RunningStats(COLUMNS), RunningStats(COLUMNS)
+    bounds = [0, 1, 8, 8, 308, 999, 1000]  # Includes an empty batch and single rows
+    for start, stop in zip(bounds[:-1], bounds[1:]):
+        batch = RunningStats(COLUMNS)
+        batch.update(values[start:stop])
+        total.merge(batch)
+        direct.update(values[start:stop])
+
+    expected = reference(values)
+    for stats in (total, direct):
+        summary = stats.summary()
+        assert summary['empty'] == {'count': 0, 'mean': None, 'variance': None, 'std': None,
+                                    'min': None, 'max': None, 'rms': None}
+        for name in COLUMNS[:3]:
+            assert summary[name]['count'] == expected[name]['count']
+            for key in ('mean', 'std', 'min', 'max', 'rms'):
+                assert summary[name][key] == pytest.approx(expected[name][key], rel=1e-9), key
+
+
+def test_single_value_has_zero_variance():
+    stats = RunningStats(['a'])
+    stats.update([[2.5]])
+    assert stats.summary()['a'] == {'count': 1, 'mean': 2.5, 'variance': 0.0, 'std': 0.0,
+                                    'min': 2.5, 'max': 2.5, 'rms': 2.5}
+
+
+def test_segmented_recording_summaries(tmp_path, monkeypatch):
+    # Every clock reading advances a second: a new segment every few batches
+    clock = itertools.count()
+    monkeypatch.setattr(recording_writer, 'time',
+                        types.SimpleNamespace(monotonic=lambda: float(next(clock))))
+    header = csv_header(DEFAULT_CHANNELS)
+    writer = RecordingWriter(str(tmp_path / 'r.csv'), header, segment_seconds=3, batch_size=40,
+                             flush_interval=0, summary=True)
+    for packet in range(300):
+        gyro = [None] * 3 if packet % 4 == 0 else [0.01 * packet, -0.5, 0.0]
+        writer.write([packet, *gyro, 0.0, 0.0, 9.81, 1.0, 2.0, 3.0, 1700000000 + packet / 100])
+    writer.start()
+    writer.close()
+
+    assert len(writer.segments) > 2
+    rows = 0
+    for path in writer.segments:
+        with open(summary_path(path)) as f:
+            summary = json.load(f)
+        records = recording_reader.load(path)
+        assert summary['file'] == os.path.basename(path)
+        assert summary['rows'] == len(records)
+        assert (summary['first_packet'], summary['last_packet']) == \
+            (records['packet'][0], records['packet'][-1])
+        assert summary['start'] == pytest.approx(records['timestamp'][0])
+        gyro_x = summary['columns']['Gyroscope X (deg/s)']
+        assert gyro_x['count'] == np.count_nonzero(~np.isnan(records['gyro'][:, 0]))
+        assert gyro_x['mean'] == pytest.approx(np.nanmean(records['gyro'][:, 0]))
+        rows += summary['rows']
+
+    with open(summary_path(str(tmp_path / 'r.csv'))) as f:
+        recording = json.load(f)
+    assert recording['segments'] == [os.path.basename(path) for path in writer.segments]
+    assert (recording['rows'], recording['first_packet'], recording['last_packet']) == \
+        (300, 0, 299)
+    assert rows == 300
+    assert recording['columns']['Gyroscope X (deg/s)']['count'] == 225
+    assert recording['columns']['Accelerometer Z (g)']['std'] == pytest.approx(0.0, abs=1e-9)
+    assert recording['columns'] == writer.stats.summary()
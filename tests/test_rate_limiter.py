@@ -0,0 +1,97 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the upload rate limiters with a fake clock (no real waiting)."""
+
+import pytest
+
+from upload_togoogle import AdaptiveRateLimiter, TokenBucket
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+@pytest.fixture
+def clock():
+    return FakeClock()
+
+
+def test_bucket_refills_at_its_rate(clock):
+    bucket = TokenBucket(1000, burst=500, clock=clock, sleep=clock.sleep)
+    bucket.consume(500)  # The full bucket
+    assert clock.sleeps == []
+    bucket.consume(250)
+    assert clock.sleeps == [pytest.approx(0.25)]
+
+    clock.now += 60  # Idle time refills the bucket, but only up to the burst
+    clock.sleeps.clear()
+    bucket.consume(600)
+    assert sum(clock.sleeps) == pytest.approx(0.1)
+
+    started = clock.now
+    bucket.consume(10000)
+    assert clock.now - started == pytest.approx(10.0)
+    assert max(clock.sleeps) == pytest.approx(0.5)  # Waits for a burst at a time
+
+
+def test_bucket_without_rate_never_waits(clock):
+    bucket = TokenBucket(None, clock=clock, sleep=clock.sleep)
+    bucket.consume(10 ** 9)
+    assert clock.sleeps == []
+
+
+def test_adaptive_limiter_follows_the_load_probe(clock):
+    loads = []
+    limiter = AdaptiveRateLimiter(100000, lambda: loads[-1], min_rate=10000, max_queue_depth=50,
+                                  max_lag=0.005, interval=0.5, clock=clock, sleep=clock.sleep)
+
+    def rate_after(load):
+        loads.append(load)
+        clock.now += 0.5
+        return limiter.current_rate()
+
+    assert rate_after(None) is None  # Idle recorder: unlimited
+    # Recording started: from the floor, additive increase up to max_rate
+    assert [rate_after((0, 0.0)) for _ in range(10)] == \
+        [20000, 30000, 40000, 50000, 60000, 70000, 80000, 90000, 100000, 100000]
+    assert rate_after((51, 0.0)) == 50000  # Queue backing up: halved
+    assert rate_after((0, 0.006)) == 25000  # Sampling lag: halved
+    assert [rate_after((100, 0.1)) for _ in range(3)] == [12500, 10000, 10000]
+    loads.append((100, 0.1))
+    assert limiter.current_rate() == 10000  # No change within the interval
+    assert rate_after((0, 0.0)) == 20000
+    assert rate_after(None) is None
+    assert rate_after((0, 0.0)) == 20000  # Ramps up from the floor again
+
+
+def test_adaptive_limiter_paces_only_while_recording(clock):
+    loads = [None]
+    limiter = AdaptiveRateLimiter(100000, lambda: loads[-1], min_rate=10000, burst=1000,
+                                  clock=clock, sleep=clock.sleep)
+    limiter.consume(10 ** 8)
+    assert clock.sleeps == []
+
+    loads.append((100, 1.0))  # Under pressure: held at min_rate
+    clock.now += 1
+    started = clock.now
+    limiter.consume(100000)
+    assert clock.now - started == pytest.approx((100000 - 1000) / 10000)  # After the burst
+
+
+def test_failing_probe_counts_as_no_pressure(clock):
+    def probe():
+        raise OSError('gone')
+
+    limiter = AdaptiveRateLimiter(100000, probe, min_rate=10000, clock=clock, sleep=clock.sleep)
+    clock.now += 1
+    assert limiter.current_rate() == 20000
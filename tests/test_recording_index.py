@@ -0,0 +1,89 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the sparse time index the recorder writes next to CSV recordings."""
+
+import itertools
+import shutil
+import types
+
+import numpy as np
+import pytest
+
+import recording_reader
+import recording_writer
+from channel_columns import DEFAULT_CHANNELS, csv_header
+from recording_writer import RecordingWriter, index_path
+
+HEADER = csv_header(DEFAULT_CHANNELS)
+INTERVAL = 10
+BATCH = 37  # Not a multiple of the interval, so index entries fall inside batches
+ROWS = 1000
+
+
+@pytest.fixture
+def segments(tmp_path, monkeypatch):
+    # Every clock reading advances a second: segments of four batches (148 rows), the first of three
+    clock = itertools.count()
+    monkeypatch.setattr(recording_writer, 'time',
+                        types.SimpleNamespace(monotonic=lambda: float(next(clock))))
+    writer = RecordingWriter(str(tmp_path / 'r.csv'), HEADER, segment_seconds=4,
+                             batch_size=BATCH, flush_interval=0, index_interval=INTERVAL)
+    for packet in range(ROWS):
+        missing = [None] * 3 if packet % 7 == 0 else [-packet / 100, 0.5, 9.81]
+        writer.write([packet, packet * 0.00109083, 0.0, -1.0, *missing, 1.0, 2.0, 3.0,
+                      1700000000 + packet / 100])
+    writer.start()
+    writer.close()
+    return writer.segments
+
+
+def test_index_points_at_every_interval_row_of_each_segment(segments):
+    assert len(segments) == 8
+    packets = []
+    for path in segments:
+        records = recording_reader.load(path)
+        packets.extend(records['packet'])
+        index = recording_reader.read_index(path)
+        assert np.array_equal(index['packet'], records['packet'][::INTERVAL])
+        assert np.array_equal(index['timestamp'], records['timestamp'][::INTERVAL])
+        with open(path, 'rb') as f:
+            for entry in index:
+                f.seek(int(entry['offset']))
+                assert f.readline().startswith(b'%d,' % entry['packet'])
+    assert packets == list(range(ROWS))
+
+
+def test_build_index_rebuilds_the_same_entries(segments, tmp_path):
+    for path in segments:
+        copy = str(tmp_path / 'copy.csv')
+        shutil.copyfile(path, copy)
+        recording_reader.build_index(copy, INTERVAL)
+        with open(index_path(path), 'rb') as written, open(index_path(copy), 'rb') as rebuilt:
+            assert written.read() == rebuilt.read()
+
+
+def test_read_window_matches_a_filtered_load(segments):
+    path = segments[4]
+    records = recording_reader.load(path)
+    timestamps = records['timestamp']
+    edges = [None, timestamps[0], timestamps[1], timestamps[INTERVAL], timestamps[INTERVAL + 1],
+             timestamps[55], timestamps[-1], timestamps[-1] + 1, timestamps[0] - 1]
+    for start, end in itertools.product(edges, repeat=2):
+        selected = np.ones(len(records), dtype=bool)
+        if start is not None:
+            selected &= timestamps >= start
+        if end is not None:
+            selected &= timestamps < end
+        window = recording_reader.read_window(path, start, end)
+        assert np.array_equal(window['packet'], records['packet'][selected]), (start, end)
+        assert np.array_equal(window['accel'], records['accel'][selected], equal_nan=True)
+
+
+def test_iter_window_by_packet_in_small_chunks(segments):
+    path = segments[2]
+    first = int(recording_reader.load(path)['packet'][0])
+    chunks = list(recording_reader.iter_window(path, first + 9, first + 31, key='packet',
+                                               chunk_rows=7))
+    assert max(len(chunk) for chunk in chunks) <= 7
+    assert np.concatenate(chunks)['packet'].tolist() == list(range(first + 9, first + 31))
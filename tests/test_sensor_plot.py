@@ -0,0 +1,99 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of the envelope plot's redraw budget with a fake canvas and clock (no Tk)."""
+
+import types
+
+import pytest
+
+import sensor_plot
+from sensor_plot import EnvelopePlot, SampleRingBuffer
+
+
+class FakeCanvas:
+    """Records the redrawn lines; every coords() call costs `cost` seconds."""
+
+    def __init__(self, clock):
+        self.clock = clock
+        self.cost = 0.0
+        self.items = 0
+        self.redrawn = []
+
+    def cget(self, option):
+        return {'width': 200, 'height': 300}[option]
+
+    def create_line(self, *args, **kwargs):
+        self.items += 1
+        return self.items
+
+    create_text = create_line
+
+    def coords(self, item, *coords):
+        self.redrawn.append(item)
+        self.clock.now += self.cost
+
+
+@pytest.fixture
+def plot(monkeypatch):
+    clock = types.SimpleNamespace(now=100.0)
+    monkeypatch.setattr(sensor_plot, 'time', types.SimpleNamespace(
+        monotonic=lambda: clock.now, perf_counter=lambda: clock.now))
+    ring = SampleRingBuffer()
+    for index in range(500):
+        ring.append([index, 0, -index], [0.1, 0.2, 0.3], [None, 1, 2])
+    plot = EnvelopePlot(FakeCanvas(clock), ring, {'sampler_lag': 0.0}, max_lag=0.005)
+    plot.clock = clock
+    plot.canvas.redrawn.clear()
+    return plot
+
+
+def redrawn_panes(plot, lag=0.0, after=0.1):
+    """Panes redrawn by one update `after` seconds later, in order."""
+    plot.globals['sampler_lag'] = lag
+    plot.clock.now += after
+    plot.canvas.redrawn.clear()
+    plot.update()
+    lines = plot.canvas.redrawn
+    assert len(lines) % 3 == 0
+    return [(plot._lines.index(line) // 3) for line in lines[::3]]
+
+
+def test_cheap_redraws_draw_every_pane(plot):
+    plot.canvas.cost = 0.0001
+    assert redrawn_panes(plot) == [0, 1, 2]
+    assert redrawn_panes(plot, lag=0.002) == [0, 1, 2]
+    assert plot.pane_costs == [pytest.approx(0.0003)] * 3
+
+
+def test_costly_redraws_are_split_to_fit_the_slack(plot):
+    plot.canvas.cost = 0.001  # 3 ms per pane
+    assert redrawn_panes(plot) == [0, 1, 2]  # Costs not measured yet
+    assert redrawn_panes(plot) == [0]  # 5 ms slack: one pane per update
+    assert redrawn_panes(plot) == [1]
+    assert redrawn_panes(plot) == [2]
+    assert redrawn_panes(plot, lag=0.004) == []  # 1 ms slack left: nothing fits
+    assert plot.skipped_redraws == 1
+
+    plot.canvas.cost = 0.0001  # Cheaper again: costs are re-measured as panes are drawn
+    assert redrawn_panes(plot) == [0]
+    assert redrawn_panes(plot) == [1]  # Pane 2 still costs 3 ms: 2 ms slack left
+    assert redrawn_panes(plot) == [2, 0, 1]
+    assert redrawn_panes(plot) == [2, 0, 1]
+
+
+def test_over_budget_plot_redraws_one_pane_per_max_interval(plot):
+    plot.canvas.cost = 0.003  # 9 ms per pane, more than max_lag
+    assert redrawn_panes(plot) == [0, 1, 2]
+    skipped = plot.skipped_redraws
+    assert [redrawn_panes(plot, after=0.5) for _ in range(4)] == [[], [], [], [0]]
+    assert plot.skipped_redraws == skipped + 3
+    assert redrawn_panes(plot, after=2.0) == [1]
+
+
+def test_sampler_lag_backs_off_redraws(plot):
+    assert redrawn_panes(plot) == [0, 1, 2]
+    assert redrawn_panes(plot, lag=0.01) == []
+    assert plot.redraw_interval == 0.2
+    assert redrawn_panes(plot, lag=0.01, after=0.3) == []  # Interval doubled to 0.4 s
+    assert redrawn_panes(plot, after=0.3) == [0, 1, 2]  # Recovered: interval halved
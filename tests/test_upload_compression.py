@@ -0,0 +1,56 @@
+# SPDX-FileCopyrightText: 2021 ladyada for Adafruit Industries
+# SPDX-License-Identifier: MIT
+
+"""Tests of compressed uploads against the local Drive stand-in server."""
+
+import pytest
+from google.auth.credentials import AnonymousCredentials
+
+from drive_stub_server import DriveStubServer
+from upload_togoogle import GoogleDriveUploader
+
+CONTENT = b'Packet number,Timestamp\r\n1,1700000000.000000\r\n'
+
+
+@pytest.fixture
+def server():
+    server = DriveStubServer()
+    server.start()
+    yield server
+    server.stop()
+
+
+def upload(server, path):
+    uploader = GoogleDriveUploader(credentials=AnonymousCredentials(),
+                                   discovery_url=server.discovery_url, folder_id=None,
+                                   token_cache_file=None, compression='gzip')
+    file_id = uploader.upload_file(str(path))
+    assert file_id is not None
+    return server.files[file_id]
+
+
+def test_properties_describe_the_original(server, tmp_path):
+    path = tmp_path / 'run1_part001.csv'
+    path.write_bytes(CONTENT)
+    record = upload(server, path)
+    assert record['name'] == 'run1_part001.csv.gz'
+    assert record['properties']['original_name'] == 'run1_part001.csv'
+    assert record['properties']['original_size'] == str(len(CONTENT))
+    assert record['properties']['compression'] == 'gzip'
+    assert not list(tmp_path.glob('.*.part'))  # Compressed copy removed
+
+
+def test_long_recording_names_fit_the_property_limit(server, tmp_path):
+    # Longest name recording_control accepts, plus the segment suffix
+    name = 'r' * 128 + '_part001.csv'
+    path = tmp_path / name
+    path.write_bytes(CONTENT)
+    record = upload(server, path)
+    assert record['name'] == name + '.gz'
+    assert 'original_name' not in record['properties']
+    assert record['properties']['original_size'] == str(len(CONTENT))
+
+
+def test_stub_server_rejects_oversized_properties(server):
+    assert server._metadata_error({'properties': {'key': 'v' * 121}}) is None
+    assert server._metadata_error({'properties': {'key': 'v' * 122}})